@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import StreamingResponse
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List
 
-from app.services.ai_service import process_ai_response, process_ai_response_text
+from app.schemas.ai_agent import BatchAnswers
+from app.services.ai_service import process_ai_response, process_ai_response_text, stream_ai_response_text, \
+    process_ai_response_text_batch
+from app.utils.http_client import get_http_client
 
 router = APIRouter()
 
@@ -19,11 +24,13 @@ class UserMessage(BaseModel):
 
 
 @router.post("/usermessage")
-async def store_user_messages(request: Request, input: UserMessage):
+async def store_user_messages(request: Request, input: UserMessage, http_client=Depends(get_http_client)):
     try:
         # Call the service that processes the user message and AI interaction
-        ai_response = await process_ai_response(input)
+        ai_response = await process_ai_response(input, http_client)
         return ai_response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -40,10 +47,50 @@ class UserMessageText(BaseModel):
 
 
 @router.post("/textusermessage")
-async def store_user_messages_text(request: Request, input: UserMessageText):
+async def store_user_messages_text(request: Request, input: UserMessageText,
+                                   http_client=Depends(get_http_client)):
     try:
         # Call the service that processes the text message and AI interaction
-        ai_response = await process_ai_response_text(input)
+        ai_response = await process_ai_response_text(input, http_client)
         return ai_response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+class UserMessageTextBatch(BaseModel):
+    companyId: str
+    userId: str
+    lang: str
+    questions: List[str] = Field(..., min_length=1)
+
+
+@router.post("/textusermessage/batch", response_model=BatchAnswers)
+async def store_user_messages_text_batch(request: Request, input: UserMessageTextBatch,
+                                         http_client=Depends(get_http_client)):
+    try:
+        # Answer every question, with per-question results
+        return await process_ai_response_text_batch(input, http_client)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/textusermessage/stream")
+async def stream_user_messages_text(request: Request, input: UserMessageText,
+                                    http_client=Depends(get_http_client)):
+    try:
+        # Admitted before the status line is sent, so shed requests get a 429 / 503
+        events = await stream_ai_response_text(input, http_client)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    # Relay the answer as Server-Sent Events while it is being generated
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
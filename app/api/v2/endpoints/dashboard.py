@@ -1,43 +1,60 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 from bson import ObjectId
 from pymongo import ReturnDocument
 from pymongo.errors import PyMongoError
 
+from app.core.config import settings
 from app.database import get_db_spatial_ai
 from app.models.dashboard import Settings, TableData, AIInfo, Preferences, BugReport
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
-
-from app.models.user_messages import UserMessages, convert_DB_user_message_pydantic
-from app.schemas.ai_agent import AISummary
-from app.services.ai_service import summarize_data
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Literal, Optional
+
+from app.schemas.ai_agent import AISummary, SearchResults, TopQuestions, TopQuestion, AILatency, LatencyPercentiles
+from app.services.ai_service import summarize_messages, invalidate_answer_cache
+from app.models.user_messages import match_object_id
+from app.services.company_config_service import invalidate_company_settings, get_company_config, \
+    invalidate_company_config
+from app.services.message_archive import ARCHIVE_COLLECTION, archived_messages
+from app.services.message_export import MEDIA_TYPES, export_query, resume_point, stream_export
+from app.services.message_search import search_messages
+from app.services.top_questions import TOP_QUESTIONS_COLLECTION, question_tracker
+from app.services.usage_rollups import ROLLUP_COLLECTION, read_daily_usage
+from app.utils.etag import conditional_response
+from app.utils.pagination import decode_cursor, keyset_filter, page_cursor
 from app.utils.security import validate_object_id
 
 router = APIRouter()
 
 
 @router.get("/aiSettings/{id}", response_model=Settings)
-async def get_ai_settings(id: str, db=Depends(get_db_spatial_ai)):
+async def get_ai_settings(id: str, request: Request, db=Depends(get_db_spatial_ai)):
     company_id = id
-    settings_collection = db['ai_setting']
-    settings_doc = await settings_collection.find_one({'companyId': company_id})
-
-    if not settings_doc:
-        # No settings found, create new one with default values
-        default_settings = Settings(
-            companyId=company_id,
-            chatEnabled=False,
-            creative=False,
-            unknown=False,
-            url=""
-        )
-        # Insert the new settings into the database
-        await settings_collection.insert_one(default_settings.dict(by_alias=True))
-        return default_settings
-    else:
-        # Return the existing settings
-        return Settings(**settings_doc)
+
+    async def load():
+        settings_collection = db['ai_setting']
+        settings_doc = await settings_collection.find_one({'companyId': match_object_id(company_id)})
+
+        if not settings_doc:
+            # No settings found, create new one with default values
+            default_settings = Settings(
+                companyId=company_id,
+                chatEnabled=False,
+                creative=False,
+                unknown=False,
+                url=""
+            )
+            # Insert the new settings into the database, with the id in the string form
+            # Settings documents are read back from
+            await settings_collection.insert_one({**default_settings.dict(by_alias=True), 'companyId': company_id})
+            return default_settings
+        else:
+            # Return the existing settings
+            return Settings(**settings_doc)
+
+    document = await get_company_config("settings", company_id, load)
+    return conditional_response(request, document.body, document.etag)
 
 
 # POST /aiSettings/{id}
@@ -46,49 +63,76 @@ async def update_ai_settings(id: str, new_settings: Settings, db=Depends(get_db_
     company_id = id
     settings_collection = db['ai_setting']
 
-    # Exclude 'url' and 'companyId' fields from the update
-    update_data = new_settings.model_dump(by_alias=True, exclude={'url', 'companyId'})
+    # Exclude 'url' and 'companyId' fields from the update, and fields the client did not
+    # send: their defaults would overwrite the stored values
+    update_data = new_settings.model_dump(by_alias=True, exclude={'url', 'companyId'}, exclude_unset=True)
 
     result = await settings_collection.update_one(
-        {'companyId': company_id},
+        {'companyId': match_object_id(company_id)},
         {'$set': update_data}
     )
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="No matching company ID found")
 
+    invalidate_company_settings(company_id)
+    invalidate_company_config("settings", company_id)
+    invalidate_answer_cache(company_id)
     return {"message": "Settings updated successfully"}
 
 
+# Newest changes first, _id breaking ties between equal dates
+AI_LIST_SORT = [("date", -1), ("_id", -1)]
+AI_LIST_PROJECTION = {"companyId": 1, "title": 1, "date": 1, "status": 1, "statusClass": 1, "progress": 1}
+
+
 @router.get("/getAiList/{id}", response_model=List[TableData])
-async def get_ai_list(id: str, db=Depends(get_db_spatial_ai)):
+async def get_ai_list(id: str, limit: Optional[int] = Query(None, ge=1), cursor: Optional[str] = None,
+                      status: Optional[List[str]] = Query(None), db=Depends(get_db_spatial_ai)):
+    """
+    One page of a company's changes, newest first. The body stays a plain list; the cursor
+    of the next page, if any, is returned in the ``X-Next-Cursor`` header.
+    """
     company_id = id
     table_data_collection = db['changes']
+    limit = min(limit or settings.AI_LIST_PAGE_SIZE, settings.AI_LIST_MAX_PAGE_SIZE)
+
+    query = {'companyId': company_id}
+    if status:
+        query['status'] = {'$in': status}
+    if cursor:
+        try:
+            query = {'$and': [query, keyset_filter(AI_LIST_SORT, decode_cursor(cursor))]}
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
 
     # Query the collection
-    cursor = table_data_collection.find({'companyId': company_id}, {'_id': 0})
+    documents = await table_data_collection.find(query, AI_LIST_PROJECTION).sort(AI_LIST_SORT) \
+        .limit(limit + 1).to_list(length=None)
+    documents, next_cursor = page_cursor(documents, AI_LIST_SORT, limit)
 
-    # Fetch all documents
+    # Documents were validated as TableData when stored: serialize them directly
     data = []
-    async for document in cursor:
-        data.append(TableData(**document))
-
-    # If no data found, return an empty list
-    if not data:
-        data = []
+    for document in documents:
+        del document['_id']
+        document['date'] = document['date'].isoformat()
+        data.append(document)
 
-    return data
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return JSONResponse(content=data, headers=headers)
 
 
 # GET /ai_info/{companyID}
 @router.get("/ai_info/{companyID}", response_model=AIInfo)
-async def get_ai_info(companyID: str, db=Depends(get_db_spatial_ai)):
+async def get_ai_info(companyID: str, request: Request, db=Depends(get_db_spatial_ai)):
     collection = db['Company']
-    try:
+
+    async def load():
         ai_info_doc = await collection.find_one({'companyId': companyID})
         if not ai_info_doc:
             # No document found, create a new one with default values
             ai_info = AIInfo(
+                _id=None,
                 companyId=companyID,
                 enterpriseName='',
                 website='',
@@ -101,7 +145,7 @@ async def get_ai_info(companyID: str, db=Depends(get_db_spatial_ai)):
                 documentationLinks=[],
                 referredLinks=[],
             )
-            result = await collection.insert_one(ai_info.model_dump(by_alias=True))
+            result = await collection.insert_one(ai_info.model_dump(by_alias=True, exclude={'id'}))
             ai_info.id = result.inserted_id
             return ai_info
         else:
@@ -109,8 +153,12 @@ async def get_ai_info(companyID: str, db=Depends(get_db_spatial_ai)):
             ai_info_doc["_id"] = str(ai_info_doc.get("_id"))
             ai_info = AIInfo(**ai_info_doc)
             return ai_info
+
+    try:
+        document = await get_company_config("ai_info", companyID, load)
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Unable to fetch AI info: {str(e)}")
+    return conditional_response(request, document.body, document.etag)
 
 
 # POST /ai_info/{companyID}
@@ -129,26 +177,33 @@ async def update_ai_info(companyID: str, updated_info: AIInfo, db=Depends(get_db
         else:
             existing_doc = await collection.find_one({'companyId': companyID})
             updated_info.id = existing_doc['_id']
+        invalidate_company_config("ai_info", companyID)
+        # Cached answers were generated from the previous company information
+        invalidate_answer_cache(companyID)
         return updated_info
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Failed to update AI info: {str(e)}")
 
 
 @router.get("/appearance/{company_id}", response_model=Preferences)
-async def get_ai_appearance(company_id: str, db=Depends(get_db_spatial_ai)):
-    collection = db["specialAI"]["appearance"]
+async def get_ai_appearance(company_id: str, request: Request, db=Depends(get_db_spatial_ai)):
+    collection = db["appearance"]
+
+    async def load():
+        # Find the preferences by company ID
+        prefs = await collection.find_one({"company_id": company_id})
 
-    # Find the preferences by company ID
-    prefs = await collection.find_one({"company_id": company_id})
+        if prefs is None:
+            # Default values if no document exists
+            default_prefs = Preferences(company_id=company_id)
+            # Insert default preferences
+            await collection.insert_one(default_prefs.model_dump(by_alias=True))
+            return default_prefs
 
-    if prefs is None:
-        # Default values if no document exists
-        default_prefs = Preferences(company_id=company_id)
-        # Insert default preferences
-        await collection.insert_one(default_prefs.model_dump(by_alias=True))
-        return default_prefs
+        return Preferences(**prefs)
 
-    return Preferences(**prefs)
+    document = await get_company_config("appearance", company_id, load)
+    return conditional_response(request, document.body, document.etag)
 
 
 # POST: Update AI appearance preferences
@@ -167,6 +222,7 @@ async def set_ai_appearance(company_id: str, prefs: Preferences, db=Depends(get_
     if updated_prefs is None:
         raise HTTPException(status_code=500, detail="Failed to update preferences")
 
+    invalidate_company_config("appearance", company_id)
     return {"message": "Preferences updated successfully"}
 
 
@@ -187,32 +243,124 @@ async def create_bug_report(report: BugReport, db=Depends(get_db_spatial_ai)):
 
 
 @router.get("/ai_summary/{company_id}", response_model=AISummary)
-async def get_ai_summary(company_id: str, db=Depends(get_db_spatial_ai)):
+async def get_ai_summary(company_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         limit: Optional[int] = Query(None, ge=1), cursor: Optional[str] = None,
+                         db=Depends(get_db_spatial_ai)):
     # Validate and convert company_id to ObjectId
     try:
         company_id = validate_object_id(company_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid company ID")
 
-    collection = db["UserMessage"]
-    filter_query = {"companyId": company_id}
-    user_messages_list = await collection.find(filter_query).sort("time",-1).to_list(length=None)
-
+    limit = min(limit or settings.AI_SUMMARY_PAGE_SIZE, settings.AI_SUMMARY_MAX_PAGE_SIZE)
+    try:
+        # Totals over the range, one page of details newest first
+        summary = await summarize_messages(db["UserMessage"], company_id, start, end, limit, cursor,
+                                           rollups=db[ROLLUP_COLLECTION], archive=db[ARCHIVE_COLLECTION])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    if not user_messages_list:
+    if summary is None:
         raise HTTPException(status_code=404, detail="No messages found")
+    return summary
+
+
+@router.get("/ai_latency/{company_id}", response_model=AILatency)
+async def get_ai_latency(company_id: str, start: Optional[date] = None, end: Optional[date] = None,
+                         db=Depends(get_db_spatial_ai)):
+    """
+    Processing time percentiles of a company per day and over days ``start`` to ``end``
+    (exclusive), the last 30 days by default, from the usage rollups.
+    """
+    try:
+        company_id = validate_object_id(company_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid company ID")
 
-    # Convert MongoDB documents to Pydantic models
-    user_messages_list =  convert_DB_user_message_pydantic(user_messages_list)
-    user_messages = [UserMessages(**message) for message in user_messages_list]
+    end = end or date.today() + timedelta(days=1)
+    start = start or end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
 
-    # Summarize the data
-    summary = summarize_data(user_messages)
+    total, days = await read_daily_usage(db[ROLLUP_COLLECTION], company_id, start.isoformat(), end.isoformat())
+    return AILatency(
+        overall=LatencyPercentiles(questions=total.questions, percentiles=total.percentiles()),
+        days=[LatencyPercentiles(day=day, questions=usage.questions, percentiles=usage.percentiles())
+              for day, usage in days.items()],
+    )
 
-    return summary
 
+@router.get("/ai_export/{company_id}")
+async def export_ai_messages(company_id: str, format: Literal["ndjson", "csv"] = "ndjson",
+                             start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             user_id: Optional[str] = None, after: Optional[str] = None,
+                             db=Depends(get_db_spatial_ai)):
+    """
+    Stream a company's messages, oldest first. Pass the ``id`` of the last row received as
+    ``after`` to resume an interrupted export.
+    """
+    try:
+        company_id = validate_object_id(company_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid company ID")
+
+    collection, archive = db["UserMessage"], db[ARCHIVE_COLLECTION]
+    last = None
+    if after:
+        try:
+            last = await resume_point(collection, company_id, after, archive)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    query = export_query(company_id, start, end, user_id, last)
+    archived = archived_messages(archive, company_id, start, end, user_id, last)
+    return StreamingResponse(
+        stream_export(collection, query, format, archived=archived),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="messages-{company_id}.{format}"'},
+    )
 
 
+@router.get("/ai_search/{company_id}", response_model=SearchResults)
+async def search_ai_messages(company_id: str, q: str = Query(..., min_length=1), start: Optional[datetime] = None,
+                             end: Optional[datetime] = None, lang: Optional[str] = None,
+                             limit: Optional[int] = Query(None, ge=1), cursor: Optional[str] = None,
+                             db=Depends(get_db_spatial_ai)):
+    """
+    A company's messages whose question or answer match ``q``, most relevant first.
+    ``q`` takes words, "quoted phrases" and -excluded words.
+    """
+    try:
+        company_id = validate_object_id(company_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid company ID")
+    if not q.strip() or len(q) > settings.AI_SEARCH_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid search")
+
+    limit = min(limit or settings.AI_SEARCH_PAGE_SIZE, settings.AI_SEARCH_MAX_PAGE_SIZE)
+    try:
+        results, next_cursor = await search_messages(db["UserMessage"], company_id, q, start, end, lang, limit,
+                                                     cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return SearchResults(results=results, next_cursor=next_cursor)
+
+
+@router.get("/top_questions/{company_id}", response_model=TopQuestions)
+async def get_top_questions(company_id: str, k: int = Query(10, ge=1), db=Depends(get_db_spatial_ai)):
+    """
+    A company's most frequently asked questions, from counts kept as messages are stored.
+    Counts are approximate, and may lag other workers by a checkpoint interval.
+    """
+    try:
+        company_id = validate_object_id(company_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid company ID")
+
+    sketch = await question_tracker.sketch(db[TOP_QUESTIONS_COLLECTION], company_id)
+    return TopQuestions(total=sketch.total, questions=[
+        TopQuestion(question=question, count=count, error=error) for question, count, error in sketch.top(k)
+    ])
 
 
 @router.post("/ai_agent", response_model=dict)
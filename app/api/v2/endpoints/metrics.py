@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+
+from app.core import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_model=dict)
+async def get_metrics():
+    """
+    Returns the counters, gauges and histograms of the worker that served the request
+    (cache hit rates, saved upstream calls, queue depths, per-stage latencies, ...).
+    """
+    return metrics.snapshot()
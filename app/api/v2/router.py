@@ -20,6 +20,7 @@ TAGS_MAPPING = {
     "google_drive": "Google Drive",
     "request": "Config",
     "tryOn": "fashion.ai",
+    "metrics": "Monitoring",
 }
 
 # Define the package containing all endpoint modules
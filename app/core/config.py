@@ -42,6 +42,83 @@ class Settings(BaseSettings):
     # AI_Agent
     AI_SITE: str = Field(default=os.getenv("AI_SITE", "default"))
 
+    # AI_Agent HTTP client (connection pool, timeouts in seconds, retry policy)
+    AI_HTTP_MAX_CONNECTIONS: int = Field(default=int(os.getenv("AI_HTTP_MAX_CONNECTIONS", 100)))
+    AI_HTTP_MAX_CONNECTIONS_PER_HOST: int = Field(default=int(os.getenv("AI_HTTP_MAX_CONNECTIONS_PER_HOST", 50)))
+    AI_HTTP_KEEPALIVE_SECONDS: float = Field(default=float(os.getenv("AI_HTTP_KEEPALIVE_SECONDS", 30)))
+    AI_HTTP_CONNECT_TIMEOUT: float = Field(default=float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", 5)))
+    AI_HTTP_READ_TIMEOUT: float = Field(default=float(os.getenv("AI_HTTP_READ_TIMEOUT", 60)))
+    AI_HTTP_RETRIES: int = Field(default=int(os.getenv("AI_HTTP_RETRIES", 2)))
+    AI_HTTP_RETRY_BACKOFF_SECONDS: float = Field(default=float(os.getenv("AI_HTTP_RETRY_BACKOFF_SECONDS", 0.2)))
+
+    # Admission control for AI_SITE calls, per worker
+    AI_MAX_CONCURRENT_REQUESTS: int = Field(default=int(os.getenv("AI_MAX_CONCURRENT_REQUESTS", 32)))
+    AI_MAX_QUEUED_REQUESTS: int = Field(default=int(os.getenv("AI_MAX_QUEUED_REQUESTS", 128)))
+    # Waiting calls of one company, so a single tenant's spike cannot fill the whole queue
+    AI_MAX_QUEUED_REQUESTS_PER_COMPANY: int = Field(default=int(os.getenv("AI_MAX_QUEUED_REQUESTS_PER_COMPANY", 32)))
+    AI_QUEUE_TIMEOUT_SECONDS: float = Field(default=float(os.getenv("AI_QUEUE_TIMEOUT_SECONDS", 10)))
+    AI_RETRY_AFTER_SECONDS: int = Field(default=int(os.getenv("AI_RETRY_AFTER_SECONDS", 5)))
+
+    # /getAiList: changes per page
+    AI_LIST_PAGE_SIZE: int = Field(default=int(os.getenv("AI_LIST_PAGE_SIZE", 50)))
+    AI_LIST_MAX_PAGE_SIZE: int = Field(default=int(os.getenv("AI_LIST_MAX_PAGE_SIZE", 200)))
+
+    # /ai_summary: details per page, and recent messages sampled for stage percentiles
+    AI_SUMMARY_PAGE_SIZE: int = Field(default=int(os.getenv("AI_SUMMARY_PAGE_SIZE", 50)))
+    AI_SUMMARY_MAX_PAGE_SIZE: int = Field(default=int(os.getenv("AI_SUMMARY_MAX_PAGE_SIZE", 500)))
+    AI_SUMMARY_STAGE_SAMPLE: int = Field(default=int(os.getenv("AI_SUMMARY_STAGE_SAMPLE", 1000)))
+    # Serve /ai_summary totals from the usage rollups; enable once they have been rebuilt
+    AI_SUMMARY_USE_ROLLUPS: bool = Field(default=(os.getenv("AI_SUMMARY_USE_ROLLUPS", "False") == "True"))
+
+    # /ai_search: results per page, and the longest accepted search
+    AI_SEARCH_PAGE_SIZE: int = Field(default=int(os.getenv("AI_SEARCH_PAGE_SIZE", 20)))
+    AI_SEARCH_MAX_PAGE_SIZE: int = Field(default=int(os.getenv("AI_SEARCH_MAX_PAGE_SIZE", 100)))
+    AI_SEARCH_MAX_LENGTH: int = Field(default=int(os.getenv("AI_SEARCH_MAX_LENGTH", 200)))
+
+    # /top_questions: questions tracked per company, and seconds between checkpoints to MongoDB
+    AI_TOP_QUESTIONS_CAPACITY: int = Field(default=int(os.getenv("AI_TOP_QUESTIONS_CAPACITY", 200)))
+    AI_TOP_QUESTIONS_CHECKPOINT_SECONDS: float = Field(
+        default=float(os.getenv("AI_TOP_QUESTIONS_CHECKPOINT_SECONDS", 60)))
+
+    # Batch question endpoint: questions per request and AI_SITE calls in flight per batch
+    AI_BATCH_MAX_QUESTIONS: int = Field(default=int(os.getenv("AI_BATCH_MAX_QUESTIONS", 20)))
+    AI_BATCH_MAX_CONCURRENCY: int = Field(default=int(os.getenv("AI_BATCH_MAX_CONCURRENCY", 4)))
+
+    # Circuit breaker in front of AI_SITE (error/slow-call rates over the last N calls)
+    AI_CIRCUIT_WINDOW: int = Field(default=int(os.getenv("AI_CIRCUIT_WINDOW", 20)))
+    AI_CIRCUIT_MIN_CALLS: int = Field(default=int(os.getenv("AI_CIRCUIT_MIN_CALLS", 10)))
+    AI_CIRCUIT_ERROR_RATE: float = Field(default=float(os.getenv("AI_CIRCUIT_ERROR_RATE", 0.5)))
+    AI_CIRCUIT_SLOW_CALL_SECONDS: float = Field(default=float(os.getenv("AI_CIRCUIT_SLOW_CALL_SECONDS", 30)))
+    AI_CIRCUIT_SLOW_RATE: float = Field(default=float(os.getenv("AI_CIRCUIT_SLOW_RATE", 0.5)))
+    AI_CIRCUIT_OPEN_SECONDS: float = Field(default=float(os.getenv("AI_CIRCUIT_OPEN_SECONDS", 30)))
+    # Hedged second request for text questions, fired after the recent p95 latency
+    AI_HEDGE_ENABLED: bool = Field(default=(os.getenv("AI_HEDGE_ENABLED", "False") == "True"))
+    AI_HEDGE_MIN_DELAY_SECONDS: float = Field(default=float(os.getenv("AI_HEDGE_MIN_DELAY_SECONDS", 0.05)))
+
+    # Decoded voice messages above this size are spooled to a temporary file
+    AUDIO_SPOOL_MAX_BYTES: int = Field(default=int(os.getenv("AUDIO_SPOOL_MAX_BYTES", 1024 * 1024)))
+
+    # Conversation history sent with each question (0 disables the limit)
+    AI_HISTORY_MAX_TURNS: int = Field(default=int(os.getenv("AI_HISTORY_MAX_TURNS", 20)))
+    AI_HISTORY_MAX_AGE_MINUTES: int = Field(default=int(os.getenv("AI_HISTORY_MAX_AGE_MINUTES", 0)))
+    # Per-worker cache of serialized histories (0 disables it)
+    AI_HISTORY_CACHE_MAX_BYTES: int = Field(default=int(os.getenv("AI_HISTORY_CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+    AI_HISTORY_CACHE_TTL_SECONDS: float = Field(default=float(os.getenv("AI_HISTORY_CACHE_TTL_SECONDS", 300)))
+    # Write-behind persistence of UserMessage documents (batched insert_many, off by default)
+    AI_MESSAGE_WRITE_BEHIND: bool = Field(default=(os.getenv("AI_MESSAGE_WRITE_BEHIND", "False") == "True"))
+    AI_MESSAGE_BATCH_SIZE: int = Field(default=int(os.getenv("AI_MESSAGE_BATCH_SIZE", 100)))
+    AI_MESSAGE_FLUSH_SECONDS: float = Field(default=float(os.getenv("AI_MESSAGE_FLUSH_SECONDS", 0.5)))
+    AI_MESSAGE_MAX_PENDING: int = Field(default=int(os.getenv("AI_MESSAGE_MAX_PENDING", 10000)))
+    # Turns older than this move to the UserMessageArchive buckets (0 keeps every turn in UserMessage)
+    AI_MESSAGE_RETENTION_DAYS: int = Field(default=int(os.getenv("AI_MESSAGE_RETENTION_DAYS", 0)))
+    # Per-worker answer cache for companies that enable it in their AI settings
+    AI_ANSWER_CACHE_MAX_BYTES: int = Field(default=int(os.getenv("AI_ANSWER_CACHE_MAX_BYTES", 16 * 1024 * 1024)))
+    # How long a company's AI settings are reused before being read again
+    COMPANY_SETTINGS_TTL_SECONDS: float = Field(default=float(os.getenv("COMPANY_SETTINGS_TTL_SECONDS", 30)))
+    # Per-worker cache of the company configuration documents the widget loads (0 disables it)
+    COMPANY_CONFIG_CACHE_MAX_BYTES: int = Field(default=int(os.getenv("COMPANY_CONFIG_CACHE_MAX_BYTES", 4 * 1024 * 1024)))
+    COMPANY_CONFIG_CACHE_TTL_SECONDS: float = Field(default=float(os.getenv("COMPANY_CONFIG_CACHE_TTL_SECONDS", 60)))
+
     # Logging
     LOG_LEVEL: str = Field(default=os.getenv("LOG_LEVEL", "DEBUG"))
 
@@ -0,0 +1,101 @@
+import threading
+
+# Registry of every metric created by the app, keyed by name
+registry = {}
+_lock = threading.Lock()
+
+
+class Counter:
+    """Monotonically increasing count, e.g. cache hits."""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Value that goes up and down, e.g. bytes held by a cache."""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def snapshot(self):
+        return self.value
+
+
+# Upper bounds in seconds, suited to request latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Distribution of observed values, e.g. latencies, as cumulative bucket counts."""
+
+    def __init__(self, name: str, description: str = "", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def snapshot(self):
+        buckets, cumulative = {}, 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+def _get_or_create(metric_class, name, description, **kwargs):
+    with _lock:
+        metric = registry.get(name)
+        if metric is None:
+            metric = registry[name] = metric_class(name, description, **kwargs)
+        return metric
+
+
+def counter(name: str, description: str = "") -> Counter:
+    """Return the counter registered under ``name``, creating it on first use."""
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name: str, description: str = "") -> Gauge:
+    """Return the gauge registered under ``name``, creating it on first use."""
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name: str, description: str = "", buckets=DEFAULT_BUCKETS) -> Histogram:
+    """Return the histogram registered under ``name``, creating it on first use."""
+    return _get_or_create(Histogram, name, description, buckets=buckets)
+
+
+def snapshot() -> dict:
+    """Current value of every registered metric, for this worker process."""
+    return {name: metric.snapshot() for name, metric in sorted(registry.items())}
@@ -0,0 +1,193 @@
+"""
+Indexes the endpoints rely on, declared in one place, and an audit of the query plans of
+every query shape the endpoints issue.
+
+``ensure_indexes`` runs from the app's ``lifespan``; creating an index that already exists
+is a no-op, so it is safe on every start. A new query shape goes in ``query_shapes``
+together with the index serving it in ``INDEXES``. Audit against a MongoDB server
+(``MONGODB_URL``), exiting non-zero when a shape scans its collection, with::
+
+    python -m app.indexes
+
+Listing every subscription (``/people``) reads the whole collection by design and is
+not audited.
+"""
+import asyncio
+import logging
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger("app")
+
+# Aliases of the two databases the app uses
+MAIN, SPATIAL_AI = "main", "spatial_ai"
+
+# ``options`` are passed on to ``create_index``
+IndexSpec = namedtuple("IndexSpec", ["database", "collection", "keys", "name", "options"], defaults=[None])
+
+INDEXES = [
+    # Signup, login and password reset look users up by email
+    IndexSpec(MAIN, "Registered_users", [("email", 1)], "email"),
+    # Conversation history lookups filter on the user and sort by time
+    IndexSpec(SPATIAL_AI, "UserMessage", [("companyId", 1), ("userId", 1), ("time", -1)], "companyId_userId_time"),
+    # /ai_summary and /ai_export filter a company's messages by time and page through them
+    IndexSpec(SPATIAL_AI, "UserMessage", [("companyId", 1), ("time", -1), ("_id", -1)], "companyId_time"),
+    # /ai_search: questions weigh more than answers; "none" as messages are in many languages
+    IndexSpec(SPATIAL_AI, "UserMessage", [("companyId", 1), ("messages.question", "text"), ("messages.answer", "text")],
+              "companyId_text", {"weights": {"messages.question": 3, "messages.answer": 1},
+                                 "default_language": "none"}),
+    # Usage rollups are read per company over a range of days
+    IndexSpec(SPATIAL_AI, "UserMessageRollup", [("companyId", 1), ("day", 1)], "companyId_day"),
+    # Archived turns are read per company in time order, and looked up by id to resume an export
+    IndexSpec(SPATIAL_AI, "UserMessageArchive", [("companyId", 1), ("start", 1)], "companyId_start"),
+    IndexSpec(SPATIAL_AI, "UserMessageArchive", [("companyId", 1), ("end", -1)], "companyId_end"),
+    IndexSpec(SPATIAL_AI, "UserMessageArchive", [("companyId", 1), ("turns._id", 1)], "companyId_turns_id"),
+    IndexSpec(SPATIAL_AI, "ai_setting", [("companyId", 1)], "companyId"),
+    IndexSpec(SPATIAL_AI, "Company", [("companyId", 1)], "companyId"),
+    # /deleteFile finds the company holding a documentation file
+    IndexSpec(SPATIAL_AI, "Company", [("documentationLinks.fileId", 1)], "documentationLinks_fileId"),
+    # /getAiList pages through a company's changes newest first, optionally by status
+    IndexSpec(SPATIAL_AI, "changes", [("companyId", 1), ("date", -1), ("_id", -1)], "companyId_date"),
+    IndexSpec(SPATIAL_AI, "changes", [("companyId", 1), ("status", 1), ("date", -1), ("_id", -1)],
+              "companyId_status_date"),
+    IndexSpec(SPATIAL_AI, "appearance", [("company_id", 1)], "company_id"),
+]
+
+
+def app_databases():
+    from app import database
+
+    return {MAIN: database.db, SPATIAL_AI: database.db_spatial_ai}
+
+
+async def ensure_indexes(databases=None):
+    """
+    Create the indexes of ``INDEXES``. An index that cannot be created, e.g. because one
+    with the same keys exists under another name, is logged and skipped.
+
+    :param databases: {MAIN: database, SPATIAL_AI: database}, the app's databases by default.
+    :return: Names of the indexes that could not be created, as "collection.name".
+    """
+    databases = databases or app_databases()
+    failed = []
+    for spec in INDEXES:
+        collection = databases[spec.database][spec.collection]
+        try:
+            await collection.create_index(spec.keys, name=spec.name, **(spec.options or {}))
+        except OperationFailure as e:
+            failed.append(f"{spec.collection}.{spec.name}")
+            logger.warning(f"Could not create index {spec.collection}.{spec.name}: {e}")
+    return failed
+
+
+QueryShape = namedtuple("QueryShape", ["name", "database", "collection", "filter", "sort"])
+
+
+def query_shapes():
+    """One example of every query the endpoints issue, built with the endpoints' own helpers."""
+    from app.api.v2.endpoints.dashboard import AI_LIST_SORT
+    from app.models.user_messages import match_object_id
+    from app.services.ai_service import SUMMARY_SORT, time_range_filter
+    from app.services.message_export import EXPORT_SORT
+    from app.services.message_search import search_pipeline
+
+    company_id, user_id = ObjectId(), ObjectId()
+    start, end = datetime(2024, 1, 1), datetime(2024, 2, 1)
+    company = match_object_id(company_id)
+    messages = {"companyId": company, **time_range_filter(start, end)}
+    return [
+        QueryShape("user by email", MAIN, "Registered_users", {"email": "user@example.com"}, None),
+        QueryShape("user by id", MAIN, "Registered_users", {"_id": ObjectId()}, None),
+        QueryShape("history", SPATIAL_AI, "UserMessage",
+                   {"companyId": company, "userId": match_object_id(user_id), **time_range_filter(start)},
+                   [("time", -1)]),
+        QueryShape("summary details", SPATIAL_AI, "UserMessage", {"companyId": company}, SUMMARY_SORT),
+        QueryShape("summary date range", SPATIAL_AI, "UserMessage", messages, SUMMARY_SORT),
+        QueryShape("summary stage sample", SPATIAL_AI, "UserMessage",
+                   {**messages, "stageTimes": {"$type": "object"}}, SUMMARY_SORT),
+        QueryShape("export", SPATIAL_AI, "UserMessage", messages, EXPORT_SORT),
+        QueryShape("export by user", SPATIAL_AI, "UserMessage",
+                   {**messages, "userId": match_object_id(user_id)}, EXPORT_SORT),
+        QueryShape("export resume", SPATIAL_AI, "UserMessage",
+                   {"_id": match_object_id(ObjectId()), "companyId": company}, None),
+        QueryShape("search", SPATIAL_AI, "UserMessage",
+                   search_pipeline(company_id, "refund", start, end, "EN")[0]["$match"], None),
+        QueryShape("archive cutoff", SPATIAL_AI, "UserMessage",
+                   {"companyId": company, "time": {"$lt": start.isoformat()}}, None),
+        QueryShape("archive oldest first", SPATIAL_AI, "UserMessageArchive",
+                   {"companyId": str(company_id), "end": {"$gte": start.isoformat()}}, [("start", 1), ("_id", 1)]),
+        QueryShape("archive newest first", SPATIAL_AI, "UserMessageArchive",
+                   {"companyId": str(company_id), "start": {"$lte": end.isoformat()}}, [("end", -1), ("_id", 1)]),
+        QueryShape("archive resume", SPATIAL_AI, "UserMessageArchive",
+                   {"companyId": str(company_id), "turns._id": match_object_id(ObjectId())}, None),
+        QueryShape("usage rollups", SPATIAL_AI, "UserMessageRollup",
+                   {"companyId": str(company_id), "day": {"$gte": "2024-01-01", "$lt": "2024-02-01"}}, None),
+        QueryShape("ai settings", SPATIAL_AI, "ai_setting", {"companyId": company}, None),
+        QueryShape("company info", SPATIAL_AI, "Company", {"companyId": str(company_id)}, None),
+        QueryShape("company by documentation file", SPATIAL_AI, "Company",
+                   {"documentationLinks.fileId": "file-id"}, None),
+        QueryShape("changes", SPATIAL_AI, "changes", {"companyId": str(company_id)}, AI_LIST_SORT),
+        QueryShape("changes by status", SPATIAL_AI, "changes",
+                   {"companyId": str(company_id), "status": {"$in": ["done", "pending"]}}, AI_LIST_SORT),
+        QueryShape("appearance", SPATIAL_AI, "appearance", {"company_id": str(company_id)}, None),
+    ]
+
+
+def plan_stages(plan):
+    """Every stage name in an explain plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key, value in plan.items():
+            # Slot-based engine plans repeat the query plan in another vocabulary
+            if key != "slotBasedPlan":
+                stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += plan_stages(value)
+    return stages
+
+
+async def audit_query_plans(databases=None):
+    """
+    Explain every query shape against a real server.
+
+    :return: (shape name, winning plan stages) of the shapes that scan their collection.
+    """
+    databases = databases or app_databases()
+    scans = []
+    for shape in query_shapes():
+        cursor = databases[shape.database][shape.collection].find(shape.filter)
+        if shape.sort:
+            cursor = cursor.sort(shape.sort)
+        explained = await cursor.explain()
+        stages = plan_stages(explained["queryPlanner"]["winningPlan"])
+        if "COLLSCAN" in stages:
+            scans.append((shape.name, stages))
+    return scans
+
+
+async def main():
+    from app import database
+
+    await database.init_db()
+    try:
+        failed = await ensure_indexes()
+        scans = await audit_query_plans()
+    finally:
+        await database.close_db()
+    for name in failed:
+        print(f"index not created: {name}")
+    for name, stages in scans:
+        print(f"COLLSCAN: {name} ({' <- '.join(stages)})")
+    print(f"{len(query_shapes())} query shapes audited, {len(scans)} collection scans")
+    return 1 if scans or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -6,7 +6,11 @@ from app.core.config import settings
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.database import init_db, close_db
+from app.indexes import ensure_indexes
 from app.google_drive import close_google_drive, init_google_drive
+from app.services.ai_service import close_user_message_writer
+from app.services.top_questions import close_question_tracker, init_question_tracker
+from app.utils.http_client import init_http_client, close_http_client
 import logging
 
 # Configure logging
@@ -29,7 +33,10 @@ async def lifespan(app: FastAPI):
         # Initialize resources during startup
         logger.info("Initializing resources...")
         await init_db()
+        await ensure_indexes()
+        await init_question_tracker()
         await init_google_drive()
+        await init_http_client()
         logger.info("Resources initialized successfully")
         yield
     except Exception as e:
@@ -38,6 +45,9 @@ async def lifespan(app: FastAPI):
     finally:
         # Clean up resources during shutdown
         logger.info("Shutting down resources...")
+        await close_user_message_writer()
+        await close_question_tracker()
+        await close_http_client()
         await close_google_drive()
         await close_db()
         logger.info("Resources shut down successfully")
@@ -62,6 +72,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paged endpoints return the cursor of the next page in a header
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include the API routers
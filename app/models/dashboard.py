@@ -11,6 +11,12 @@ class Settings(BaseModel):
     creative: bool = Field(..., alias='creative')
     unknown: bool = Field(..., alias='unknown')
     url: Optional[str] = Field(None, alias='url')
+    # Opt-in: answer repeated questions from a cache. Questions are then answered without
+    # the user's conversation history, so one answer is valid for every user.
+    answerCache: bool = Field(False, alias='answerCache')
+    answerCacheTtl: int = Field(3600, alias='answerCacheTtl', ge=1)  # seconds
+    # Share of the AI service this company gets relative to others while requests are queued
+    schedulerWeight: float = Field(1.0, alias='schedulerWeight', gt=0)
 
     class Config:
         allow_population_by_field_name = True
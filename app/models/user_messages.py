@@ -2,7 +2,7 @@ from datetime import datetime
 
 from bson import ObjectId
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 from app.utils.object_id_pydantic_annotation import PyObjectId
@@ -15,6 +15,7 @@ class AIResponse(BaseModel):
     process_time: Optional[float]=None
     lang: Optional[str]=None
     voice: Optional[str] = Field(alias='voice_answer', default=None)
+    cached: bool = False  # True when served from the answer cache
     model_config = ConfigDict(
         populate_by_name=True,
         arbitrary_types_allowed=True,
@@ -29,6 +30,8 @@ class UserMessages(BaseModel):
     AIResponses: AIResponse = Field(alias='messages')
     lang: Optional[str] = "EN-US"
     time: datetime
+    # Seconds spent per pipeline stage (history, upstream, ...) while answering
+    stageTimes: Optional[Dict[str, float]] = Field(default=None, alias='stageTimes')
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -41,4 +44,15 @@ def convert_DB_user_message_pydantic(user_messages_list):
         message["_id"] = str(message.get("_id"))
         message["companyId"] = str(message.get("companyId"))
         message["userId"] = str(message.get("userId"))
-    return user_messages_list
\ No newline at end of file
+    return user_messages_list
+
+
+def match_object_id(object_id):
+    """
+    Query clause matching an id stored either as an ObjectId or as its string form.
+    ``insert_user_message_async`` stores ids as strings, older documents hold ObjectIds.
+    """
+    object_id_str = str(object_id)
+    if len(object_id_str) == 24 and ObjectId.is_valid(object_id_str):
+        return {"$in": [ObjectId(object_id_str), object_id_str]}
+    return object_id_str
@@ -1,8 +1,9 @@
 from datetime import datetime
 
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 
+from app.models.user_messages import AIResponse as AIAnswer
 from app.utils.object_id_pydantic_annotation import PyObjectId
 
 
@@ -21,22 +22,85 @@ class AIResponse(BaseModel):
 
 
 
+class BatchAnswer(BaseModel):
+    index: int  # Position of the question in the batch
+    status_code: int
+    answer: Optional[AIAnswer] = None
+    detail: Optional[str] = None  # Why the question failed
+
+
+class BatchAnswers(BaseModel):
+    results: List[BatchAnswer]
+
+
 class MessageDetail(BaseModel):
     userId: str
     question: str
     answer: str
     time: datetime
 
+class SearchResult(BaseModel):
+    id: str
+    userId: str
+    lang: Optional[str] = None
+    time: datetime
+    question: Optional[str] = None
+    answer: Optional[str] = None
+    score: float  # Text relevance, higher is better
+
+
+class SearchResults(BaseModel):
+    results: List[SearchResult]
+    # Pass as ``cursor`` to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class TopQuestion(BaseModel):
+    question: str  # Normalized: lower case, no trailing punctuation
+    count: int
+    error: int  # count over-estimates how often the question was asked by at most this
+
+
+class TopQuestions(BaseModel):
+    total: int  # Questions counted
+    questions: List[TopQuestion]
+
+
+class LatencyPercentiles(BaseModel):
+    day: Optional[str] = None  # "YYYY-MM-DD"; None for the whole range
+    questions: int
+    # p50 / p90 / p95 / p99 processing time in seconds, within 2%
+    percentiles: Dict[str, float] = {}
+
+
+class AILatency(BaseModel):
+    overall: LatencyPercentiles
+    days: List[LatencyPercentiles]
+
+
 class AISummary(BaseModel):
     total_questions: int
     total_time: str
     details: List[MessageDetail]
+    # p50 / p90 / p99 seconds per pipeline stage, over the messages that recorded it
+    stage_percentiles: Dict[str, Dict[str, float]] = {}
+    # From the usage rollups, when the summary is served from them; unique_users is an
+    # estimate, within a few percent
+    unique_users: Optional[int] = None
+    process_time_percentiles: Dict[str, float] = {}
+    # Pass as ``cursor`` to get the next page of details; None on the last page
+    next_cursor: Optional[str] = None
 
     class Config:
         schema_extra = {
             "example": {
                 "total_questions": 3,
                 "total_time": "2 days, 1:30:00",
+                "next_cursor": None,
+                "stage_percentiles": {
+                    "history": {"p50": 0.004, "p90": 0.012, "p99": 0.05},
+                    "upstream": {"p50": 1.8, "p90": 3.2, "p99": 7.5}
+                },
                 "details": [
                     {
                         "userId": "507f1f77bcf86cd799439011",
@@ -1,23 +1,40 @@
-import base64
-import os
+import asyncio
+import json
+import math
 import time
+from contextlib import aclosing
 from datetime import datetime, timedelta
-from typing import List
 
+import aiohttp
 from fastapi import HTTPException
 from mongomock.object_id import ObjectId
 
 
-from app.utils.file_manger import save_audio_file
-from app.utils.http_client import send_request
+from app.utils.admission import AdmissionController
+from app.utils.cache import LRUCache
+from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.utils.file_manger import decode_audio
+from app.utils.hedging import Hedger
+from app.utils.http_client import send_request, stream_request
 from app.utils.object_id_pydantic_annotation import PyObjectId
+from app.utils.pagination import decode_cursor, keyset_filter, page_cursor
 from app.utils.security import validate_object_id
-from app.models.user_messages import UserMessages, convert_DB_user_message_pydantic
+from app.utils.single_flight import SingleFlight
+from app.utils.stage_timer import StageTimer, percentiles
+from app.utils.text import normalize_question
+from app.utils.write_behind import WriteBehindBuffer
+from app.models.user_messages import UserMessages, match_object_id
 from app.models.user_messages import AIResponse as Ai_api_answer
-from app.schemas.ai_agent import AIResponse, AISummary, MessageDetail
+from app.schemas.ai_agent import AIResponse, AISummary, MessageDetail, BatchAnswer, BatchAnswers
 from app.database import get_db_spatial_ai
+from app.services.answer_postprocessing import clean_string, get_rules
+from app.services.company_config_service import get_company_ai_settings, get_company_scheduler_weight
+from app.services.message_archive import archived_messages, archived_totals
+from app.services.top_questions import question_tracker
+from app.services.usage_rollups import ROLLUP_COLLECTION, read_usage, record_usage
 from app.core.config import settings
 
+
 def convert_objectid_to_str(data):
     """Recursively convert ObjectId instances in a dictionary to strings."""
     if isinstance(data, list):
@@ -32,30 +49,251 @@ def convert_objectid_to_str(data):
         return str(data)
 
     return data
-async def process_ai_response(input):
+
+
+# Fields of a stored UserMessage the AI service needs to follow the conversation
+HISTORY_PROJECTION = {
+    "companyId": 1,
+    "userId": 1,
+    "lang": 1,
+    "time": 1,
+    "messages.question": 1,
+    "messages.answer": 1,
+}
+
+
+# Serialized recent history per (companyId, userId), kept current by insert_user_message_async.
+# The cache is per worker: turns stored by other workers show up once the entry expires.
+history_cache = LRUCache(
+    "history_cache",
+    max_bytes=settings.AI_HISTORY_CACHE_MAX_BYTES,
+    ttl=settings.AI_HISTORY_CACHE_TTL_SECONDS,
+)
+
+
+async def get_user_messages_json(collection, company_id, user_id):
+    """
+    Load a user's recent conversation history and serialize it for the AI service.
+
+    Only the last ``AI_HISTORY_MAX_TURNS`` turns newer than ``AI_HISTORY_MAX_AGE_MINUTES``
+    are read (a value of 0 disables either limit), newest first so the
+    (companyId, userId, time) index serves the sort, then returned oldest first.
+    Results are served from ``history_cache`` when possible.
+    """
+    cache_key = (str(company_id), str(user_id))
+    cached = history_cache.get(cache_key)
+    if cached is not None:
+        return apply_history_age_window(cached)
+
+    # Taken before the query: a batch flushed meanwhile is then seen twice rather than never
+    pending = user_message_writer.pending(
+        lambda document: document["companyId"] == cache_key[0] and document["userId"] == cache_key[1]
+    )
+
+    filter_query = {"companyId": match_object_id(company_id), "userId": match_object_id(user_id)}
+    if settings.AI_HISTORY_MAX_AGE_MINUTES:
+        filter_query["time"] = {"$gte": history_age_cutoff()}
+
+    cursor = collection.find(filter_query, HISTORY_PROJECTION).sort("time", -1)
+    if settings.AI_HISTORY_MAX_TURNS:
+        cursor = cursor.limit(settings.AI_HISTORY_MAX_TURNS)
+    user_messages_list = await cursor.to_list(length=None)
+    user_messages_list.reverse()
+
+    user_messages_json = serialize_user_messages(user_messages_list)
+    if pending:
+        user_messages_json = merge_pending_messages(user_messages_json, pending)
+    history_cache.set(cache_key, user_messages_json, json_size(user_messages_json))
+    return list(user_messages_json)
+
+
+def serialize_user_messages(user_messages_list):
+    """
+    Turn stored UserMessage documents (or their ``HISTORY_PROJECTION``) into the JSON-ready
+    dicts the AI service expects, in the shape ``UserMessages.model_dump(by_alias=True)``
+    gives, without building models: ids become strings and times ISO strings.
+    """
+    return [history_message(document) for document in user_messages_list]
+
+
+def history_message(document):
+    messages = document.get("messages") or {}
+    return {
+        "_id": str(document["_id"]),
+        "companyId": str(document.get("companyId")),
+        "userId": str(document.get("userId")),
+        "messages": {
+            "answer": messages["answer"],
+            "question": messages["question"],
+            "links": messages.get("links"),
+            "process_time": messages.get("process_time"),
+            "lang": messages.get("lang"),
+            "voice_answer": messages.get("voice_answer"),
+            "cached": messages.get("cached", False),
+        },
+        "lang": document.get("lang", "EN-US"),
+        "time": iso_time(document["time"]),
+        "stageTimes": document.get("stageTimes"),
+    }
+
+
+def iso_time(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    # Times stored by insert_user_message_async are already in isoformat()
+    if len(value) in (19, 26) and value[10] == "T":
+        return value
+    return datetime.fromisoformat(value).isoformat()
+
+
+def merge_pending_messages(user_messages_json, pending):
+    """
+    Add turns still buffered by ``user_message_writer`` to a history loaded from the
+    database, so the previous question is part of the next one's history.
+    """
+    stored_ids = {message["_id"] for message in user_messages_json}
+    pending_json = serialize_user_messages([
+        project_history_fields(document) for document in pending if document["_id"] not in stored_ids
+    ])
+    merged = apply_history_age_window(sorted(user_messages_json + pending_json, key=lambda message: message["time"]))
+    if settings.AI_HISTORY_MAX_TURNS:
+        merged = merged[-settings.AI_HISTORY_MAX_TURNS:]
+    return merged
+
+
+def history_age_cutoff():
+    # Times are stored as ISO strings, which compare chronologically
+    return (datetime.now() - timedelta(minutes=settings.AI_HISTORY_MAX_AGE_MINUTES)).isoformat()
+
+
+def apply_history_age_window(user_messages_json):
+    if not settings.AI_HISTORY_MAX_AGE_MINUTES:
+        return list(user_messages_json)
+    cutoff = history_age_cutoff()
+    return [message for message in user_messages_json if message["time"] >= cutoff]
+
+
+def project_history_fields(document):
+    """Apply ``HISTORY_PROJECTION`` to a document in memory."""
+    projected = {"_id": document.get("_id")}
+    for field in HISTORY_PROJECTION:
+        parent, _, child = field.partition(".")
+        if child:
+            projected.setdefault(parent, {})[child] = document.get(parent, {}).get(child)
+        else:
+            projected[field] = document.get(field)
+    return projected
+
+
+def json_size(value):
+    return len(json.dumps(value))
+
+
+# Bounds the AI_SITE calls issued by this worker, shedding load once the queue is full
+ai_admission = AdmissionController(
+    "ai_upstream",
+    max_concurrency=settings.AI_MAX_CONCURRENT_REQUESTS,
+    max_queue=settings.AI_MAX_QUEUED_REQUESTS,
+    queue_timeout=settings.AI_QUEUE_TIMEOUT_SECONDS,
+    retry_after=settings.AI_RETRY_AFTER_SECONDS,
+    max_queue_per_tenant=settings.AI_MAX_QUEUED_REQUESTS_PER_COMPANY,
+)
+
+
+def is_local_rejection(exc):
+    # Load shed by ai_admission before AI_SITE was called
+    return isinstance(exc, HTTPException)
+
+
+def is_ai_service_failure(exc):
+    # Load shed locally and client errors say nothing about the health of AI_SITE
+    if isinstance(exc, HTTPException):
+        return False
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status >= 500
+    return True
+
+
+# Fails fast while AI_SITE is erroring or too slow, probing for recovery after a while
+ai_circuit_breaker = CircuitBreaker(
+    "ai_upstream",
+    window=settings.AI_CIRCUIT_WINDOW,
+    min_calls=settings.AI_CIRCUIT_MIN_CALLS,
+    error_rate=settings.AI_CIRCUIT_ERROR_RATE,
+    slow_call_seconds=settings.AI_CIRCUIT_SLOW_CALL_SECONDS,
+    slow_rate=settings.AI_CIRCUIT_SLOW_RATE,
+    open_seconds=settings.AI_CIRCUIT_OPEN_SECONDS,
+    is_failure=is_ai_service_failure,
+    is_neutral=is_local_rejection,
+)
+
+ai_hedger = Hedger("ai_upstream", min_delay=settings.AI_HEDGE_MIN_DELAY_SECONDS)
+
+
+async def call_ai_service(http_client, url, company_id=None, weight=1.0, hedge=False, **kwargs):
+    """
+    ``send_request`` to AI_SITE behind ``ai_circuit_breaker`` and ``ai_admission``.
+
+    :param company_id: The company asking, queued fairly against other companies.
+    :param weight: The company's ``schedulerWeight``.
+    :param hedge: Allow a hedged second request (when AI_HEDGE_ENABLED is set). Only for
+        calls that are safe to send twice, i.e. text questions.
+    :raises HTTPException: 503 with Retry-After while the circuit is open.
+    """
+    tenant = str(company_id) if company_id else None
+
+    async def attempt():
+        return await send_request(http_client, url, **kwargs)
+
+    async def call():
+        async with ai_admission.slot(tenant, weight):
+            if hedge and settings.AI_HEDGE_ENABLED:
+                # Timed and hedged once a slot is held, so queue wait does not count towards
+                # the hedge delay, and the hedge only goes out in a spare slot, never queued
+                return await ai_hedger.call(attempt, reserve=ai_admission.try_acquire,
+                                            release=ai_admission.release)
+            return await attempt()
+
+    try:
+        return await ai_circuit_breaker.call(call)
+    except CircuitOpenError as e:
+        raise ai_service_unavailable(e)
+
+
+def ai_service_unavailable(error):
+    """503 for a call failed fast by ``ai_circuit_breaker``."""
+    return HTTPException(status_code=503, detail="The AI service is unavailable, please retry later",
+                         headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+
+async def process_ai_response(input, http_client):
+    audio = None
+    timer = StageTimer("ai_stage")
     try:
         start_time = time.time()
-        audio_data = base64.b64decode(input.wavData)
-        file_path = save_audio_file(audio_data)
+        with timer.stage("decode"):
+            audio = decode_audio(input.wavData)
         company_id = validate_object_id(input.companyId)
         user_id = validate_object_id(input.userId)
 
         # Fetch user messages from the database
         db = await get_db_spatial_ai()
         collection = db["UserMessage"]
-        filter_query = {"companyId": company_id, "userId": user_id}
-        user_messages = await collection.find(filter_query).to_list(length=None)
-        user_messages = convert_DB_user_message_pydantic(user_messages)
-        user_messages = [UserMessages(**message) for message in user_messages]
-        user_messages_json = [message.model_dump(by_alias=True) for message in user_messages]
-        user_messages_json = convert_objectid_to_str(user_messages_json)
+        with timer.stage("settings"):
+            weight = await get_company_scheduler_weight(db, company_id)
+        with timer.stage("history"):
+            user_messages_json = await get_user_messages_json(collection, company_id, user_id)
         # Send audio and user messages to AI service
         url = f"{settings.AI_SITE}/process_voice/{input.companyId}"
-        ai_response_data = send_request(url, file_path=file_path, lang=input.lang, user_messages=user_messages_json)
+        with timer.stage("upstream"):
+            ai_response_data = await call_ai_service(http_client, url, company_id, weight, audio=audio,
+                                                     lang=input.lang, user_messages=user_messages_json)
 
         if ai_response_data:
-            ai_response = Ai_api_answer(**ai_response_data)
-            process_ai_response_links(ai_response, input.lang)
+            with timer.stage("convert"):
+                ai_response = Ai_api_answer(**ai_response_data)
+            with timer.stage("postprocess"):
+                process_ai_response_links(ai_response, input.lang)
 
             # Calculate processing time
             ai_response.process_time = time.time() - start_time
@@ -66,137 +304,553 @@ async def process_ai_response(input):
                 AIResponses=ai_response,
                 lang=input.lang,
                 companyId=str(company_id),
-                userId=str(user_id)
+                userId=str(user_id),
+                stageTimes=timer.stages
             )
-            await insert_user_message_async(collection, user_message)
+            with timer.stage("insert"):
+                await insert_user_message_async(collection, user_message, db[ROLLUP_COLLECTION])
             return ai_response
         else:
             raise HTTPException(status_code=500, detail="AI response is invalid")
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if os.path.exists("output.wav"):
-            os.remove("output.wav")
+        timer.observe()
+        if audio:
+            audio.close()
 
 
-async def process_ai_response_text(input):
+async def process_ai_response_text(input, http_client):
+    timer = StageTimer("ai_stage")
     try:
         start_time = time.time()
         company_id = validate_object_id(input.companyId)
         user_id = validate_object_id(input.userId)
 
-        # Fetch user messages from the database
         db = await get_db_spatial_ai()
         collection = db["UserMessage"]
-        filter_query = {"companyId": company_id, "userId": user_id}
-        user_messages_list = await collection.find(filter_query).to_list(length=None)
-        # Convert documents to Pydantic models
-        user_messages = convert_DB_user_message_pydantic(user_messages_list)
-        user_messages = [UserMessages(**message) for message in user_messages]
-
-        # Serialize models to dictionaries with correct field names
-        user_messages_json = [message.model_dump(by_alias=True) for message in user_messages]
-        user_messages_json = convert_objectid_to_str(user_messages_json)
-        payload = {
-            "user_messages": user_messages_json,
-            "lang": input.lang,
-            "question": input.question
-        }
-
-        url = f"{settings.AI_SITE}/get_answer/"
-        ai_response_data = send_request(url, payload=payload)
-
-        if ai_response_data:
-            ai_response = Ai_api_answer(**ai_response_data)
-            process_ai_response_links(ai_response, input.lang)
-
-            # Calculate processing time
-            ai_response.process_time = time.time() - start_time
-
-            # Store user message in the database
-            user_message = UserMessages(
-                time=str(datetime.now()),
-                AIResponses=ai_response,
-                lang=input.lang,
-                companyId=str(company_id),
-                userId=str(user_id)
-            )
-            await insert_user_message_async(collection, user_message)
-            return ai_response
-        else:
-            raise HTTPException(status_code=500, detail="AI response is invalid")
+        with timer.stage("settings"):
+            company_settings = await get_company_ai_settings(db, company_id)
+        # Cached answers are shared by every user, so they are built without history
+        user_messages_json = []
+        if not uses_answer_cache(company_settings):
+            # Fetch user messages from the database
+            with timer.stage("history"):
+                user_messages_json = await get_user_messages_json(collection, company_id, user_id)
+
+        ai_response = await answer_text_question(http_client, company_id, company_settings, input.lang,
+                                                 input.question, user_messages_json, timer)
+
+        # Calculate processing time
+        ai_response.process_time = time.time() - start_time
+
+        # Store user message in the database
+        user_message = UserMessages(
+            time=str(datetime.now()),
+            AIResponses=ai_response,
+            lang=input.lang,
+            companyId=str(company_id),
+            userId=str(user_id),
+            stageTimes=timer.stages
+        )
+        with timer.stage("insert"):
+            await insert_user_message_async(collection, user_message, db[ROLLUP_COLLECTION])
+        return ai_response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        timer.observe()
 
 
-def process_ai_response_links(ai_response, lang):
-    import re
-
-    # Extract and remove links from the answer
-    link_pattern = re.compile(r'[\[(](https?://[^\s]+|www\.[^\s]+)[\])]')
-    ai_response.links = link_pattern.findall(ai_response.answer)
-    ai_response.answer = link_pattern.sub('', ai_response.answer)
-
-    # Process list numbers in the answer
-    ai_response.voice = replace_list_numbers(ai_response.answer, lang)
-
-    # Clean the answer and voice text
-    ai_response.answer = clean_string(ai_response.answer)
-    ai_response.voice = clean_string(ai_response.voice)
-
-
-def replace_list_numbers(input_text, lang):
-    import re
+async def process_ai_response_text_batch(input, http_client):
+    """
+    Answer several text questions of one user.
 
-    # First stage: Replace main numbers (1., 2., etc.)
-    re_main = re.compile(r'(?m)^(\d+)\.')
-    input_text = re_main.sub(lambda m: f"numero {m.group(1)}." if lang == "IT" else f"number {m.group(1)}.", input_text)
+    Company settings and history are loaded once and shared by every question, so the
+    questions do not see each other's turns. Questions go to AI_SITE concurrently, at most
+    ``AI_BATCH_MAX_CONCURRENCY`` at a time, and the answered turns are stored with one bulk
+    write. A failing question gets its own status code and detail in the results instead
+    of failing the batch.
+    """
+    timer = StageTimer("ai_stage")
+    try:
+        start_time = time.time()
+        company_id = validate_object_id(input.companyId)
+        user_id = validate_object_id(input.userId)
+        if len(input.questions) > settings.AI_BATCH_MAX_QUESTIONS:
+            raise HTTPException(status_code=400,
+                                detail=f"At most {settings.AI_BATCH_MAX_QUESTIONS} questions per batch")
 
-    # Second stage: Replace nested numbers (1.1, 1.2, etc.)
-    re_nested = re.compile(r'(\d+(\.\d+)+)')
+        db = await get_db_spatial_ai()
+        collection = db["UserMessage"]
+        with timer.stage("settings"):
+            company_settings = await get_company_ai_settings(db, company_id)
+        user_messages_json = []
+        if not uses_answer_cache(company_settings):
+            with timer.stage("history"):
+                user_messages_json = await get_user_messages_json(collection, company_id, user_id)
+
+        semaphore = asyncio.Semaphore(settings.AI_BATCH_MAX_CONCURRENCY)
+
+        async def answer(question):
+            question_timer = StageTimer("ai_stage")
+            try:
+                async with semaphore:
+                    ai_response = await answer_text_question(http_client, company_id, company_settings, input.lang,
+                                                             question, user_messages_json, question_timer)
+            finally:
+                question_timer.observe()
+            ai_response.process_time = time.time() - start_time
+            return ai_response, {**timer.stages, **question_timer.stages}
+
+        outcomes = await asyncio.gather(*[answer(question) for question in input.questions], return_exceptions=True)
+
+        results, user_messages = [], []
+        for index, outcome in enumerate(outcomes):
+            if isinstance(outcome, HTTPException):
+                results.append(BatchAnswer(index=index, status_code=outcome.status_code, detail=outcome.detail))
+            elif isinstance(outcome, BaseException):
+                results.append(BatchAnswer(index=index, status_code=500, detail=str(outcome)))
+            else:
+                ai_response, stage_times = outcome
+                results.append(BatchAnswer(index=index, status_code=200, answer=ai_response))
+                user_messages.append(UserMessages(
+                    time=str(datetime.now()),
+                    AIResponses=ai_response,
+                    lang=input.lang,
+                    companyId=str(company_id),
+                    userId=str(user_id),
+                    stageTimes=stage_times
+                ))
+
+        with timer.stage("insert"):
+            await insert_user_messages_async(collection, user_messages, db[ROLLUP_COLLECTION])
+        return BatchAnswers(results=results)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        timer.observe()
+
+
+def uses_answer_cache(company_settings):
+    return bool(company_settings and company_settings.answerCache)
+
+
+async def answer_text_question(http_client, company_id, company_settings, lang, question, user_messages_json, timer):
+    """
+    Answer one text question from the answer cache or AI_SITE, post-processed. The caller
+    sets ``process_time`` and stores the turn.
+
+    :param company_settings: The company's ``Settings``, or None.
+    :param user_messages_json: History sent along, empty for companies using the answer cache.
+    :param timer: ``StageTimer`` recording the upstream, convert and postprocess stages.
+    :raises HTTPException: When AI_SITE gives no answer or cannot be called.
+    """
+    answer_cache_key = None
+    if uses_answer_cache(company_settings):
+        answer_cache_key = get_answer_cache_key(company_id, lang, question)
+        cached_answer = answer_cache.get(answer_cache_key)
+        if cached_answer is not None:
+            ai_response = Ai_api_answer(**cached_answer)
+            ai_response.question = question
+            ai_response.cached = True
+            return ai_response
 
-    def replace_nested(match):
-        numbers = match.group(1).split('.')
-        if lang == "IT":
-            formatted = "numero " + " punto ".join(numbers) + "."
+    payload = {
+        "user_messages": user_messages_json,
+        "lang": lang,
+        "question": question
+    }
+
+    url = f"{settings.AI_SITE}/get_answer/"
+    weight = company_settings.schedulerWeight if company_settings else 1.0
+    with timer.stage("upstream"):
+        if answer_cache_key:
+            # History-independent answers: identical questions in flight share one upstream call
+            ai_response_data = await upstream_single_flight.do(
+                answer_cache_key,
+                lambda: call_ai_service(http_client, url, company_id, weight, hedge=True, payload=payload)
+            )
         else:
-            formatted = "number " + " point ".join(numbers) + "."
-        return formatted
-
-    input_text = re_nested.sub(replace_nested, input_text)
-
-    return input_text
-
-
-def clean_string(text):
-    # Implement any cleaning logic required
-    return text.strip()
-
-
-async def insert_user_message_async(collection, user_message):
-    await collection.insert_one(convert_objectid_to_str(user_message.model_dump(by_alias=True)))
-
+            ai_response_data = await call_ai_service(http_client, url, company_id, weight, hedge=True,
+                                                     payload=payload)
+    if not ai_response_data:
+        raise HTTPException(status_code=500, detail="AI response is invalid")
+
+    with timer.stage("convert"):
+        ai_response = Ai_api_answer(**ai_response_data)
+        # A shared call answered another phrasing of the question: keep this caller's
+        ai_response.question = question
+    with timer.stage("postprocess"):
+        process_ai_response_links(ai_response, lang)
+    if answer_cache_key:
+        cached_answer = ai_response.model_dump(by_alias=True, exclude={"process_time", "cached"})
+        answer_cache.set(answer_cache_key, cached_answer, json_size(cached_answer),
+                         ttl=company_settings.answerCacheTtl)
+    return ai_response
+
+
+# Post-processed answers of companies with ``Settings.answerCache`` enabled
+answer_cache = LRUCache("answer_cache", max_bytes=settings.AI_ANSWER_CACHE_MAX_BYTES, ttl=3600)
+
+# Bumped whenever a company's AI configuration changes, orphaning its cached answers
+answer_cache_generations = {}
+
+# Identical history-independent questions waiting on the same /get_answer/ call
+upstream_single_flight = SingleFlight("ai_upstream_coalesced")
+
+
+def get_answer_cache_key(company_id, lang, question):
+    company_id = str(company_id)
+    return company_id, answer_cache_generations.get(company_id, 0), lang, normalize_question(question)
+
+
+def invalidate_answer_cache(company_id):
+    """Forget every cached answer of a company, e.g. after its AI info or settings changed."""
+    company_id = str(company_id)
+    answer_cache_generations[company_id] = answer_cache_generations.get(company_id, 0) + 1
+
+
+async def stream_ai_response_text(input, http_client):
+    """
+    Stream the answer to a text question as Server-Sent Events.
+
+    Upstream chunks from ``/stream_answer/`` are post-processed incrementally and relayed as
+    ``delta`` events (answer text, voice text and any links found so far). Once the upstream
+    stream closes the final answer is stored as a ``UserMessages`` document and sent as a
+    ``done`` event; failures are reported as an ``error`` event since the status line is
+    already sent. Bad ids, load shedding and an open circuit are raised before the stream
+    starts, so they still get a plain 400, 429 or 503.
+
+    :return: The events, to be sent once the call to AI_SITE was admitted.
+    """
+    company_id = validate_object_id(input.companyId)
+    user_id = validate_object_id(input.userId)
+    events = _stream_answer_events(input, http_client, company_id, user_id)
+    await anext(events)
+    return events
+
+
+async def _stream_answer_events(input, http_client, company_id, user_id):
+    """
+    Yields None once the call to AI_SITE holds an ``ai_admission`` slot, then the events.
+    Errors until then are raised; later ones are sent as an ``error`` event.
+    """
+    start_time = time.time()
+    timer = StageTimer("ai_stage")
+    started = admitted = False
+    try:
+        db = await get_db_spatial_ai()
+        collection = db["UserMessage"]
+        with timer.stage("settings"):
+            weight = await get_company_scheduler_weight(db, company_id)
+        with timer.stage("history"):
+            user_messages_json = await get_user_messages_json(collection, company_id, user_id)
+        payload = {
+            "user_messages": user_messages_json,
+            "lang": input.lang,
+            "question": input.question
+        }
 
-def summarize_data(messages: List[UserMessages]) -> AISummary:
-    total_questions = len(messages)
-    total_time = timedelta()
+        try:
+            ai_circuit_breaker.check()
+        except CircuitOpenError as e:
+            raise ai_service_unavailable(e)
+        await ai_admission.acquire(str(company_id), weight)
+        started = admitted = True
+        yield None
+
+        url = f"{settings.AI_SITE}/stream_answer/"
+        processor = StreamingAnswerProcessor(input.lang)
+        # Time to the last upstream chunk, including the incremental post-processing
+        with timer.stage("upstream"):
+            async with aclosing(stream_request(http_client, url, payload)) as chunks:
+                # The breaker judges how the stream starts: an error or the wait for the first
+                # chunk, not how long the whole answer takes to relay
+                with ai_circuit_breaker.guard():
+                    chunk = await anext(chunks, None)
+                while chunk is not None:
+                    delta = processor.feed(chunk)
+                    if delta:
+                        yield format_sse_event("delta", delta)
+                    chunk = await anext(chunks, None)
+        ai_admission.release()
+        admitted = False
+        delta = processor.close()
+        if delta:
+            yield format_sse_event("delta", delta)
+
+        ai_response = Ai_api_answer(
+            question=input.question,
+            answer=processor.answer,
+            voice=processor.voice,
+            links=processor.links,
+        )
+        ai_response.process_time = time.time() - start_time
+
+        user_message = UserMessages(
+            time=str(datetime.now()),
+            AIResponses=ai_response,
+            lang=input.lang,
+            companyId=str(company_id),
+            userId=str(user_id),
+            stageTimes=timer.stages
+        )
+        with timer.stage("insert"):
+            await insert_user_message_async(collection, user_message, db[ROLLUP_COLLECTION])
+        yield format_sse_event("done", ai_response.model_dump(by_alias=True))
+    except Exception as e:
+        if not started:
+            raise
+        yield format_sse_event("error", {"detail": str(e)})
+    finally:
+        if admitted:
+            ai_admission.release()
+        timer.observe()
+
+
+def format_sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamingAnswerProcessor:
+    """
+    Incremental counterpart of ``process_ai_response_links``.
+
+    Links and (nested) list numbers never contain whitespace, so text is released up to the
+    last whitespace seen and the remainder is held back until more text arrives. The
+    concatenated deltas equal the answer and voice produced by the non-streaming path.
+    """
+
+    def __init__(self, lang):
+        self.rules = get_rules(lang)
+        self.links = []
+        self._answer_parts = []
+        self._voice_parts = []
+        self._pending = ""
+        self._started = False
+
+    @property
+    def answer(self):
+        return clean_string("".join(self._answer_parts))
+
+    @property
+    def voice(self):
+        return clean_string("".join(self._voice_parts))
+
+    def feed(self, chunk):
+        self._pending += chunk
+        cut = max(self._pending.rfind(" "), self._pending.rfind("\n"), self._pending.rfind("\t"))
+        if cut <= 0:
+            return None
+        segment, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._process(segment)
+
+    def close(self):
+        segment, self._pending = self._pending, ""
+        return self._process(segment)
+
+    def _process(self, segment):
+        if not segment:
+            return None
+        # Only the first segment starts a line, later ones start with the held-back whitespace
+        processed = self.rules.process(segment, line_start=not self._answer_parts, skip=("clean",))
+        answer, voice, links = processed.answer, processed.voice, processed.links
+
+        if not self._started:
+            answer, voice = answer.lstrip(), voice.lstrip()
+            self._started = bool(answer)
+        self._answer_parts.append(answer)
+        self._voice_parts.append(voice)
+        self.links.extend(links)
+        return {"answer": answer, "voice": voice, "links": links}
 
-    results = []
-    for message in messages:
-        if message.AIResponses.process_time:
-            total_time += timedelta(seconds=message.AIResponses.process_time)
 
-        results.append(MessageDetail(
-            userId=str(message.userId),
-            question=message.AIResponses.question,
-            answer=message.AIResponses.answer,
-            time=message.time
-        ))
+def process_ai_response_links(ai_response, lang):
+    """Split links out of the answer and derive its voice version, see ``answer_postprocessing``."""
+    processed = get_rules(lang).process(ai_response.answer)
+    ai_response.links = processed.links
+    ai_response.answer = processed.answer
+    ai_response.voice = processed.voice
+
+
+async def user_messages_written(documents, rollups=None):
+    """
+    Count stored ``UserMessage`` documents: their questions in ``question_tracker`` and the
+    turns in the usage rollups.
+
+    :param rollups: The usage rollup collection to count them in, if any.
+    """
+    # O(1) per question; no read of UserMessage ever needed for /top_questions
+    for document in documents:
+        question_tracker.add(document["companyId"], (document.get("messages") or {}).get("question"))
+    if rollups is not None:
+        await record_usage(rollups, documents)
+
+
+# Batches UserMessage inserts, and the counting of the stored ones, off the request path
+# when AI_MESSAGE_WRITE_BEHIND is set
+user_message_writer = WriteBehindBuffer(
+    "user_message_writer",
+    batch_size=settings.AI_MESSAGE_BATCH_SIZE,
+    flush_interval=settings.AI_MESSAGE_FLUSH_SECONDS,
+    max_pending=settings.AI_MESSAGE_MAX_PENDING,
+    on_written=user_messages_written,
+)
+
+
+async def close_user_message_writer():
+    """Write the UserMessage documents still buffered, on shutdown."""
+    await user_message_writer.close()
+    print("User message writer flushed")
+
+
+async def insert_user_message_async(collection, user_message, rollups=None):
+    await insert_user_messages_async(collection, [user_message], rollups)
+
+
+async def insert_user_messages_async(collection, user_messages, rollups=None):
+    """
+    Store ``UserMessages`` turns with a single write and add them to cached histories. Once
+    they are stored, ``user_messages_written`` counts them.
+
+    :param rollups: The usage rollup collection to count the turns in once stored, if any.
+    """
+    documents = [convert_objectid_to_str(user_message.model_dump(by_alias=True)) for user_message in user_messages]
+    if not documents:
+        return
+    if settings.AI_MESSAGE_WRITE_BEHIND:
+        for document in documents:
+            await user_message_writer.add(collection, document, rollups)
+    elif len(documents) == 1:
+        await collection.insert_one(documents[0])
+    else:
+        await collection.insert_many(documents, ordered=False)
+
+    # Write-through: append the new turns to a cached history rather than dropping it
+    for document in documents:
+        cache_key = (document["companyId"], document["userId"])
+        cached = history_cache.peek(cache_key)
+        if cached is not None:
+            history = cached + serialize_user_messages([project_history_fields(document)])
+            if settings.AI_HISTORY_MAX_TURNS:
+                history = history[-settings.AI_HISTORY_MAX_TURNS:]
+            history_cache.replace(cache_key, history, json_size(history))
+
+    if not settings.AI_MESSAGE_WRITE_BEHIND:
+        await user_messages_written(documents, rollups)
+
+
+def time_range_filter(start=None, end=None):
+    """Query clause for messages at or after ``start`` and before ``end``, either optional."""
+    if not (start or end):
+        return {}
+    # Times are stored as ISO strings, which compare chronologically
+    time_range = {}
+    if start:
+        time_range["$gte"] = start.isoformat()
+    if end:
+        time_range["$lt"] = end.isoformat()
+    return {"time": time_range}
+
+
+# Sort of the /ai_summary details: newest first, _id breaking ties between equal times
+SUMMARY_SORT = [("time", -1), ("_id", -1)]
+# Fields of a stored UserMessage shown in a summary's details
+SUMMARY_DETAIL_PROJECTION = {"userId": 1, "time": 1, "messages.question": 1, "messages.answer": 1}
+
+
+async def summarize_messages(collection, company_id, start=None, end=None, limit=50, cursor=None,
+                             rollups=None, archive=None) -> AISummary:
+    """
+    Summarize a company's messages: totals are computed by MongoDB with one aggregation,
+    and the page of details and the stage timing sample are read with ``find``, so the
+    companyId_time index serves their sort and only ``limit + 1`` and
+    ``AI_SUMMARY_STAGE_SAMPLE`` messages are read.
+
+    With ``AI_SUMMARY_USE_ROLLUPS`` set and a range of whole days, totals, an estimate of
+    unique users and processing time percentiles are read from the usage rollups instead,
+    in O(days): no aggregation runs over the messages, which are only read for the page of
+    details and the stage sample.
+
+    :param start: Only messages at or after this time.
+    :param end: Only messages before this time.
+    :param limit: Details per page.
+    :param cursor: ``next_cursor`` of the previous page.
+    :param rollups: The usage rollup collection.
+    :param archive: The archive of old turns, counted and paged after the stored ones.
+    :raises ValueError: When ``cursor`` is invalid.
+    :return: The summary, or None when the company has no messages in the range.
+    """
+    match = {"companyId": match_object_id(company_id), **time_range_filter(start, end)}
+    page = {**match, **keyset_filter(SUMMARY_SORT, decode_cursor(cursor))} if cursor else match
+
+    usage = None
+    if rollups is not None and settings.AI_SUMMARY_USE_ROLLUPS and is_whole_day(start) and is_whole_day(end):
+        usage = await read_usage(rollups, company_id, start and start.date().isoformat(),
+                                 end and end.date().isoformat())
+        if usage is None:
+            return None
+        totals = {"total_questions": usage.questions, "total_time": usage.process_time}
+    else:
+        pipeline = [{"$match": match}, {"$group": {
+            "_id": None,
+            "total_questions": {"$sum": 1},
+            "total_time": {"$sum": {"$ifNull": ["$messages.process_time", 0]}},
+        }}]
+        result = await collection.aggregate(pipeline).to_list(length=1)
+        totals = result[0] if result else {"total_questions": 0, "total_time": 0}
+        if archive is not None:
+            archived_questions, archived_time = await archived_totals(archive, company_id, start, end)
+            totals = {"total_questions": totals["total_questions"] + archived_questions,
+                      "total_time": totals["total_time"] + archived_time}
+        if not totals["total_questions"]:
+            return None
+
+    documents = await collection.find(page, SUMMARY_DETAIL_PROJECTION).sort(SUMMARY_SORT) \
+        .limit(limit + 1).to_list(length=None)
+    if archive is not None and len(documents) <= limit:
+        # Archived turns are older than every stored one: the page continues in the archive
+        after = documents[-1] if documents else (decode_cursor(cursor) if cursor else None)
+        async with aclosing(archived_messages(archive, company_id, start, end, after=after,
+                                              descending=True)) as archived:
+            async for document in archived:
+                documents.append(document)
+                if len(documents) > limit:
+                    break
+
+    details, next_cursor = page_cursor(documents, SUMMARY_SORT, limit)
+    # Stage percentiles over the most recent messages that recorded stage timings
+    stage_times = {}
+    sample = collection.find({**match, "stageTimes": {"$type": "object"}}, {"_id": 0, "stageTimes": 1}) \
+        .sort(SUMMARY_SORT).limit(settings.AI_SUMMARY_STAGE_SAMPLE)
+    async for document in sample:
+        for stage, seconds in document["stageTimes"].items():
+            stage_times.setdefault(stage, []).append(seconds)
 
     # Return the summary using the AISummary schema
     return AISummary(
-        total_questions=total_questions,
-        total_time=str(total_time),
-        details=results
+        total_questions=totals["total_questions"],
+        total_time=str(timedelta(seconds=totals["total_time"])),
+        details=[MessageDetail(
+            userId=str(document.get("userId")),
+            question=document["messages"]["question"],
+            answer=document["messages"]["answer"],
+            time=document["time"]
+        ) for document in details],
+        stage_percentiles={stage: percentiles(values) for stage, values in stage_times.items()},
+        unique_users=usage.unique_users() if usage else None,
+        process_time_percentiles=usage.percentiles() if usage else {},
+        next_cursor=next_cursor
     )
+
+
+def is_whole_day(value):
+    return value is None or value.time() == datetime.min.time()
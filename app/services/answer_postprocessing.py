@@ -0,0 +1,174 @@
+"""
+Post-processing of AI answers: link extraction, the spoken ("voice") version of the answer
+and cleaning, driven by per-language rule tables.
+
+Rule tables are JSON files in ``answer_rules/`` named after the language code, loaded and
+compiled once on import. Adding a language means adding a file::
+
+    {
+        "number_word": "number",      # "1." at a line start is read "number 1."
+        "point_word": "point",        # "2.1" is read "number 2 point 1."
+        "voice_rewrites": {"&": "and"},
+        "steps": ["links", "voice", "clean"]
+    }
+
+``voice_rewrites`` keys are replaced literally in the voice text; they may not contain
+whitespace so streamed answers, which are processed in whitespace-delimited segments,
+give the same result. ``steps`` is optional and defaults to ``DEFAULT_STEPS``; new steps
+are added with ``register_step``. Languages without a table (and regional variants such
+as "EN-US" without their own file) fall back to their base language, then to "EN".
+"""
+import json
+import re
+from pathlib import Path
+
+RULES_DIRECTORY = Path(__file__).parent / "answer_rules"
+DEFAULT_LANG = "EN"
+DEFAULT_STEPS = ("links", "voice", "clean")
+
+LINK_PATTERN = re.compile(r'[\[(](https?://[^\s]+|www\.[^\s]+)[\])]')
+
+# A list number at a line start ("1.", possibly nested as in "1.2.3") or a nested number
+# anywhere, with the dot that may follow it. One pass gives the same text as rewriting
+# line-start list numbers first and nested numbers second. The pattern starts with a plain
+# character set so the regex engine can skip ahead to the next digit; the lookbehind then
+# checks whether that digit starts a line.
+NUMBER_PATTERN = (
+    r'[0-9](?:(?<![^\n].)([0-9]*\.)([0-9]+(?:\.[0-9]+)*\.?)?'
+    r'|([0-9]*(?:\.[0-9]+)+\.?))'
+)
+LIST_GROUP, LIST_NESTED_GROUP, NESTED_GROUP, REWRITE_GROUP = 1, 2, 3, 4
+
+
+class ProcessedAnswer:
+    """The answer being post-processed, passed through each step in turn."""
+
+    __slots__ = ("answer", "voice", "links", "line_start")
+
+    def __init__(self, answer, line_start=True):
+        self.answer = answer
+        self.voice = answer
+        self.links = []
+        # False when the text continues a line, e.g. a streamed segment after the first
+        self.line_start = line_start
+
+
+class LanguageRules:
+    """A compiled rule table."""
+
+    def __init__(self, lang, number_word, point_word, voice_rewrites=None, steps=DEFAULT_STEPS):
+        for source in voice_rewrites or {}:
+            if not source or any(char.isspace() for char in source):
+                raise ValueError(f"{lang}: voice rewrite {source!r} must be non-empty and contain no whitespace")
+        unknown = [step for step in steps if step not in STEPS]
+        if unknown:
+            raise ValueError(f"{lang}: unknown post-processing steps {unknown}")
+
+        self.lang = lang
+        self.number_word = number_word
+        self.point_word = point_word
+        self.voice_rewrites = dict(voice_rewrites or {})
+        self.steps = [(step, STEPS[step]) for step in steps]
+
+        pattern = NUMBER_PATTERN
+        if self.voice_rewrites:
+            # Longest first so overlapping sources prefer the most specific rewrite
+            sources = sorted(self.voice_rewrites, key=len, reverse=True)
+            pattern += "|(" + "|".join(map(re.escape, sources)) + ")"
+        self.voice_pattern = re.compile(pattern)
+
+    def process(self, answer, line_start=True, skip=()):
+        """
+        :param line_start: Whether ``answer`` starts at the beginning of a line.
+        :param skip: Names of steps not to run, e.g. "clean" for streamed segments.
+        """
+        text = ProcessedAnswer(answer, line_start)
+        for name, step in self.steps:
+            if name not in skip:
+                step(text, self)
+        return text
+
+    def speak_nested(self, number):
+        """"2.1" -> "number 2 point 1.", keeping a trailing dot: "2.1." -> "number 2 point 1.."."""
+        dot = "." if number.endswith(".") else ""
+        parts = number.rstrip(".").split(".")
+        return f"{self.number_word} " + f" {self.point_word} ".join(parts) + "." + dot
+
+    def rewrite_voice(self, text, line_start=True):
+        number_word = self.number_word
+        speak_nested = self.speak_nested
+
+        def replace(match):
+            # The last group that matched tells the alternatives apart
+            group = match.lastindex
+            matched = match.group()
+            if group >= NESTED_GROUP:
+                return speak_nested(matched) if group < REWRITE_GROUP else self.voice_rewrites[matched]
+            spoken = f"{number_word} {matched}" if group == LIST_GROUP else speak_nested(matched)
+            if match.start() == 0 and not line_start:
+                # Text continuing a line: "1." is not a list number, "1.2" is still read out
+                return matched if group == LIST_GROUP else spoken
+            return spoken if group == LIST_GROUP else f"{number_word} {spoken}"
+
+        return self.voice_pattern.sub(replace, text)
+
+
+def extract_links(text: ProcessedAnswer, rules: LanguageRules):
+    def remove(match):
+        text.links.append(match.group(1))
+        return ""
+
+    text.answer = text.voice = LINK_PATTERN.sub(remove, text.answer)
+
+
+def rewrite_voice(text: ProcessedAnswer, rules: LanguageRules):
+    text.voice = rules.rewrite_voice(text.voice, text.line_start)
+
+
+def clean(text: ProcessedAnswer, rules: LanguageRules):
+    text.answer = clean_string(text.answer)
+    text.voice = clean_string(text.voice)
+
+
+def clean_string(text):
+    return text.strip()
+
+
+STEPS = {
+    "links": extract_links,
+    "voice": rewrite_voice,
+    "clean": clean,
+}
+
+
+def register_step(name, step):
+    """
+    Make ``step(text: ProcessedAnswer, rules: LanguageRules)`` available to rule tables.
+    Call ``load_rules()`` afterwards for tables that list it.
+    """
+    STEPS[name] = step
+
+
+def load_rules(directory=RULES_DIRECTORY):
+    """(Re)load every rule table in ``directory``."""
+    global rules_by_lang
+    loaded = {}
+    for path in sorted(Path(directory).glob("*.json")):
+        lang = path.stem.upper()
+        with open(path, encoding="utf-8") as file:
+            loaded[lang] = LanguageRules(lang, **json.load(file))
+    if DEFAULT_LANG not in loaded:
+        raise ValueError(f"No {DEFAULT_LANG} answer rules in {directory}")
+    rules_by_lang = loaded
+
+
+def get_rules(lang) -> LanguageRules:
+    """Rule table for ``lang``, e.g. "IT", "it" or "EN-US"."""
+    code = (lang or DEFAULT_LANG).upper()
+    rules = rules_by_lang.get(code)
+    if rules is None:
+        rules = rules_by_lang.get(code.replace("_", "-").partition("-")[0], rules_by_lang[DEFAULT_LANG])
+    return rules
+
+
+load_rules()
@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.core.config import settings
+from app.models.dashboard import Settings
+from app.models.user_messages import match_object_id
+from app.utils.cache import LRUCache
+from app.utils.etag import etag_for
+
+# Company AI settings read on the question path, dropped by the dashboard when they change
+company_settings_cache = LRUCache(
+    "company_settings_cache",
+    max_bytes=1024 * 1024,
+    ttl=settings.COMPANY_SETTINGS_TTL_SECONDS,
+)
+
+# Rough per-entry footprint of a cached Settings model
+SETTINGS_ENTRY_SIZE = 512
+
+
+async def get_company_ai_settings(db, company_id):
+    """
+    Return the ``Settings`` of a company, or None when the company has none yet.
+
+    :param db: The spatial AI database.
+    :param company_id: The company id, as an ObjectId or a string.
+    """
+    cache_key = str(company_id)
+    cached = company_settings_cache.get(cache_key)
+    if cached is not None:
+        return cached or None
+
+    settings_doc = await db['ai_setting'].find_one({'companyId': match_object_id(company_id)})
+    company_settings = Settings(**settings_doc) if settings_doc else None
+    # False marks a known-missing document, None means "not cached"
+    company_settings_cache.set(cache_key, company_settings or False, SETTINGS_ENTRY_SIZE)
+    return company_settings
+
+
+async def get_company_scheduler_weight(db, company_id):
+    """The company's ``schedulerWeight``, 1 for companies without settings."""
+    company_settings = await get_company_ai_settings(db, company_id)
+    return company_settings.schedulerWeight if company_settings else 1.0
+
+
+def invalidate_company_settings(company_id):
+    company_settings_cache.invalidate(str(company_id))
+
+
+# Rendered company configuration documents served to the widget on every page load
+# (/aiSettings, /ai_info, /appearance), keyed by (kind, companyId) and dropped by the
+# matching POST handlers
+company_config_cache = LRUCache(
+    "company_config_cache",
+    max_bytes=settings.COMPANY_CONFIG_CACHE_MAX_BYTES,
+    ttl=settings.COMPANY_CONFIG_CACHE_TTL_SECONDS,
+)
+
+# JSON body of a document as its GET endpoint returns it, and the body's ETag
+CachedDocument = namedtuple("CachedDocument", ["body", "etag"])
+
+
+async def get_company_config(kind, company_id, load):
+    """
+    Read-through lookup of a company configuration document.
+
+    :param kind: Which document, e.g. "settings".
+    :param load: Coroutine function returning the document's model, called on a miss.
+    :return: A ``CachedDocument``.
+    """
+    cache_key = (kind, str(company_id))
+    cached = company_config_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Rendered like the endpoint's response model would be
+    body = JSONResponse(jsonable_encoder(await load())).body
+    document = CachedDocument(body, etag_for(body))
+    company_config_cache.set(cache_key, document, len(body))
+    return document
+
+
+def invalidate_company_config(kind, company_id):
+    company_config_cache.invalidate((kind, str(company_id)))
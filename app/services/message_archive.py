@@ -0,0 +1,245 @@
+"""
+Tiered retention of conversation turns: turns older than ``AI_MESSAGE_RETENTION_DAYS``
+move from ``UserMessage`` into ``UserMessageArchive``, which holds one compact bucket per
+company, user and day::
+
+    {
+        "_id": "<companyId>:<userId>:2024-10-01",
+        "companyId": "<companyId>", "userId": "<userId>", "day": "2024-10-01",
+        "start": "<time of the oldest turn>", "end": "<time of the newest turn>",
+        "turns": [{"_id", "time", "lang", "question", "answer", "links", "process_time"}, ...]
+    }
+
+``UserMessage`` then only holds recent turns, which keeps the history reads and the
+working set small; history sent to the AI service comes from recent turns only. The
+export and the summary read archived turns back with ``archived_messages``, and usage
+rollups are left untouched. Archived turns drop the voice answer and stage timings.
+
+Move old turns (also the migration of an existing deployment) with::
+
+    python -m app.services.message_archive [--days 90] [--company <companyId>]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from app.core.config import settings
+from app.models.user_messages import match_object_id
+
+ARCHIVE_COLLECTION = "UserMessageArchive"
+
+# Fields of a stored UserMessage kept in the archive
+ARCHIVE_PROJECTION = {
+    "companyId": 1,
+    "userId": 1,
+    "lang": 1,
+    "time": 1,
+    "messages.question": 1,
+    "messages.answer": 1,
+    "messages.links": 1,
+    "messages.process_time": 1,
+}
+
+
+def archive_turn(document):
+    messages = document.get("messages") or {}
+    time = document["time"]
+    return {
+        "_id": document["_id"],
+        "time": time.isoformat() if isinstance(time, datetime) else time,
+        "lang": document.get("lang"),
+        "question": messages.get("question"),
+        "answer": messages.get("answer"),
+        "links": messages.get("links"),
+        "process_time": messages.get("process_time"),
+    }
+
+
+def bucket_updates(documents):
+    """One upsert per (company, user, day) bucket the documents fall in."""
+    buckets = {}
+    for document in documents:
+        turn = archive_turn(document)
+        key = (str(document["companyId"]), str(document.get("userId")), turn["time"][:10])
+        buckets.setdefault(key, []).append(turn)
+
+    operations = []
+    for (company_id, user_id, day), turns in buckets.items():
+        times = [turn["time"] for turn in turns]
+        operations.append(UpdateOne({"_id": f"{company_id}:{user_id}:{day}"}, {
+            "$setOnInsert": {"companyId": company_id, "userId": user_id, "day": day},
+            "$min": {"start": min(times)},
+            "$max": {"end": max(times)},
+            # A set, so turns copied again after an interrupted run are not duplicated
+            "$addToSet": {"turns": {"$each": turns}},
+        }, upsert=True))
+    return operations
+
+
+async def archive_messages(db, older_than_days, company_id=None, batch_size=1000):
+    """
+    Move turns older than ``older_than_days`` into the archive, ``batch_size`` at a time.
+    Each batch is written to the archive before it is deleted from ``UserMessage``, so an
+    interrupted run loses nothing and can be started again.
+
+    :return: Number of turns moved.
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    messages, archive = db["UserMessage"], db[ARCHIVE_COLLECTION]
+    if company_id:
+        companies = [match_object_id(company_id)]
+    else:
+        # A query per company uses the companyId_time index; one on time alone scans every turn
+        companies = await messages.distinct("companyId")
+
+    moved = 0
+    for company in companies:
+        query = {"companyId": company, "time": {"$lt": cutoff}}
+        while True:
+            batch = await messages.find(query, ARCHIVE_PROJECTION).limit(batch_size).to_list(length=None)
+            if not batch:
+                break
+            await archive.bulk_write(bucket_updates(batch), ordered=False)
+            await messages.delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+            moved += len(batch)
+    return moved
+
+
+def archived_message(bucket, turn):
+    """An archived turn in the shape of a stored UserMessage document."""
+    return {
+        "_id": turn["_id"],
+        "companyId": bucket["companyId"],
+        "userId": bucket["userId"],
+        "lang": turn.get("lang"),
+        "time": turn["time"],
+        "messages": {
+            "question": turn.get("question"),
+            "answer": turn.get("answer"),
+            "links": turn.get("links"),
+            "process_time": turn.get("process_time"),
+        },
+    }
+
+
+def turn_order(document):
+    return document["time"], str(document["_id"])
+
+
+async def archived_messages(archive, company_id, start=None, end=None, user_id=None, after=None,
+                            descending=False):
+    """
+    Archived turns of a company as UserMessage documents, in ``(time, _id)`` order.
+
+    Buckets are read in order of their first (or, descending, last) turn and their turns
+    merged, so only the buckets overlapping in time are held in memory at once.
+
+    :param start: Only turns at or after this time.
+    :param end: Only turns before this time.
+    :param after: ``{"time", "_id"}`` of the last message already served.
+    :param descending: Newest first.
+    """
+    start = start.isoformat() if start else None
+    end = end.isoformat() if end else None
+    after = turn_order(after) if after else None
+
+    query = {"companyId": str(company_id)}
+    if user_id:
+        query["userId"] = str(user_id)
+    # Skip buckets entirely outside the range
+    if start or (after and not descending):
+        query["end"] = {"$gte": max(filter(None, [start, after and after[0]]))}
+    if end or (after and descending):
+        query["start"] = {"$lte": min(filter(None, [end, after and after[0]]))}
+
+    def wanted(document):
+        if start and document["time"] < start or end and document["time"] >= end:
+            return False
+        if after:
+            return turn_order(document) < after if descending else turn_order(document) > after
+        return True
+
+    if descending:
+        buckets = archive.find(query).sort([("end", -1), ("_id", 1)])
+    else:
+        buckets = archive.find(query).sort([("start", 1), ("_id", 1)])
+
+    pending = []
+    async for bucket in buckets:
+        # Later buckets only hold turns at or past this bucket's boundary: turns before it are final
+        boundary = bucket["end"] if descending else bucket["start"]
+        ready, pending = split_ready(pending, boundary, descending)
+        for document in ready:
+            yield document
+        pending += [document for document in (archived_message(bucket, turn) for turn in bucket["turns"])
+                    if wanted(document)]
+    for document in sorted(pending, key=turn_order, reverse=descending):
+        yield document
+
+
+def split_ready(pending, boundary, descending):
+    """Turns strictly before ``boundary`` in output order, sorted, and the others."""
+    ready, remaining = [], []
+    for document in pending:
+        before = document["time"] > boundary if descending else document["time"] < boundary
+        (ready if before else remaining).append(document)
+    return sorted(ready, key=turn_order, reverse=descending), remaining
+
+
+async def find_archived(archive, company_id, message_id):
+    """``{"time", "_id"}`` of an archived turn, or None."""
+    bucket = await archive.find_one(
+        {"companyId": str(company_id), "turns._id": match_object_id(message_id)},
+        {"turns": {"$elemMatch": {"_id": match_object_id(message_id)}}},
+    )
+    if not bucket or not bucket.get("turns"):
+        return None
+    turn = bucket["turns"][0]
+    return {"time": turn["time"], "_id": turn["_id"]}
+
+
+async def archived_totals(archive, company_id, start=None, end=None):
+    """Number of archived turns of a company in the range, and their summed processing time."""
+    buckets, turns = {"companyId": str(company_id)}, {}
+    if start:
+        turns["$gte"] = start.isoformat()
+        buckets["end"] = {"$gte": start.isoformat()}
+    if end:
+        turns["$lt"] = end.isoformat()
+        buckets["start"] = {"$lt": end.isoformat()}
+    pipeline = [{"$match": buckets}, {"$unwind": "$turns"}]
+    if turns:
+        pipeline.append({"$match": {"turns.time": turns}})
+    pipeline.append({"$group": {
+        "_id": None,
+        "total_questions": {"$sum": 1},
+        "total_time": {"$sum": {"$ifNull": ["$turns.process_time", 0]}},
+    }})
+    result = await archive.aggregate(pipeline).to_list(length=1)
+    if not result:
+        return 0, 0.0
+    return result[0]["total_questions"], result[0]["total_time"]
+
+
+async def main(days, company_id):
+    from app import database
+
+    await database.init_db()
+    try:
+        moved = await archive_messages(database.db_spatial_ai, days, company_id)
+        print(f"Archived {moved} turns older than {days} days")
+    finally:
+        await database.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old conversation turns into the archive.")
+    parser.add_argument("--days", type=int, default=settings.AI_MESSAGE_RETENTION_DAYS,
+                        help="archive turns older than this (default: AI_MESSAGE_RETENTION_DAYS)")
+    parser.add_argument("--company", help="only this company's turns")
+    args = parser.parse_args()
+    if args.days <= 0:
+        parser.error("set --days or AI_MESSAGE_RETENTION_DAYS")
+    asyncio.run(main(args.days, args.company))
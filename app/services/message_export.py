@@ -0,0 +1,117 @@
+"""
+Streaming export of a company's stored conversations as NDJSON or CSV.
+
+Messages are read from one cursor in ``(time, _id)`` order and encoded ``chunk_rows`` rows
+at a time, so memory stays constant whatever the size of the export. Archived turns
+(see ``message_archive``) come first, as they are older than every stored one. Every row
+carries the message ``id``: an interrupted export resumes by passing the last id
+received as ``after``.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from app.models.user_messages import match_object_id
+from app.services.ai_service import time_range_filter
+from app.services.message_archive import find_archived
+from app.utils.pagination import keyset_filter
+
+EXPORT_SORT = [("time", 1), ("_id", 1)]
+EXPORT_FIELDS = ("id", "time", "userId", "lang", "question", "answer", "links", "process_time")
+EXPORT_PROJECTION = {
+    "time": 1,
+    "userId": 1,
+    "lang": 1,
+    "messages.question": 1,
+    "messages.answer": 1,
+    "messages.links": 1,
+    "messages.process_time": 1,
+}
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_CHUNK_ROWS = 500
+
+
+async def resume_point(collection, company_id, after, archive=None):
+    """
+    ``{"time", "_id"}`` of the message an export resumes after.
+
+    :param after: Id of the last message already exported.
+    :raises ValueError: When ``after`` is not a message of the company.
+    """
+    last = await collection.find_one({"_id": match_object_id(after), "companyId": match_object_id(company_id)},
+                                     {"time": 1})
+    if last is None and archive is not None:
+        last = await find_archived(archive, company_id, after)
+    if last is None:
+        raise ValueError("Unknown message id")
+    return last
+
+
+def export_query(company_id, start=None, end=None, user_id=None, last=None):
+    """
+    Query selecting the stored messages to export.
+
+    :param last: ``resume_point`` of a resumed export.
+    """
+    query = {"companyId": match_object_id(company_id), **time_range_filter(start, end)}
+    if user_id:
+        query["userId"] = match_object_id(user_id)
+    if last:
+        query = {"$and": [query, keyset_filter(EXPORT_SORT, last)]}
+    return query
+
+
+def export_row(document):
+    messages = document.get("messages") or {}
+    time = document.get("time")
+    return {
+        "id": str(document["_id"]),
+        "time": time.isoformat() if isinstance(time, datetime) else time,
+        "userId": str(document.get("userId")),
+        "lang": document.get("lang"),
+        "question": messages.get("question"),
+        "answer": messages.get("answer"),
+        "links": messages.get("links") or [],
+        "process_time": messages.get("process_time"),
+    }
+
+
+def encode_ndjson(rows):
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+def encode_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        row["links"] = " ".join(row["links"])
+        writer.writerow([row[field] for field in EXPORT_FIELDS])
+    return buffer.getvalue()
+
+
+async def stream_export(collection, query, export_format, chunk_rows=EXPORT_CHUNK_ROWS, archived=None):
+    """
+    Encoded export of the messages matching ``query``, as byte chunks.
+
+    :param export_format: "ndjson" or "csv".
+    :param archived: ``archived_messages`` to export first, as they are older than stored ones.
+    """
+    encode = encode_csv if export_format == "csv" else encode_ndjson
+    if export_format == "csv":
+        yield encode_csv([], header=True).encode()
+
+    rows = []
+    cursor = collection.find(query, EXPORT_PROJECTION).sort(EXPORT_SORT).batch_size(chunk_rows)
+    for documents in (archived, cursor):
+        if documents is None:
+            continue
+        async for document in documents:
+            rows.append(export_row(document))
+            if len(rows) >= chunk_rows:
+                yield encode(rows).encode()
+                rows = []
+    if rows:
+        yield encode(rows).encode()
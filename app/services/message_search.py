@@ -0,0 +1,66 @@
+"""
+Keyword search over a company's stored conversations.
+
+Served by the ``companyId_text`` index of ``app.indexes``: a text index on the question and
+answer, prefixed by ``companyId``, so a search only reads the company's index entries. A
+text index prefix needs an equality match, so only messages stored with a string
+``companyId`` (every message written by ``insert_user_messages_async``) are searched, and
+archived turns (see ``message_archive``) are not. ``terms`` use MongoDB ``$text`` syntax:
+words, ``"quoted phrases"`` and ``-excluded`` words.
+
+Results are sorted by relevance, then newest first, and paged with keyset cursors on the
+text score.
+"""
+from app.services.ai_service import time_range_filter
+from app.utils.pagination import decode_cursor, keyset_filter, page_cursor
+
+SEARCH_SORT = [("score", -1), ("time", -1), ("_id", -1)]
+
+
+def search_pipeline(company_id, terms, start=None, end=None, lang=None, limit=20, after=None):
+    """
+    Aggregation pipeline of one page of search results, ``limit + 1`` documents.
+
+    :param after: Sort values of the last result already served.
+    :raises ValueError: When ``after`` lacks a sort field.
+    """
+    match = {"$text": {"$search": terms}, "companyId": str(company_id), **time_range_filter(start, end)}
+    if lang:
+        match["lang"] = lang
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after:
+        pipeline.append({"$match": keyset_filter(SEARCH_SORT, after)})
+    pipeline += [
+        {"$sort": dict(SEARCH_SORT)},
+        {"$limit": limit + 1},
+        {"$project": {"score": 1, "time": 1, "userId": 1, "lang": 1,
+                      "question": "$messages.question", "answer": "$messages.answer"}},
+    ]
+    return pipeline
+
+
+async def search_messages(collection, company_id, terms, start=None, end=None, lang=None, limit=20, cursor=None):
+    """
+    One page of the company's messages matching ``terms``, most relevant first.
+
+    :param cursor: ``next_cursor`` of the previous page.
+    :raises ValueError: When ``cursor`` is invalid.
+    :return: (results, cursor of the next page or None)
+    """
+    after = decode_cursor(cursor) if cursor else None
+    pipeline = search_pipeline(company_id, terms, start, end, lang, limit, after)
+    documents = await collection.aggregate(pipeline).to_list(length=None)
+    documents, next_cursor = page_cursor(documents, SEARCH_SORT, limit)
+    results = [{
+        "id": str(document["_id"]),
+        "userId": str(document.get("userId")),
+        "lang": document.get("lang"),
+        "time": document["time"],
+        "question": document.get("question"),
+        "answer": document.get("answer"),
+        "score": document["score"],
+    } for document in documents]
+    return results, next_cursor
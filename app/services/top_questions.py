@@ -0,0 +1,169 @@
+"""
+Most frequent questions per company, tracked online with a ``SpaceSaving`` sketch as
+messages are stored, so no read ever scans ``UserMessage``.
+
+Each worker counts the questions it stores in per-company sketches of the questions seen
+since its last checkpoint. Every ``AI_TOP_QUESTIONS_CHECKPOINT_SECONDS`` these are merged
+into the company's stored sketch in ``TopQuestions``, with a version check so workers
+checkpointing at once do not overwrite each other::
+
+    {
+        "_id": "<companyId>", "version": 12, "total": 5230,
+        "items": [{"question": "how do i reset my password", "count": 310, "error": 2}, ...]
+    }
+
+Reads merge the stored sketch with the worker's own pending counts. Questions are counted
+in the form ``normalize_question`` gives them, the one the answer cache is keyed on.
+"""
+import asyncio
+import logging
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from app.core import metrics
+from app.core.config import settings
+from app.utils.space_saving import SpaceSaving
+from app.utils.text import normalize_question
+
+logger = logging.getLogger("app")
+
+TOP_QUESTIONS_COLLECTION = "TopQuestions"
+
+# Questions are counted on their first characters only
+QUESTION_MAX_LENGTH = 200
+CHECKPOINT_ATTEMPTS = 5
+
+checkpoint_failures = metrics.counter("top_questions_checkpoint_failures",
+                                      "Top question checkpoints that failed and were kept for the next one")
+
+
+def load_sketch(document, capacity):
+    if not document:
+        return SpaceSaving(capacity)
+    items = [(item["question"], item["count"], item["error"]) for item in document.get("items", [])]
+    return SpaceSaving.from_items(capacity, items, document.get("total", 0))
+
+
+def dump_sketch(sketch):
+    return {
+        "total": sketch.total,
+        "items": [{"question": question, "count": count, "error": error}
+                  for question, count, error in sketch.top(sketch.capacity)],
+    }
+
+
+async def save_sketch(collection, company_id, sketch, capacity):
+    """
+    Merge ``sketch`` into the company's stored sketch.
+
+    :raises PyMongoError: When the stored sketch kept changing under concurrent checkpoints.
+    """
+    for _ in range(CHECKPOINT_ATTEMPTS):
+        stored = await collection.find_one({"_id": company_id})
+        merged = dump_sketch(SpaceSaving.merged(load_sketch(stored, capacity), sketch, capacity))
+        if stored is None:
+            try:
+                await collection.insert_one({"_id": company_id, "version": 1, **merged})
+                return
+            except DuplicateKeyError:
+                continue
+        result = await collection.replace_one({"_id": company_id, "version": stored["version"]},
+                                              {"version": stored["version"] + 1, **merged})
+        if result.matched_count:
+            return
+    raise PyMongoError(f"Top questions of {company_id} changed during {CHECKPOINT_ATTEMPTS} checkpoint attempts")
+
+
+class QuestionTracker:
+    """Per-company sketches of the questions stored since the last checkpoint."""
+
+    def __init__(self, capacity: int, checkpoint_interval: float):
+        self.capacity = capacity
+        self.checkpoint_interval = checkpoint_interval
+        self._pending = {}  # companyId -> SpaceSaving
+        self._collection = None
+        self._task = None
+
+    def add(self, company_id, question):
+        question = normalize_question(question or "")[:QUESTION_MAX_LENGTH].rstrip()
+        if not question:
+            return
+        company_id = str(company_id)
+        sketch = self._pending.get(company_id)
+        if sketch is None:
+            sketch = self._pending[company_id] = SpaceSaving(self.capacity)
+        sketch.add(question)
+
+    def start(self, collection):
+        """Checkpoint into ``collection`` periodically, on the running event loop."""
+        self._collection = collection
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._checkpoint_periodically())
+
+    async def close(self):
+        """Stop the periodic checkpoint and save the pending counts."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._collection is not None:
+            # Shielded: a cancelled shutdown still saves the counts
+            await asyncio.shield(self.checkpoint(self._collection))
+
+    async def checkpoint(self, collection):
+        unsaved, self._pending = self._pending, {}
+        try:
+            for company_id, sketch in list(unsaved.items()):
+                try:
+                    await save_sketch(collection, company_id, sketch, self.capacity)
+                except PyMongoError as e:
+                    checkpoint_failures.inc()
+                    logger.error(f"Failed to checkpoint top questions of {company_id}: {e}")
+                    continue
+                del unsaved[company_id]
+        finally:
+            # Keep the counts not saved, also when cancelled, for the next checkpoint
+            for company_id, sketch in unsaved.items():
+                current = self._pending.get(company_id)
+                self._pending[company_id] = SpaceSaving.merged(sketch, current) if current else sketch
+
+    async def sketch(self, collection, company_id):
+        """
+        Sketch of every question of a company: the stored one and this worker's pending counts.
+        ``top(k)`` gives the most frequent, as (question, count, error), where ``count``
+        over-estimates how often the question was asked by at most ``error``.
+        """
+        company_id = str(company_id)
+        sketch = load_sketch(await collection.find_one({"_id": company_id}), self.capacity)
+        pending = self._pending.get(company_id)
+        if pending is not None:
+            sketch = SpaceSaving.merged(sketch, pending, self.capacity)
+        return sketch
+
+    async def _checkpoint_periodically(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint(self._collection)
+            except Exception as e:
+                logger.error(f"Top questions checkpoint failed: {e}")
+
+
+question_tracker = QuestionTracker(
+    capacity=settings.AI_TOP_QUESTIONS_CAPACITY,
+    checkpoint_interval=settings.AI_TOP_QUESTIONS_CHECKPOINT_SECONDS,
+)
+
+
+async def init_question_tracker():
+    from app import database
+
+    question_tracker.start(database.db_spatial_ai[TOP_QUESTIONS_COLLECTION])
+
+
+async def close_question_tracker():
+    """Save the questions counted since the last checkpoint, on shutdown."""
+    await question_tracker.close()
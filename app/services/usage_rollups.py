@@ -0,0 +1,234 @@
+"""
+Per-company usage rollups: one ``UserMessageRollup`` document per company, day and
+language, kept current with ``$inc`` as messages are stored, so usage over a date range
+is read from O(days) documents instead of every message::
+
+    {
+        "_id": "<companyId>:2024-10-01:EN",
+        "companyId": "<companyId>", "day": "2024-10-01", "lang": "EN",
+        "questions": 12,
+        "processTime": 30.5,                    # seconds, summed
+        "processTimeMax": 7.1,
+        "processTimeSketch": {"27": 10, "43": 2},  # LatencySketch buckets of the processing times
+        "usersSketch": {"17": 3, "402": 1}      # HyperLogLog registers of the userIds
+    }
+
+Unique users are estimated from ``usersSketch``, within a few percent, so a rollup stays
+a few kilobytes however many users a company has.
+
+Rollups only cover messages stored since they were introduced; rebuild them from the
+stored messages with::
+
+    python -m app.services.usage_rollups [--company <companyId>]
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+from app.core import metrics
+from app.models.user_messages import match_object_id
+from app.utils.hyperloglog import HyperLogLog
+from app.utils.latency_sketch import LatencySketch
+
+logger = logging.getLogger("app")
+
+ROLLUP_COLLECTION = "UserMessageRollup"
+
+# Relative accuracy of the processing time percentiles. Stored sketches depend on it:
+# rebuild the rollups after changing it.
+PROCESS_TIME_ACCURACY = 0.02
+# Unique users are estimated within about 1.04 / sqrt(2^USERS_PRECISION), 3.3%. Stored
+# sketches depend on it too.
+USERS_PRECISION = 10
+
+# Fields of a stored UserMessage a rollup is built from
+ROLLUP_PROJECTION = {"companyId": 1, "userId": 1, "lang": 1, "time": 1, "messages.process_time": 1}
+
+rollup_failures = metrics.counter("usage_rollup_failures", "Usage rollup updates that failed")
+
+
+class Usage:
+    """Usage folded from messages, for one rollup or a whole date range."""
+
+    __slots__ = ("questions", "process_time", "process_time_max", "sketch", "users")
+
+    def __init__(self):
+        self.questions = 0
+        self.process_time = 0.0
+        self.process_time_max = None
+        self.sketch = LatencySketch(PROCESS_TIME_ACCURACY)
+        self.users = HyperLogLog(USERS_PRECISION)
+
+    def add_message(self, document):
+        self.questions += 1
+        self.users.add(str(document.get("userId")))
+        process_time = (document.get("messages") or {}).get("process_time")
+        if process_time is not None:
+            self.process_time += process_time
+            self.process_time_max = max(self.process_time_max or 0.0, process_time)
+            self.sketch.add(process_time)
+
+    def add_rollup(self, rollup):
+        self.questions += rollup.get("questions", 0)
+        self.process_time += rollup.get("processTime", 0.0)
+        if rollup.get("processTimeMax") is not None:
+            self.process_time_max = max(self.process_time_max or 0.0, rollup["processTimeMax"])
+        self.sketch.merge(rollup.get("processTimeSketch") or {})
+        self.users.merge(rollup.get("usersSketch") or {})
+
+    def unique_users(self):
+        """Estimated number of distinct users, within about 3.3%."""
+        return self.users.count()
+
+    def percentiles(self):
+        """p50 / p90 / p95 / p99 processing time, within ``PROCESS_TIME_ACCURACY``."""
+        return {name: min(value, self.process_time_max)
+                for name, value in self.sketch.percentiles().items()}
+
+
+def rollup_key(document):
+    """(companyId, day, lang) of a stored UserMessage document."""
+    time = document["time"]
+    day = time.date().isoformat() if isinstance(time, datetime) else time[:10]
+    return str(document["companyId"]), day, document.get("lang") or "EN-US"
+
+
+def fold_usage(documents, usage_by_key=None):
+    usage_by_key = {} if usage_by_key is None else usage_by_key
+    for document in documents:
+        key = rollup_key(document)
+        usage = usage_by_key.get(key)
+        if usage is None:
+            usage = usage_by_key[key] = Usage()
+        usage.add_message(document)
+    return usage_by_key
+
+
+def rollup_id(key):
+    return ":".join(key)
+
+
+async def record_usage(rollups, documents):
+    """
+    Add stored UserMessage documents to their rollups, one upsert per rollup touched.
+    A failure is logged and counted rather than raised: the messages are stored, and
+    rebuilding the rollups recovers the missing counts.
+    """
+    operations = []
+    for key, usage in fold_usage(documents).items():
+        company_id, day, lang = key
+        increments = {"questions": usage.questions, "processTime": usage.process_time}
+        for bucket, count in usage.sketch.buckets.items():
+            increments[f"processTimeSketch.{bucket}"] = count
+        maxima = {f"usersSketch.{key}": rank for key, rank in usage.users.registers.items()}
+        if usage.process_time_max is not None:
+            maxima["processTimeMax"] = usage.process_time_max
+        update = {
+            "$setOnInsert": {"companyId": company_id, "day": day, "lang": lang},
+            "$inc": increments,
+            "$max": maxima,
+        }
+        operations.append(UpdateOne({"_id": rollup_id(key)}, update, upsert=True))
+    if not operations:
+        return
+    try:
+        await rollups.bulk_write(operations, ordered=False)
+    except PyMongoError as e:
+        rollup_failures.inc()
+        logger.error(f"Failed to update usage rollups: {e}")
+
+
+def rollup_query(company_id, start_day=None, end_day=None):
+    query = {"companyId": str(company_id)}
+    if start_day or end_day:
+        query["day"] = {}
+        if start_day:
+            query["day"]["$gte"] = start_day
+        if end_day:
+            query["day"]["$lt"] = end_day
+    return query
+
+
+async def read_usage(rollups, company_id, start_day=None, end_day=None):
+    """
+    Usage of a company from its rollups, over days ``start_day`` (inclusive) to
+    ``end_day`` (exclusive), both "YYYY-MM-DD".
+
+    :return: The folded ``Usage``, or None when there is none in the range.
+    """
+    usage = Usage()
+    async for rollup in rollups.find(rollup_query(company_id, start_day, end_day)):
+        usage.add_rollup(rollup)
+    return usage if usage.questions else None
+
+
+async def read_daily_usage(rollups, company_id, start_day=None, end_day=None):
+    """
+    Like ``read_usage``, also folded per day.
+
+    :return: (``Usage`` over the range, {day: ``Usage``} in day order)
+    """
+    total, days = Usage(), {}
+    async for rollup in rollups.find(rollup_query(company_id, start_day, end_day)).sort("day", 1):
+        total.add_rollup(rollup)
+        days.setdefault(rollup["day"], Usage()).add_rollup(rollup)
+    return total, days
+
+
+async def rebuild_usage_rollups(db, company_id=None, batch_size=1000):
+    """
+    Recompute rollups from the stored messages of one company (or all), replacing the
+    existing ones. Messages stored while this runs may be counted twice or not at all, so
+    run it while traffic is quiet.
+
+    :return: Number of rollups written.
+    """
+    query = {"companyId": match_object_id(company_id)} if company_id else {}
+    usage_by_key = {}
+    batch = []
+    async for document in db["UserMessage"].find(query, ROLLUP_PROJECTION):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            fold_usage(batch, usage_by_key)
+            batch = []
+    fold_usage(batch, usage_by_key)
+
+    operations = [DeleteMany({"companyId": str(company_id)} if company_id else {})]
+    for key, usage in usage_by_key.items():
+        company, day, lang = key
+        rollup = {
+            "_id": rollup_id(key), "companyId": company, "day": day, "lang": lang,
+            "questions": usage.questions, "processTime": usage.process_time,
+            "processTimeSketch": usage.sketch.buckets, "usersSketch": usage.users.registers,
+        }
+        if usage.process_time_max is not None:
+            rollup["processTimeMax"] = usage.process_time_max
+        operations.append(ReplaceOne({"_id": rollup["_id"]}, rollup, upsert=True))
+
+    rollups = db[ROLLUP_COLLECTION]
+    for start in range(0, len(operations), batch_size):
+        # Ordered, so the delete runs before the first replacement
+        await rollups.bulk_write(operations[start:start + batch_size], ordered=True)
+    return len(usage_by_key)
+
+
+async def main(company_id):
+    from app import database
+
+    await database.init_db()
+    try:
+        count = await rebuild_usage_rollups(database.db_spatial_ai, company_id)
+        print(f"Rebuilt {count} usage rollups")
+    finally:
+        await database.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild usage rollups from stored messages.")
+    parser.add_argument("--company", help="only this company's rollups")
+    args = parser.parse_args()
+    asyncio.run(main(args.company))
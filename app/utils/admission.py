@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from app.core import metrics
+
+
+class AdmissionController:
+    """
+    Caps the number of concurrent calls to a backend, with a bounded wait queue shared
+    fairly between tenants.
+
+    Callers beyond ``max_concurrency`` wait for a free slot. Once ``max_queue`` callers are
+    waiting, or ``max_queue_per_tenant`` callers of the same tenant, new ones are shed at
+    once with a 429; a caller that waited ``queue_timeout`` seconds without getting a slot
+    gets a 503. Both carry a ``Retry-After`` header.
+
+    Waiting callers are served by weighted fair queuing: each gets a virtual finish time
+    of ``max(now, tenant's last finish) + 1 / weight`` and the smallest goes first, so a
+    tenant queueing many calls does not delay the others beyond its share, and calls of
+    one tenant stay in FIFO order. ``<name>_in_flight`` and ``<name>_queue_depth`` gauges
+    expose the current load, with per-tenant ``<name>_queue_depth{company="..."}`` gauges
+    and ``<name>_wait_seconds{company="..."}`` histograms.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float,
+                 retry_after: int, max_queue_per_tenant: int = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant or max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._active = 0
+        self._queue = []  # heap of (finish, seq, tenant, waiter); cancelled waiters are skipped
+        self._queued = 0
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._tenants = {}  # tenant -> [waiting calls, finish time of its last call]
+        self.in_flight = metrics.gauge(f"{name}_in_flight", f"{name} calls currently running")
+        self.queue_depth = metrics.gauge(f"{name}_queue_depth", f"{name} calls waiting for a slot")
+        self.rejected = metrics.counter(f"{name}_rejected", f"{name} calls shed because the queue was full")
+        self.timed_out = metrics.counter(f"{name}_queue_timeouts", f"{name} calls that waited too long for a slot")
+        self.wait_time = metrics.histogram(f"{name}_wait_seconds", f"{name} seconds spent waiting for a slot")
+
+    @asynccontextmanager
+    async def slot(self, tenant=None, weight: float = 1.0):
+        await self.acquire(tenant, weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, tenant=None, weight: float = 1.0):
+        """
+        :param tenant: Who the call is made for, e.g. a company id. Calls without a tenant
+            share one queue.
+        :param weight: The tenant's share of the slots relative to other waiting tenants.
+        """
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            self._update_gauges()
+            self._observe_wait(tenant, 0.0)
+            return
+        state = self._tenants.get(tenant)
+        if self._queued >= self.max_queue or (state and state[0] >= self.max_queue_per_tenant):
+            self.rejected.inc()
+            raise self._overloaded(429, "Too many requests waiting for the AI service")
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if state is None:
+            state = self._tenants[tenant] = [0, self._virtual_time]
+        finish = max(self._virtual_time, state[1]) + 1.0 / weight
+        state[0] += 1
+        state[1] = finish
+        waiter = loop.create_future()
+        heapq.heappush(self._queue, (finish, next(self._seq), tenant, waiter))
+        self._queued += 1
+        self._update_gauges(tenant)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # The slot was handed over just as we gave up on it, pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._dequeued(tenant)
+                self._update_gauges(tenant)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out.inc()
+                raise self._overloaded(503, "Timed out waiting for the AI service")
+            raise
+        self._observe_wait(tenant, loop.time() - start)
+
+    def try_acquire(self):
+        """Take a slot only if one is free and nobody is waiting for one, never queueing."""
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            self._update_gauges()
+            return True
+        return False
+
+    def release(self):
+        # Hand the slot straight to the waiter with the smallest finish time, if any
+        while self._queue:
+            finish, _, tenant, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                self._virtual_time = finish
+                self._dequeued(tenant)
+                waiter.set_result(None)
+                self._update_gauges(tenant)
+                return
+        self._active -= 1
+        self._update_gauges()
+
+    def _dequeued(self, tenant):
+        self._queued -= 1
+        state = self._tenants[tenant]
+        state[0] -= 1
+        if not state[0]:
+            del self._tenants[tenant]
+
+    def _overloaded(self, status_code, detail):
+        return HTTPException(status_code=status_code, detail=detail,
+                             headers={"Retry-After": str(self.retry_after)})
+
+    def _update_gauges(self, tenant=None):
+        self.in_flight.set(self._active)
+        self.queue_depth.set(self._queued)
+        if tenant is not None:
+            state = self._tenants.get(tenant)
+            metrics.gauge(f'{self.name}_queue_depth{{company="{tenant}"}}').set(state[0] if state else 0)
+
+    def _observe_wait(self, tenant, seconds):
+        self.wait_time.observe(seconds)
+        if tenant is not None:
+            metrics.histogram(f'{self.name}_wait_seconds{{company="{tenant}"}}').observe(seconds)
@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+
+from app.core import metrics
+
+
+class LRUCache:
+    """
+    In-process LRU cache with a per-entry TTL, bounded by the total size in bytes of its
+    values rather than by the number of entries.
+
+    Callers pass the size of each value when storing it. Hits, misses and evictions are
+    published as ``<name>_hits`` / ``<name>_misses`` / ``<name>_evictions`` counters, the
+    share of lookups that hit as a ``<name>_hit_rate`` gauge and the current footprint as
+    ``<name>_bytes`` / ``<name>_entries`` gauges.
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self.hits = metrics.counter(f"{name}_hits", f"{name} lookups served from memory")
+        self.misses = metrics.counter(f"{name}_misses", f"{name} lookups that were not cached or expired")
+        self.evictions = metrics.counter(f"{name}_evictions", f"{name} entries evicted to stay under max_bytes")
+        self.bytes = metrics.gauge(f"{name}_bytes", f"{name} bytes currently held")
+        self.entries = metrics.gauge(f"{name}_entries", f"{name} entries currently held")
+        self.hit_rate = metrics.gauge(f"{name}_hit_rate", f"{name} share of lookups served from memory")
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.ttl > 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[2] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses.inc()
+            self._update_hit_rate()
+            return default
+        self._entries.move_to_end(key)
+        self.hits.inc()
+        self._update_hit_rate()
+        return entry[0]
+
+    def peek(self, key, default=None):
+        """Like ``get`` but without touching the LRU order or the hit/miss counters."""
+        entry = self._entries.get(key)
+        if entry is None or entry[2] < time.monotonic():
+            return default
+        return entry[0]
+
+    def set(self, key, value, size: int, ttl: float = None):
+        if not self.enabled or size > self.max_bytes:
+            self.invalidate(key)
+            return
+        self.invalidate(key)
+        self._entries[key] = (value, size, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions.inc()
+        self._update_gauges()
+
+    def replace(self, key, value, size: int):
+        """Swap the value of a cached entry, keeping its expiry. No-op if the key is not cached."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        self.set(key, value, size, ttl=entry[2] - time.monotonic())
+
+    def invalidate(self, key):
+        if key in self._entries:
+            self._remove(key)
+            self._update_gauges()
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self._update_gauges()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _update_hit_rate(self):
+        self.hit_rate.set(self.hits.value / (self.hits.value + self.misses.value))
+
+    def _update_gauges(self):
+        self.bytes.set(self._bytes)
+        self.entries.set(len(self._entries))
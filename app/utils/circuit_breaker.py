@@ -0,0 +1,149 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from app.core import metrics
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+# Values published by the ``<name>_circuit_state`` gauge
+STATE_GAUGE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the backend while the circuit is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing backend so callers fail fast instead of waiting out timeouts.
+
+    The outcome of the last ``window`` calls is kept. Once at least ``min_calls`` were
+    seen, the circuit opens when the share of failed calls reaches ``error_rate`` or the
+    share of calls slower than ``slow_call_seconds`` reaches ``slow_rate``. After
+    ``open_seconds`` it half-opens and lets ``half_open_calls`` probes through: if they
+    all succeed the circuit closes again, any failure reopens it.
+
+    :param is_failure: Decides whether an exception counts against the backend, e.g. to
+        ignore client errors. Every exception counts by default.
+    :param is_neutral: Decides whether an exception says nothing about the backend, e.g. a
+        request rejected locally before reaching it: it counts neither as a success nor as
+        a failure. A call cancelled midway is neutral too.
+    """
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_call_seconds: float = 30.0, slow_rate: float = 0.5, open_seconds: float = 30.0,
+                 half_open_calls: int = 1, is_failure=None, is_neutral=None):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure or (lambda exc: True)
+        self.is_neutral = is_neutral or (lambda exc: False)
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # (failed, slow) per call
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self.state_gauge = metrics.gauge(f"{name}_circuit_state", f"{name} circuit: 0 closed, 1 half-open, 2 open")
+        self.rejected = metrics.counter(f"{name}_circuit_rejected", f"{name} calls failed fast by the open circuit")
+        self.opened = metrics.counter(f"{name}_circuit_opened", f"{name} times the circuit opened")
+
+    async def call(self, fn):
+        """Await ``fn()`` if the circuit allows it, recording its outcome."""
+        with self.guard():
+            return await fn()
+
+    @contextmanager
+    def guard(self):
+        """
+        Like ``call``, for work that is not one coroutine function, e.g. waiting for the
+        first chunk of a stream: the body runs if the circuit allows it, and its outcome is
+        recorded.
+
+        :raises CircuitOpenError: Instead of running the body while the circuit is open.
+        """
+        self._before_call()
+        probe = self.state == HALF_OPEN
+        start = time.monotonic()
+        recorded = False
+        try:
+            yield
+        except Exception as e:
+            if not self.is_neutral(e):
+                recorded = True
+                self._record(failed=self.is_failure(e), elapsed=time.monotonic() - start)
+            raise
+        else:
+            recorded = True
+            self._record(failed=False, elapsed=time.monotonic() - start)
+        finally:
+            # A probe that was cancelled or rejected locally lets another one through
+            if probe and not recorded and self.state == HALF_OPEN:
+                self._probes_started -= 1
+
+    def check(self):
+        """
+        Fail fast if a call would be failed fast now, without starting one, e.g. before
+        committing to a response that cannot report the error with its status.
+
+        :raises CircuitOpenError: While the circuit is open.
+        """
+        if self.state == OPEN:
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                self.rejected.inc()
+                raise CircuitOpenError(remaining)
+        elif self.state == HALF_OPEN and self._probes_started >= self.half_open_calls:
+            self.rejected.inc()
+            raise CircuitOpenError(self.open_seconds)
+
+    def _before_call(self):
+        self.check()
+        if self.state == OPEN:
+            # open_seconds have passed
+            self._set_state(HALF_OPEN)
+            self._probes_started = self._probes_succeeded = 0
+        if self.state == HALF_OPEN:
+            self._probes_started += 1
+
+    def _record(self, failed, elapsed):
+        slow = elapsed >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._trip()
+            else:
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_calls:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+            return
+        if self.state == OPEN:
+            # A call admitted before the circuit opened finished late
+            return
+
+        self._outcomes.append((failed, slow))
+        calls = len(self._outcomes)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for f, _ in self._outcomes if f)
+        slow_calls = sum(1 for _, s in self._outcomes if s)
+        if failures / calls >= self.error_rate or slow_calls / calls >= self.slow_rate:
+            self._trip()
+
+    def _trip(self):
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.opened.inc()
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_gauge.set(STATE_GAUGE_VALUES[state])
@@ -0,0 +1,35 @@
+import hashlib
+
+from fastapi import Request, Response
+
+from app.core import metrics
+
+not_modified_responses = metrics.counter("http_not_modified", "Conditional GETs answered with 304 Not Modified")
+
+
+def etag_for(body: bytes) -> str:
+    """Strong ETag of a response body; identical bodies get the same tag in every worker."""
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match lists ``etag`` (weak comparison, as for GET)."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def conditional_response(request: Request, body: bytes, etag: str, media_type="application/json") -> Response:
+    """
+    ``body`` with its ETag, or an empty 304 when the client already holds it. Clients must
+    revalidate before reusing their copy, so a change is visible on the next request.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        not_modified_responses.inc()
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
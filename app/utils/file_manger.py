@@ -1,7 +1,35 @@
-import os
+import base64
+import re
+import tempfile
 
-def save_audio_file(audio_data):
-    file_path = "output.wav"
-    with open(file_path, "wb") as f:
-        f.write(audio_data)
-    return file_path
\ No newline at end of file
+from app.core.config import settings
+
+# Base64 characters decoded per step, a multiple of 4 so each step stands on its own
+DECODE_CHUNK_SIZE = 256 * 1024
+
+WHITESPACE_PATTERN = re.compile(r'\s')
+
+
+def decode_audio(wav_data: str):
+    """
+    Decode base64 audio into a buffer private to the request.
+
+    The buffer stays in memory up to ``settings.AUDIO_SPOOL_MAX_BYTES`` and spills to an
+    anonymous temporary file above that, so nothing is shared between concurrent requests.
+    The caller must close it, e.g. by using it as a context manager.
+
+    :param wav_data: Base64 encoded audio.
+    :return: A SpooledTemporaryFile positioned at the start of the decoded audio.
+    """
+    if WHITESPACE_PATTERN.search(wav_data):
+        wav_data = WHITESPACE_PATTERN.sub('', wav_data)
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=settings.AUDIO_SPOOL_MAX_BYTES)
+    try:
+        for start in range(0, len(wav_data), DECODE_CHUNK_SIZE):
+            buffer.write(base64.b64decode(wav_data[start:start + DECODE_CHUNK_SIZE]))
+    except Exception:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,97 @@
+import asyncio
+from collections import deque
+
+from app.core import metrics
+
+
+class LatencyTracker:
+    """Latencies of the last ``window`` successful calls, for percentile estimates."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        """Return the ``q`` quantile (0..1) of the recorded latencies, or None without samples."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class Hedger:
+    """
+    Fires a second, identical call when the first one is slower than the recent p95 and
+    returns whichever finishes first successfully, cancelling the other.
+
+    Until ``min_samples`` latencies are known the call is never hedged. The delay never
+    goes below ``min_delay`` so a fast backend is not hit twice for every request.
+    Latencies are those of ``fn`` alone, so it should not include time spent waiting for
+    capacity: take that before ``call`` and reserve the second call's with ``reserve``.
+    """
+
+    def __init__(self, name: str, quantile: float = 0.95, min_delay: float = 0.05, min_samples: int = 20,
+                 window: int = 200):
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latency = LatencyTracker(window)
+        self.fired = metrics.counter(f"{name}_hedges_fired", f"{name} second requests sent")
+        self.won = metrics.counter(f"{name}_hedges_won", f"{name} second requests that answered first")
+        self.skipped = metrics.counter(f"{name}_hedges_skipped", f"{name} second requests not sent, no capacity")
+
+    def delay(self):
+        if len(self.latency) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.percentile(self.quantile))
+
+    async def call(self, fn, reserve=None, release=None):
+        """
+        :param fn: Zero-argument coroutine function performing one attempt. It must be safe
+            to run twice concurrently.
+        :param reserve: Called when the first attempt is slow; the second one is only sent
+            if it returns True, e.g. when a spare slot could be taken at once.
+        :param release: Called once a second attempt sent after ``reserve`` has ended.
+        """
+        delay = self.delay()
+        tasks = [asyncio.ensure_future(self._timed(fn))]
+        try:
+            if delay is None:
+                return await tasks[0]
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if reserve is None or reserve():
+                    self.fired.inc()
+                    tasks.append(asyncio.ensure_future(self._timed(fn)))
+                    if release is not None:
+                        # Also runs for a task cancelled before it started
+                        tasks[1].add_done_callback(lambda _: release())
+                else:
+                    self.skipped.inc()
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.won.inc()
+                        return task.result()
+            # Every attempt failed, report the first one's error
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _timed(self, fn):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await fn()
+        self.latency.observe(loop.time() - start)
+        return result
@@ -1,39 +1,130 @@
+import asyncio
+import codecs
 import json
+import logging
 
-import requests
+import aiohttp
 
-import os
+from app.core.config import settings
 
+logger = logging.getLogger("app")
 
-def send_request(url, file_path=None, lang=None, user_messages=None, payload=None):
-    if file_path:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
+# Global variable to store the shared HTTP session
+http_session = None
 
-        # Prepare multipart/form-data with file and additional fields
-        with open(file_path, 'rb') as f:
-            user_messages_str = json.dumps(user_messages) if user_messages else None
-            files = {
-                'wavData': ('output.wav', f, 'audio/wav')  # File to upload
-            }
-            data = {
-                'lang': lang,  # Form data fields
-                'user_messages': user_messages_str  # Ensure this is a string
-            }
+# Upstream statuses that are worth retrying (gateway / overload errors)
+RETRY_STATUS_CODES = {502, 503, 504}
 
-            response = requests.post(url, files=files, data=data)
-            response.raise_for_status()
-            return response.json()
 
-            response = requests.post(url, files=form_data)
-            response.raise_for_status()
-            return response.json()
+async def init_http_client():
+    """Initialize the shared, pooled HTTP session used for AI_SITE calls."""
+    global http_session
+    connector = aiohttp.TCPConnector(
+        limit=settings.AI_HTTP_MAX_CONNECTIONS,
+        limit_per_host=settings.AI_HTTP_MAX_CONNECTIONS_PER_HOST,
+        keepalive_timeout=settings.AI_HTTP_KEEPALIVE_SECONDS,
+    )
+    timeout = aiohttp.ClientTimeout(
+        connect=settings.AI_HTTP_CONNECT_TIMEOUT,
+        sock_read=settings.AI_HTTP_READ_TIMEOUT,
+    )
+    http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    print("HTTP client initialized")
+
+
+async def close_http_client():
+    """Close the shared HTTP session and its connection pool."""
+    global http_session
+    if http_session:
+        await http_session.close()
+        http_session = None
+        print("HTTP client closed")
+
+
+async def get_http_client():
+    return http_session
+
+
+# Size of the reads used to upload spooled audio
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+async def _read_chunks(file):
+    while chunk := file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
 
-    elif payload:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
 
-    else:
-        raise ValueError("Either file_path or payload must be provided")
+def _build_form_data(audio, lang, user_messages):
+    # A new FormData is needed per attempt, aiohttp consumes it on send
+    if not isinstance(audio, (bytes, bytearray)):
+        # Stream file objects from the start; handing them to aiohttp directly would close them
+        audio.seek(0)
+        audio = _read_chunks(audio)
+    user_messages_str = json.dumps(user_messages) if user_messages else None
+    form_data = aiohttp.FormData()
+    form_data.add_field('wavData', audio, filename='output.wav', content_type='audio/wav')
+    form_data.add_field('lang', lang or '')
+    if user_messages_str:
+        form_data.add_field('user_messages', user_messages_str)
+    return form_data
+
+
+async def send_request(session, url, audio=None, lang=None, user_messages=None, payload=None):
+    """
+    POST to the AI service through the shared session and return the decoded JSON body.
+
+    Connection errors, timeouts and 502/503/504 answers are retried with exponential
+    backoff, up to ``settings.AI_HTTP_RETRIES`` extra attempts.
+
+    :param session: The shared aiohttp session (see ``get_http_client``).
+    :param url: The AI_SITE endpoint to call.
+    :param audio: Audio to send as multipart/form-data, as bytes or a binary file object.
+    :param lang: Language sent alongside the audio.
+    :param user_messages: Conversation history sent alongside the audio.
+    :param payload: JSON body for text requests.
+    :return: The JSON response of the AI service.
+    """
+    if audio is None and not payload:
+        raise ValueError("Either audio or payload must be provided")
+
+    attempts = settings.AI_HTTP_RETRIES + 1
+    for attempt in range(attempts):
+        try:
+            if audio is not None:
+                request = session.post(url, data=_build_form_data(audio, lang, user_messages))
+            else:
+                request = session.post(url, json=payload)
+            async with request as response:
+                if response.status in RETRY_STATUS_CODES and attempt < attempts - 1:
+                    logger.warning(f"AI service returned {response.status}, retrying ({attempt + 1}/{attempts - 1})")
+                else:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning(f"AI service request failed: {e!r}, retrying ({attempt + 1}/{attempts - 1})")
+        await asyncio.sleep(settings.AI_HTTP_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+
+async def stream_request(session, url, payload):
+    """
+    POST a JSON payload to the AI service and yield the response body as text chunks
+    as soon as they arrive. Streams are not retried, part of the answer may already
+    have been relayed to the client.
+
+    :param session: The shared aiohttp session (see ``get_http_client``).
+    :param url: The AI_SITE streaming endpoint to call.
+    :param payload: JSON body of the request.
+    """
+    async with session.post(url, json=payload) as response:
+        response.raise_for_status()
+        # Multi-byte characters may be split across network chunks
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async for chunk in response.content.iter_any():
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
@@ -0,0 +1,68 @@
+import math
+
+# Quantiles reported by ``LatencySketch.percentiles``
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class LatencySketch:
+    """
+    Histogram of durations in logarithmic buckets, so every quantile is estimated within
+    ``relative_accuracy`` of the exact value whatever the distribution (as in DDSketch,
+    Masson, Rim and Lee, 2019).
+
+    Bucket ``i`` counts the values in (gamma^(i-1), gamma^i], gamma = (1 + a) / (1 - a):
+    the size grows with the log of the spread of the values, at most 316 buckets from a
+    millisecond to five minutes at 2%, however many values are added. Sketches merge by
+    adding bucket counts, so per-day sketches in MongoDB are updated with ``$inc`` and
+    summed on read. Bucket keys are strings, to be stored as document fields.
+    """
+
+    __slots__ = ("relative_accuracy", "gamma", "log_gamma", "min_value", "buckets")
+
+    def __init__(self, relative_accuracy: float = 0.02, min_value: float = 0.001, buckets=None):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Smaller durations are counted as ``min_value``
+        self.min_value = min_value
+        self.buckets = dict(buckets or {})  # str(index) -> count
+
+    def __len__(self):
+        return len(self.buckets)
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    def key(self, value):
+        return str(math.ceil(math.log(max(value, self.min_value)) / self.log_gamma))
+
+    def add(self, value, count: int = 1):
+        key = self.key(value)
+        self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, buckets):
+        """Add another sketch's bucket counts, e.g. a stored document's."""
+        for key, count in buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def quantile(self, q: float):
+        """
+        Estimate of the value of rank ``int(q * count)`` in sorted order, as
+        ``app.utils.stage_timer.percentiles`` takes it, or None when empty.
+        """
+        total = self.count
+        if not total:
+            return None
+        rank, seen = min(total - 1, int(q * total)), 0
+        for index in sorted(int(key) for key in self.buckets):
+            seen += self.buckets[str(index)]
+            if seen > rank:
+                # Middle of the bucket in relative terms: within relative_accuracy of any value in it
+                return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def percentiles(self, quantiles=PERCENTILES):
+        """``{"p50": ..., "p90": ..., "p95": ..., "p99": ...}``, or {} when empty."""
+        if not self.buckets:
+            return {}
+        return {f"p{round(q * 100)}": self.quantile(q) for q in quantiles}
@@ -0,0 +1,54 @@
+import base64
+import binascii
+
+from bson import json_util
+
+
+def encode_cursor(values: dict) -> str:
+    """
+    Opaque page cursor holding the sort key values of the last document served.
+    ObjectIds and dates keep their type, so the next query compares like with like.
+    """
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """:raises ValueError: When ``cursor`` was not made by ``encode_cursor``."""
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, dict):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_filter(sort, after: dict) -> dict:
+    """
+    Query clause matching the documents that come after ``after`` in ``sort`` order.
+
+    :param sort: ``[(field, 1 | -1), ...]``, ending with a unique field such as ``_id``.
+    :param after: Values of the sort fields in the last document served.
+    :raises ValueError: When ``after`` lacks one of the sort fields.
+    """
+    missing = [field for field, _ in sort if field not in after]
+    if missing:
+        raise ValueError("Invalid cursor")
+    # (a, b) after (x, y): a past x, or a == x and b past y
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prefix: after[prefix] for prefix, _ in sort[:i]}
+        clause[field] = {"$lt" if direction < 0 else "$gt": after[field]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def page_cursor(documents, sort, limit):
+    """
+    Trim a page fetched with ``limit + 1`` documents and give the cursor of the next page,
+    or None on the last page.
+    """
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, encode_cursor({field: documents[-1][field] for field, _ in sort})
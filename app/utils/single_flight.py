@@ -0,0 +1,46 @@
+import asyncio
+
+from app.core import metrics
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing a key into one execution whose result (or
+    exception) is handed to every caller.
+
+    The shared call runs as its own task, so a caller that is cancelled (e.g. the client
+    went away) does not cancel it for the others. ``<name>_calls`` counts executions and
+    ``<name>_saved`` counts calls that joined one already in flight.
+    """
+
+    def __init__(self, name: str):
+        self._in_flight = {}
+        self.calls = metrics.counter(f"{name}_calls", f"{name} executions")
+        self.saved = metrics.counter(f"{name}_saved", f"{name} calls served by an execution already in flight")
+
+    async def do(self, key, fn):
+        """
+        Await ``fn()`` unless a call with the same key is already running, then await that one.
+
+        :param key: Hashable identity of the call.
+        :param fn: Zero-argument coroutine function performing the call.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.calls.inc()
+        else:
+            self.saved.inc()
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self):
+        return len(self._in_flight)
@@ -0,0 +1,91 @@
+class SpaceSaving:
+    """
+    Approximate counts of the most frequent items of a stream in fixed memory, with the
+    Space-Saving algorithm (Metwally, Agrawal and El Abbadi, 2005).
+
+    At most ``capacity`` items are tracked. Once full, a new item replaces one holding the
+    minimum count and inherits that count as its ``error``: a tracked item's count
+    over-estimates its true count by at most its error, and every item seen more than
+    ``total / capacity`` times is tracked. Items are grouped by count, so ``add`` is O(1).
+
+    Two sketches merge into one with the same guarantees over both streams, so per-worker
+    sketches can be folded into a stored one.
+    """
+
+    __slots__ = ("capacity", "total", "counts", "errors", "buckets", "min_count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}  # item -> count
+        self.errors = {}  # item -> over-estimation bound
+        self.buckets = {}  # count -> {item: None}, oldest first
+        self.min_count = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item):
+        self.total += 1
+        count = self.counts.get(item)
+        if count is None:
+            if len(self.counts) < self.capacity:
+                count = 0
+            else:
+                count = self.min_count
+                evicted = next(iter(self.buckets[count]))
+                self._unlink(evicted, count)
+                del self.counts[evicted], self.errors[evicted]
+            self.errors[item] = count
+        else:
+            self._unlink(item, count)
+
+        self.counts[item] = count + 1
+        self.buckets.setdefault(count + 1, {})[item] = None
+        if count == 0:
+            self.min_count = 1
+        elif count == self.min_count and count not in self.buckets:
+            self.min_count = count + 1
+
+    def _unlink(self, item, count):
+        bucket = self.buckets[count]
+        del bucket[item]
+        if not bucket:
+            del self.buckets[count]
+
+    def floor(self):
+        """Upper bound of the count of any untracked item."""
+        return self.min_count if len(self.counts) >= self.capacity else 0
+
+    def top(self, k: int):
+        """The ``k`` items with the highest counts, as (item, count, error), highest first."""
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+    @classmethod
+    def from_items(cls, capacity: int, items, total: int):
+        """A sketch holding ``items``, (item, count, error), trimmed to the ``capacity`` highest counts."""
+        sketch = cls(capacity)
+        sketch.total = total
+        for item, count, error in sorted(items, key=lambda item: item[1], reverse=True)[:capacity]:
+            sketch.counts[item] = count
+            sketch.errors[item] = error
+            sketch.buckets.setdefault(count, {})[item] = None
+        sketch.min_count = min(sketch.counts.values(), default=0)
+        return sketch
+
+    @classmethod
+    def merged(cls, first, second, capacity: int = None):
+        """
+        One sketch over the streams of ``first`` and ``second``. An item missing from one of
+        them may have been seen up to that sketch's ``floor`` times there, which is added to
+        both its count and its error.
+        """
+        floors = first.floor(), second.floor()
+        items = [
+            (item,
+             first.counts.get(item, floors[0]) + second.counts.get(item, floors[1]),
+             first.errors.get(item, floors[0]) + second.errors.get(item, floors[1]))
+            for item in first.counts.keys() | second.counts.keys()
+        ]
+        return cls.from_items(capacity or max(first.capacity, second.capacity), items, first.total + second.total)
@@ -0,0 +1,40 @@
+import time
+from contextlib import contextmanager
+
+from app.core import metrics
+
+
+class StageTimer:
+    """
+    Wall-clock seconds spent in each named stage of one request.
+
+    ``observe`` exports every recorded stage to a ``<prefix>_<stage>_seconds`` histogram;
+    call it once per request, also for failed ones.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def observe(self):
+        for name, seconds in self.stages.items():
+            metrics.histogram(f"{self.prefix}_{name}_seconds", f"Seconds spent in the {name} stage").observe(seconds)
+
+
+def percentiles(values, quantiles=(0.5, 0.9, 0.99)):
+    """``{"p50": ..., "p90": ..., "p99": ...}`` of ``values`` (nearest rank), or {} without values."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        f"p{round(q * 100)}": ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        for q in quantiles
+    }
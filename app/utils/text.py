@@ -0,0 +1,12 @@
+import re
+
+NON_WORD_PATTERN = re.compile(r'[^\w\s]')
+
+
+def normalize_question(question):
+    """
+    Case-, punctuation- and whitespace-insensitive form of a question. The answer cache
+    and the top questions both use it, so phrasings that share a cached answer are also
+    counted as one question.
+    """
+    return " ".join(NON_WORD_PATTERN.sub(" ", str(question).casefold()).split())
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+
+from pymongo.errors import BulkWriteError
+
+from app.core import metrics
+
+logger = logging.getLogger("app")
+
+
+class WriteBehindBuffer:
+    """
+    Buffers documents in memory and writes them with ``insert_many(ordered=False)``, so
+    callers do not wait for a MongoDB round trip.
+
+    A flush starts once ``batch_size`` documents are buffered and at least every
+    ``flush_interval`` seconds. At most ``max_pending`` documents are held, counting both
+    buffered ones and those of batches being written: when that many are held, ``add``
+    waits for a flush to complete instead of growing the buffer, so memory stays bounded
+    while MongoDB is slow or down. Documents that failed to be
+    written are logged and counted in ``<name>_failed``; they are not retried.
+
+    ``pending`` exposes documents not yet committed, including batches being written,
+    so readers can merge them into what they load from the database.
+
+    ``on_written(documents, context)``, if given, is awaited after each write with the
+    documents that were stored, grouped by the ``context`` they were added with, so work
+    that depends on a document being stored runs off the request path as well. Its
+    errors are logged.
+    """
+
+    def __init__(self, name: str, batch_size: int, flush_interval: float, max_pending: int, on_written=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_written = on_written
+        self._pending = []  # (collection, document, context)
+        self._in_flight = []  # (batch, future set once written): handed to insert_many, not acknowledged yet
+        self._in_flight_count = 0
+        self._task = None
+        self._flushes = set()
+        self.pending_gauge = metrics.gauge(f"{name}_pending", f"{name} documents waiting to be written")
+        self.written = metrics.counter(f"{name}_written", f"{name} documents written")
+        self.failed = metrics.counter(f"{name}_failed", f"{name} documents that could not be written")
+        self.batches = metrics.counter(f"{name}_batches", f"{name} insert_many calls")
+
+    def start(self):
+        """Start the periodic flush on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        """Stop the periodic flush and write everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes)
+        await self.flush()
+
+    async def add(self, collection, document, context=None):
+        self.start()
+        while len(self._pending) + self._in_flight_count >= self.max_pending:
+            if self._pending:
+                await self.flush()
+            else:
+                # Shielded: a cancelled caller must not cancel the write it waits for
+                await asyncio.shield(self._in_flight[0][1])
+        self._pending.append((collection, document, context))
+        self.pending_gauge.set(len(self._pending))
+        if len(self._pending) >= self.batch_size:
+            task = asyncio.ensure_future(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    def pending(self, predicate):
+        """Buffered or in-flight documents matching ``predicate``, oldest first."""
+        return [
+            document
+            for batch in [batch for batch, _ in self._in_flight] + [self._pending]
+            for _, document, _ in batch
+            if predicate(document)
+        ]
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        self.pending_gauge.set(0)
+        if not batch:
+            return
+        entry = (batch, asyncio.get_running_loop().create_future())
+        self._in_flight.append(entry)
+        self._in_flight_count += len(batch)
+        try:
+            for collection, context, documents in self._group_by_collection(batch):
+                written = await self._insert(collection, documents)
+                if written and self.on_written is not None:
+                    try:
+                        await self.on_written(written, context)
+                    except Exception as e:
+                        logger.error(f"Write-behind callback for {len(written)} documents failed: {e}")
+        finally:
+            self._in_flight.remove(entry)
+            self._in_flight_count -= len(batch)
+            entry[1].set_result(None)
+
+    async def _insert(self, collection, documents):
+        """Write ``documents`` and return those that were stored."""
+        self.batches.inc()
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            self.written.inc(len(documents) - len(failed))
+            self.failed.inc(len(failed))
+            logger.error(f"Write-behind insert_many: {len(failed)} of {len(documents)} documents failed: {e}")
+            return [document for index, document in enumerate(documents) if index not in failed]
+        except Exception as e:
+            self.failed.inc(len(documents))
+            logger.error(f"Write-behind insert_many of {len(documents)} documents failed: {e}")
+            return []
+        self.written.inc(len(documents))
+        return documents
+
+    @staticmethod
+    def _group_by_collection(batch):
+        groups = {}
+        for collection, document, context in batch:
+            # Motor hands out a new collection object per lookup; equal ones share a batch
+            groups.setdefault((collection, context), (collection, context, []))[2].append(document)
+        return groups.values()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
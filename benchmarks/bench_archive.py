@@ -0,0 +1,123 @@
+"""
+History-read latency and storage of an aged tenant, a year of conversations, before and
+after moving turns older than 30 days into ``UserMessageArchive`` with ``archive_messages``,
+and the export throughput over the archive.
+
+Needs a MongoDB server (``MONGODB_URL``); data is written to a throwaway database
+that is dropped afterwards. Run from the repository root:
+    python -m benchmarks.bench_archive [--users 200] [--turns-per-day 5] [--runs 20]
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+from app.indexes import INDEXES, SPATIAL_AI
+from app.services.ai_service import get_user_messages_json, history_cache
+from app.services.message_archive import ARCHIVE_COLLECTION, archive_messages, archived_messages
+from app.services.message_export import export_query, stream_export
+
+BENCH_DB_NAME = "bench_archive"
+DAYS = 365
+
+
+async def seed(collection, company_id, users, turns_per_day):
+    now = datetime.now()
+    batch = []
+    for day in range(DAYS):
+        for user_id in users:
+            for turn in range(turns_per_day):
+                batch.append({
+                    "companyId": str(company_id),
+                    "userId": str(user_id),
+                    "lang": "EN",
+                    "time": (now - timedelta(days=day, minutes=turn)).isoformat(),
+                    "messages": {
+                        "question": f"What about topic {day}-{turn}?",
+                        "answer": "A reasonably long answer about the topic. " * 10,
+                        "links": ["https://example.com/docs"],
+                        "process_time": 1.2,
+                        "voice_answer": "A reasonably long answer about the topic. " * 10,
+                    },
+                })
+                if len(batch) == 10000:
+                    await collection.insert_many(batch)
+                    batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def history_latency(collection, company_id, users, runs):
+    timings = []
+    for i in range(runs):
+        # Every read goes to the database
+        history_cache.clear()
+        start = time.perf_counter()
+        await get_user_messages_json(collection, company_id, users[i % len(users)])
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+
+async def storage(db):
+    sizes = {}
+    for name in ("UserMessage", ARCHIVE_COLLECTION):
+        stats = await db.command("collStats", name)
+        sizes[name] = (stats.get("count", 0), stats.get("storageSize", 0), stats.get("totalIndexSize", 0))
+    return sizes
+
+
+async def report(label, db, company_id, users, runs):
+    p50, p99 = await history_latency(db["UserMessage"], company_id, users, runs)
+    print(f"{label}: history p50 {p50 * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms")
+    for name, (count, size, index_size) in (await storage(db)).items():
+        print(f"  {name:<20} {count:>9} documents  storage {size / 2 ** 20:8.1f} MB  "
+              f"indexes {index_size / 2 ** 20:7.1f} MB")
+
+
+async def export_seconds(db, company_id):
+    start = time.perf_counter()
+    archived = archived_messages(db[ARCHIVE_COLLECTION], company_id)
+    async for _ in stream_export(db["UserMessage"], export_query(company_id), "ndjson", archived=archived):
+        pass
+    return time.perf_counter() - start
+
+
+async def main(user_count, turns_per_day, runs):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    db = client[BENCH_DB_NAME]
+    try:
+        for spec in INDEXES:
+            if spec.database == SPATIAL_AI and spec.collection in ("UserMessage", ARCHIVE_COLLECTION):
+                await db[spec.collection].create_index(spec.keys, name=spec.name)
+        company_id = ObjectId()
+        users = [ObjectId() for _ in range(user_count)]
+        await seed(db["UserMessage"], company_id, users, turns_per_day)
+        print(f"{user_count} users x {turns_per_day} turns/day x {DAYS} days, "
+              f"history window: {settings.AI_HISTORY_MAX_TURNS} turns")
+
+        await report("all turns stored", db, company_id, users, runs)
+        print(f"  export {await export_seconds(db, company_id):6.1f} s")
+
+        start = time.perf_counter()
+        moved = await archive_messages(db, 30)
+        print(f"archived {moved} turns in {time.perf_counter() - start:6.1f} s")
+
+        await report("30 days stored  ", db, company_id, users, runs)
+        print(f"  export {await export_seconds(db, company_id):6.1f} s")
+    finally:
+        await client.drop_database(BENCH_DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--turns-per-day", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.turns_per_day, args.runs))
@@ -0,0 +1,97 @@
+"""
+Throughput and memory of the streaming conversation export on a large company: the
+``/ai_summary``-style ``to_list(length=None)`` load followed by encoding, versus
+``stream_export`` reading one cursor in chunks, for NDJSON and CSV.
+
+Needs a MongoDB server (``MONGODB_URL``); data is written to a throwaway database
+that is dropped afterwards. Run from the repository root:
+    python -m benchmarks.bench_export [--messages 1000000] [--chunk-rows 500]
+"""
+import argparse
+import asyncio
+import resource
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+from app.services.message_export import (EXPORT_PROJECTION, EXPORT_SORT, encode_csv, encode_ndjson, export_query,
+                                         export_row, stream_export)
+
+BENCH_DB_NAME = "bench_export"
+
+
+async def seed(collection, company_id, count):
+    users = [str(ObjectId()) for _ in range(1000)]
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(count):
+        batch.append({
+            "companyId": str(company_id),
+            "userId": users[i % len(users)],
+            "lang": "EN",
+            "time": (start + timedelta(seconds=i)).isoformat(),
+            "messages": {
+                "question": f"What about topic {i}?",
+                "answer": "A reasonably long answer about the topic, with a comma. " * 5,
+                "links": ["https://example.com/docs"],
+                "process_time": 1.2,
+            },
+        })
+        if len(batch) == 10000:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def load_all(collection, query, export_format, chunk_rows):
+    # Everything in memory first, as /ai_summary used to do
+    documents = await collection.find(query, EXPORT_PROJECTION).sort(EXPORT_SORT).to_list(length=None)
+    encode = encode_csv if export_format == "csv" else encode_ndjson
+    yield encode([export_row(document) for document in documents]).encode()
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(label, export, collection, query, export_format, chunk_rows):
+    rss_before = max_rss_mb()
+    start = time.perf_counter()
+    size = 0
+    async for chunk in export(collection, query, export_format, chunk_rows):
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<9} {export_format:<6} {size / elapsed / 2 ** 20:7.1f} MB/s  {elapsed:6.1f} s  "
+          f"peak RSS +{max_rss_mb() - rss_before:7.1f} MB")
+    return elapsed
+
+
+async def main(count, chunk_rows):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    collection = client[BENCH_DB_NAME]["UserMessage"]
+    try:
+        await collection.create_index([("companyId", 1), ("time", -1), ("_id", -1)])
+        company_id = ObjectId()
+        await seed(collection, company_id, count)
+        query = export_query(company_id)
+        print(f"{count} messages")
+        # Streaming first: peak RSS only grows, so the in-memory load must come last
+        for export_format in ("ndjson", "csv"):
+            elapsed = await run("streaming", stream_export, collection, query, export_format, chunk_rows)
+            print(f"{'':<16} {count / elapsed:10.0f} messages/s")
+        await run("to_list", load_all, collection, query, "ndjson", chunk_rows)
+    finally:
+        await client.drop_database(BENCH_DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chunk-rows", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.chunk_rows))
@@ -0,0 +1,66 @@
+"""
+Latency of a small company's questions while a big company floods the AI service:
+first-come-first-served versus per-company weighted fair queuing in ``AdmissionController``.
+
+Run from the repository root:
+    python -m benchmarks.bench_fair_scheduling [--burst 300] [--small 20] [--slots 8] [--delay 0.05]
+"""
+import argparse
+import asyncio
+import time
+
+from app.utils.admission import AdmissionController
+from app.utils.http_client import init_http_client, close_http_client, get_http_client, send_request
+from tests.AIStubServer import AIStubServer
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(label, fair, session, url, burst, small, slots):
+    controller = AdmissionController(f"bench_{label}", max_concurrency=slots, max_queue=burst + small,
+                                     queue_timeout=600, retry_after=1, max_queue_per_tenant=burst + small)
+    latencies = {"big": [], "small": []}
+
+    async def ask(company, i):
+        start = time.perf_counter()
+        async with controller.slot(company if fair else None):
+            await send_request(session, url, payload={"user_messages": [], "lang": "EN", "question": f"{company} {i}"})
+        latencies[company].append(time.perf_counter() - start)
+
+    async def small_company():
+        # A steady trickle of questions arriving during the spike
+        tasks = []
+        for i in range(small):
+            tasks.append(asyncio.ensure_future(ask("small", i)))
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(*[ask("big", i) for i in range(burst)], small_company())
+    for company, samples in latencies.items():
+        print(f"{label:<6} {company:<6} p50 {percentile(samples, 0.5) * 1000:7.0f} ms   "
+              f"p99 {percentile(samples, 0.99) * 1000:7.0f} ms")
+
+
+async def main(burst, small, slots, delay):
+    async with AIStubServer(delay=delay) as stub:
+        url = f"{stub.url}/get_answer/"
+        await init_http_client()
+        session = await get_http_client()
+        try:
+            await run("fifo", False, session, url, burst, small, slots)
+            await run("fair", True, session, url, burst, small, slots)
+        finally:
+            await close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=300, help="questions the big company sends at once")
+    parser.add_argument("--small", type=int, default=20, help="questions the small company sends meanwhile")
+    parser.add_argument("--slots", type=int, default=8, help="concurrent AI service calls")
+    parser.add_argument("--delay", type=float, default=0.05, help="stub server latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(main(args.burst, args.small, args.slots, args.delay))
@@ -0,0 +1,97 @@
+"""
+History-fetch latency for users holding 10, 1k and 100k messages: the previous
+unbounded ``find().to_list(length=None)`` + Pydantic chain versus the bounded,
+projected and indexed ``get_user_messages_json``.
+
+Needs a MongoDB server (``MONGODB_URL``); data is written to a throwaway database
+that is dropped afterwards. Run from the repository root:
+    python -m benchmarks.bench_history_fetch [--sizes 10 1000 100000] [--runs 5]
+"""
+import argparse
+import asyncio
+import time
+import warnings
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+from app.models.user_messages import UserMessages, convert_DB_user_message_pydantic
+from app.services.ai_service import get_user_messages_json, convert_objectid_to_str
+
+BENCH_DB_NAME = "bench_history_fetch"
+
+# model_dump warns about ObjectId values on every message
+warnings.filterwarnings("ignore", category=UserWarning)
+
+
+async def unbounded_fetch(collection, company_id, user_id):
+    # The pre-window implementation
+    filter_query = {"companyId": {"$in": [company_id, str(company_id)]}, "userId": {"$in": [user_id, str(user_id)]}}
+    user_messages_list = await collection.find(filter_query).to_list(length=None)
+    user_messages = convert_DB_user_message_pydantic(user_messages_list)
+    user_messages = [UserMessages(**message) for message in user_messages]
+    user_messages_json = [message.model_dump(by_alias=True) for message in user_messages]
+    return convert_objectid_to_str(user_messages_json)
+
+
+async def seed(collection, company_id, size):
+    user_id = ObjectId()
+    start = datetime.now() - timedelta(minutes=size)
+    batch = []
+    for i in range(size):
+        batch.append({
+            "companyId": str(company_id),
+            "userId": str(user_id),
+            "lang": "EN",
+            "time": (start + timedelta(minutes=i)).isoformat(),
+            "messages": {
+                "question": f"What about topic {i}?",
+                "answer": "A reasonably long answer about the topic. " * 10,
+                "links": ["https://example.com/docs"],
+                "process_time": 1.2,
+                "voice_answer": "A reasonably long answer about the topic. " * 10,
+            },
+        })
+        if len(batch) == 5000:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+    return user_id
+
+
+async def timed(fetch, collection, company_id, user_id, runs):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        messages = await fetch(collection, company_id, user_id)
+        best = min(best, time.perf_counter() - start)
+    return best, len(messages)
+
+
+async def main(sizes, runs):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    collection = client[BENCH_DB_NAME]["UserMessage"]
+    try:
+        await collection.create_index([("companyId", 1), ("userId", 1), ("time", -1)])
+        company_id = ObjectId()
+        print(f"history window: {settings.AI_HISTORY_MAX_TURNS} turns")
+        for size in sizes:
+            user_id = await seed(collection, company_id, size)
+            before, before_count = await timed(unbounded_fetch, collection, company_id, user_id, runs)
+            after, after_count = await timed(get_user_messages_json, collection, company_id, user_id, runs)
+            print(f"{size:>7} messages: unbounded {before * 1000:9.1f} ms ({before_count} turns) | "
+                  f"windowed {after * 1000:7.1f} ms ({after_count} turns)")
+    finally:
+        await client.drop_database(BENCH_DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.runs))
@@ -0,0 +1,77 @@
+"""
+Cost of turning a user's stored history into the upstream JSON body: the previous
+Pydantic chain (``convert_DB_user_message_pydantic`` -> ``UserMessages`` ->
+``model_dump`` -> ``convert_objectid_to_str``) versus ``serialize_user_messages``.
+
+Run from the repository root:
+    python -m benchmarks.bench_history_serialization [--messages 1000] [--rounds 20]
+"""
+import argparse
+import copy
+import json
+import time
+import warnings
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.models.user_messages import UserMessages, convert_DB_user_message_pydantic
+from app.services.ai_service import convert_objectid_to_str, serialize_user_messages
+
+# model_dump warns about ObjectId values on every message
+warnings.filterwarnings("ignore", category=UserWarning)
+
+
+def legacy_serialize_user_messages(user_messages_list):
+    user_messages = convert_DB_user_message_pydantic(user_messages_list)
+    user_messages = [UserMessages(**message) for message in user_messages]
+    user_messages_json = [message.model_dump(by_alias=True) for message in user_messages]
+    return convert_objectid_to_str(user_messages_json)
+
+
+def make_history(count):
+    company_id, user_id = ObjectId(), ObjectId()
+    start = datetime(2024, 10, 1)
+    history = []
+    for i in range(count):
+        # Older documents hold ObjectIds and datetimes, newer ones strings
+        legacy = i % 2 == 0
+        time_value = start + timedelta(minutes=i)
+        history.append({
+            "_id": ObjectId() if legacy else str(ObjectId()),
+            "companyId": company_id if legacy else str(company_id),
+            "userId": user_id if legacy else str(user_id),
+            "lang": "EN",
+            "time": time_value if legacy else time_value.isoformat(),
+            "messages": {
+                "question": f"What are the opening hours of shop {i}?",
+                "answer": "We are open Monday to Friday from 9:00 to 18:00 and on Saturday morning. " * 3,
+            },
+        })
+    return history
+
+
+def run(label, serialize, history, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        documents = copy.deepcopy(history)  # as fresh from the driver
+        start = time.perf_counter()
+        body = json.dumps({"user_messages": serialize(documents), "lang": "EN", "question": "q"}).encode()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<8} {len(history)} messages -> {len(body)} bytes in {best * 1000:7.2f} ms")
+    return body
+
+
+def main(count, rounds):
+    history = make_history(count)
+    legacy = run("legacy", legacy_serialize_user_messages, history, rounds)
+    current = run("direct", serialize_user_messages, history, rounds)
+    assert legacy == current
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    main(args.messages, args.rounds)
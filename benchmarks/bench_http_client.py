@@ -0,0 +1,69 @@
+"""
+Concurrent requests/sec against a local stub AI server: the legacy blocking
+``requests.post`` call versus the pooled aiohttp client.
+
+Run from the repository root:
+    python -m benchmarks.bench_http_client [--requests 200] [--concurrency 50] [--delay 0.05]
+"""
+import argparse
+import asyncio
+import time
+
+import requests
+
+from app.utils.http_client import init_http_client, close_http_client, get_http_client, send_request
+from tests.AIStubServer import AIStubServer
+
+
+def legacy_send_request(url, payload):
+    # The pre-aiohttp implementation: blocks the event loop for the whole round trip
+    response = requests.post(url, json=payload, headers={'Content-Type': 'application/json'})
+    response.raise_for_status()
+    return response.json()
+
+
+async def run(label, call, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await call({"user_messages": [], "lang": "EN", "question": f"question {i}"})
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(total)])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {total} requests in {elapsed:.2f}s -> {total / elapsed:.1f} req/s")
+
+
+async def main(total, concurrency, delay):
+    # The stub runs on its own loop so the blocking client cannot starve it
+    stub = AIStubServer(delay=delay).start_in_thread()
+    try:
+        url = f"{stub.url}/get_answer/"
+
+        async def legacy(payload):
+            return legacy_send_request(url, payload)
+
+        await run("blocking", legacy, total, concurrency)
+
+        await init_http_client()
+        session = await get_http_client()
+
+        async def pooled(payload):
+            return await send_request(session, url, payload=payload)
+
+        try:
+            await run("pooled", pooled, total, concurrency)
+        finally:
+            await close_http_client()
+    finally:
+        stub.stop_in_thread()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.05, help="stub server latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.delay))
@@ -0,0 +1,92 @@
+"""
+Per-answer CPU cost of answer post-processing (links, voice text, cleaning): the legacy
+implementation, which recompiled its patterns and made four passes over the answer,
+versus the rule-table engine.
+
+Run from the repository root:
+    python -m benchmarks.bench_postprocessing [--answers 200] [--size 4000] [--rounds 5]
+"""
+import argparse
+import random
+import time
+
+from app.models.user_messages import AIResponse
+from app.services.ai_service import process_ai_response_links
+
+LINES = [
+    "Our opening hours are Monday to Friday, 9:00 to 18:00, and Saturday morning.",
+    "See the full price list (https://example.com/pricing) before booking.",
+    "Version 2.1.3 of the app adds offline mode, and 10.5% of users already use it.",
+    "More help is available at [www.example.com/help] or by phone.",
+    "Delivery takes 3 to 5 working days within the country.",
+]
+
+
+def legacy_process_ai_response_links(ai_response, lang):
+    import re
+
+    link_pattern = re.compile(r'[\[(](https?://[^\s]+|www\.[^\s]+)[\])]')
+    ai_response.links = link_pattern.findall(ai_response.answer)
+    ai_response.answer = link_pattern.sub('', ai_response.answer)
+    ai_response.voice = legacy_replace_list_numbers(ai_response.answer, lang)
+    ai_response.answer = ai_response.answer.strip()
+    ai_response.voice = ai_response.voice.strip()
+
+
+def legacy_replace_list_numbers(input_text, lang):
+    import re
+
+    re_main = re.compile(r'(?m)^(\d+)\.')
+    input_text = re_main.sub(
+        lambda m: f"numero {m.group(1)}." if lang == "IT" else f"number {m.group(1)}.", input_text
+    )
+    re_nested = re.compile(r'(\d+(\.\d+)+)')
+
+    def replace_nested(match):
+        numbers = match.group(1).split('.')
+        if lang == "IT":
+            return "numero " + " punto ".join(numbers) + "."
+        return "number " + " point ".join(numbers) + "."
+
+    return re_nested.sub(replace_nested, input_text)
+
+
+def make_answer(rng, size):
+    lines = []
+    while sum(map(len, lines)) < size:
+        number = len(lines) + 1
+        prefix = f"{number}." if rng.random() < 0.6 else f"{number}.{rng.randint(1, 9)} "
+        lines.append(f"{prefix} {rng.choice(LINES)}")
+    return "\n".join(lines)
+
+
+def run(label, process, answers, lang, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for answer in answers:
+            process(AIResponse(question="q", answer=answer), lang)
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<8} {lang}  {best / len(answers) * 1e6:8.1f} us/answer")
+
+
+def main(count, size, rounds):
+    rng = random.Random(0)
+    answers = [make_answer(rng, size) for _ in range(count)]
+    for lang in ("EN", "IT"):
+        for answer in answers[:20]:
+            legacy, current = AIResponse(question="q", answer=answer), AIResponse(question="q", answer=answer)
+            legacy_process_ai_response_links(legacy, lang)
+            process_ai_response_links(current, lang)
+            assert (legacy.answer, legacy.voice, legacy.links) == (current.answer, current.voice, current.links)
+        run("legacy", legacy_process_ai_response_links, answers, lang, rounds)
+        run("rules", process_ai_response_links, answers, lang, rounds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=200)
+    parser.add_argument("--size", type=int, default=4000, help="answer size in characters")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    main(args.answers, args.size, args.rounds)
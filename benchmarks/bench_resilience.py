@@ -0,0 +1,73 @@
+"""
+Tail latency of text questions against a stub AI server with a slow tail, with and
+without hedged requests.
+
+Run from the repository root:
+    python -m benchmarks.bench_resilience [--requests 500] [--concurrency 10] [--slow-share 0.02]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from app.utils.hedging import Hedger
+from app.utils.http_client import init_http_client, close_http_client, get_http_client, send_request
+from tests.AIStubServer import AIStubServer
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(label, call, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await call({"user_messages": [], "lang": "EN", "question": f"question {i}"})
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[one(i) for i in range(total)])
+    print(f"{label:<10} p50 {percentile(latencies, 0.5) * 1000:7.1f} ms   "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms   "
+          f"max {max(latencies) * 1000:7.1f} ms")
+
+
+async def main(total, concurrency, fast, slow, slow_share):
+    rng = random.Random(0)
+    async with AIStubServer() as stub:
+        stub.delay_fn = lambda: slow if rng.random() < slow_share else fast
+        url = f"{stub.url}/get_answer/"
+        await init_http_client()
+        session = await get_http_client()
+        try:
+            async def plain(payload):
+                return await send_request(session, url, payload=payload)
+
+            await run("plain", plain, total, concurrency)
+
+            hedger = Hedger("bench_hedger")
+
+            async def hedged(payload):
+                return await hedger.call(lambda: send_request(session, url, payload=payload))
+
+            await run("hedged", hedged, total, concurrency)
+            sent = total + hedger.fired.value
+            print(f"hedges fired {hedger.fired.value} ({hedger.fired.value / total:.1%} extra load), "
+                  f"won {hedger.won.value}, upstream requests {sent}")
+        finally:
+            await close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--fast", type=float, default=0.02, help="usual stub latency in seconds")
+    parser.add_argument("--slow", type=float, default=1.0, help="slow-tail stub latency in seconds")
+    parser.add_argument("--slow-share", type=float, default=0.02, help="share of slow responses")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.fast, args.slow, args.slow_share))
@@ -0,0 +1,103 @@
+"""
+``/ai_search`` latency on a large company: first and deeper pages of frequent and rare
+terms, a phrase, and searches narrowed by date range and language, over the
+``companyId_text`` index.
+
+Needs a MongoDB server (``MONGODB_URL``); data is written to a throwaway database
+that is dropped afterwards. Run from the repository root:
+    python -m benchmarks.bench_search [--messages 1000000] [--runs 20]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+from app.indexes import INDEXES
+from app.services.message_search import search_messages
+
+BENCH_DB_NAME = "bench_search"
+
+# Word frequencies fall off like natural text: the first words are in most messages
+VOCABULARY = [f"word{i}" for i in range(5000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def sentence(rng, length):
+    return " ".join(rng.choices(VOCABULARY, WEIGHTS, k=length))
+
+
+async def seed(collection, company_id, count):
+    rng = random.Random(1)
+    users = [str(ObjectId()) for _ in range(1000)]
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(count):
+        batch.append({
+            "companyId": str(company_id),
+            "userId": users[i % len(users)],
+            "lang": "EN" if i % 4 else "FR",
+            "time": (start + timedelta(seconds=30 * i)).isoformat(),
+            "messages": {"question": sentence(rng, 8), "answer": sentence(rng, 60), "process_time": 1.2},
+        })
+        if len(batch) == 10000:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def latency(collection, company_id, runs, pages, **search):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        cursor = None
+        for _ in range(pages):
+            results, cursor = await search_messages(collection, company_id, cursor=cursor, **search)
+            if cursor is None:
+                break
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+
+async def main(count, runs):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    collection = client[BENCH_DB_NAME]["UserMessage"]
+    try:
+        spec = next(spec for spec in INDEXES if spec.name == "companyId_text")
+        await collection.create_index(spec.keys, name=spec.name, **spec.options)
+        company_id = ObjectId()
+        await seed(collection, company_id, count)
+        print(f"{count} messages")
+
+        one_week = {"start": datetime(2024, 3, 1), "end": datetime(2024, 3, 8)}
+        cases = [
+            ("frequent term", 1, {"terms": "word0"}),
+            ("frequent, page 5", 5, {"terms": "word0"}),
+            ("mid term", 1, {"terms": "word50"}),
+            ("rare term", 1, {"terms": "word4000"}),
+            ("two terms", 1, {"terms": "word10 word20"}),
+            ("phrase", 1, {"terms": '"word0 word1"'}),
+            ("frequent, one week", 1, {"terms": "word0", **one_week}),
+            ("frequent, FR", 1, {"terms": "word0", "lang": "FR"}),
+        ]
+        for label, pages, search in cases:
+            p50, p99 = await latency(collection, company_id, runs, pages, limit=settings.AI_SEARCH_PAGE_SIZE,
+                                     **search)
+            print(f"{label:<20} p50 {p50 * 1000:8.1f} ms  p99 {p99 * 1000:8.1f} ms")
+    finally:
+        await client.drop_database(BENCH_DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.runs))
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import threading
+
+from aiohttp import web
+
+
+class AIStubServer:
+    """
+    Local stand-in for the AI_SITE service, served on an ephemeral localhost port.
+
+    Answers ``/get_answer/`` and ``/process_voice/{companyId}`` after ``delay`` seconds and
+    records every request it received. ``/stream_answer/`` sends ``stream_chunks`` one at a
+    time, ``delay`` seconds apart. ``delay_fn``, if set, picks the ``/get_answer/`` delay
+    per request, e.g. to simulate a backend with a slow tail. Statuses pushed to ``fail_statuses`` are returned
+    (one per request) before the server starts answering normally again.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.fail_statuses = []
+        self.stream_chunks = None
+        self.delay_fn = None
+        self.requests = []
+        self.url = None
+        self._runner = None
+        self._loop = None
+        self._thread = None
+
+    async def _get_answer(self, request: web.Request):
+        payload = await request.json()
+        self.requests.append(payload)
+        if self.fail_statuses:
+            return web.Response(status=self.fail_statuses.pop(0))
+        await asyncio.sleep(self.delay_fn() if self.delay_fn else self.delay)
+        return web.json_response({
+            "question": payload["question"],
+            "answer": f"Answer to: {payload['question']}",
+        })
+
+    async def _stream_answer(self, request: web.Request):
+        payload = await request.json()
+        self.requests.append(payload)
+        if self.fail_statuses:
+            return web.Response(status=self.fail_statuses.pop(0))
+        response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8"})
+        await response.prepare(request)
+        for chunk in self.stream_chunks or [f"Answer to: {payload['question']}"]:
+            await asyncio.sleep(self.delay)
+            await response.write(chunk.encode())
+        await response.write_eof()
+        return response
+
+    async def _process_voice(self, request: web.Request):
+        form = await request.post()
+        audio = form["wavData"].file.read()
+        user_messages = form.get("user_messages")
+        self.requests.append({
+            "companyId": request.match_info["company_id"],
+            "lang": form.get("lang"),
+            "audio": audio,
+            "user_messages": json.loads(user_messages) if user_messages else None,
+        })
+        if self.fail_statuses:
+            return web.Response(status=self.fail_statuses.pop(0))
+        await asyncio.sleep(self.delay)
+        return web.json_response({
+            "question": audio.decode(errors="replace"),
+            "answer": f"Heard {len(audio)} bytes",
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/get_answer/", self._get_answer)
+        app.router.add_post("/stream_answer/", self._stream_answer)
+        app.router.add_post("/process_voice/{company_id}", self._process_voice)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def start_in_thread(self):
+        """Serve from a dedicated event loop thread, for callers that may block their own loop."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+        return self
+
+    def stop_in_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -59,3 +59,80 @@ class MockDatabase:
         Remove the dependency override to clean up after tests.
         """
         self.app.dependency_overrides = self.original_dependency_overrides.copy()
+
+
+class MockMotorCursor:
+    """Async facade over a mongomock cursor, mirroring the motor cursor API used by the app."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args):
+        self._cursor = self._cursor.limit(*args)
+        return self
+
+    def skip(self, *args):
+        self._cursor = self._cursor.skip(*args)
+        return self
+
+    def batch_size(self, *args):
+        self._cursor = self._cursor.batch_size(*args)
+        return self
+
+    async def to_list(self, length=None):
+        documents = list(self._cursor)
+        return documents if length is None else documents[:length]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MockMotorCollection:
+    """
+    Async facade over an in-memory mongomock collection, so service code written against
+    motor can run real queries in tests without a MongoDB server.
+    """
+
+    def __init__(self, collection=None):
+        if collection is None:
+            import mongomock
+            collection = mongomock.MongoClient().db.collection
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return MockMotorCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        return MockMotorCursor(self.collection.aggregate(pipeline, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class MockMotorDatabase:
+    """In-memory database handing out ``MockMotorCollection`` objects by name."""
+
+    def __init__(self):
+        import mongomock
+        self.database = mongomock.MongoClient().db
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MockMotorCollection(self.database[name])
+        return self._collections[name]
@@ -2,8 +2,11 @@ import pytest
 from asgi_lifespan import LifespanManager
 from fastapi.testclient import TestClient
 
+from app.core.config import settings
+from app.database import get_db_spatial_ai
 from app.main import app
-from tests.MockDataBase import MockDatabase
+from app.utils.http_client import init_http_client, close_http_client, get_http_client
+from tests.MockDataBase import MockDatabase, MockMotorDatabase
 
 # Fixture to handle FastAPI app lifespan, allowing start-up and shutdown events to be tested
 @pytest.fixture(scope="function")  # Changed to function scope to prevent issues with async context
@@ -22,3 +25,26 @@ def mock_db(app_lifespan):  # Ensure app_lifespan is included to make sure the a
     mock_db_instance.setup()  # Override get_db dependency with mock
     yield mock_db_instance
     mock_db_instance.teardown()  # Clean up after tests
+
+
+# Fixture providing the pooled AI_SITE session, without retry backoff delays
+@pytest.fixture
+async def http_session(monkeypatch):
+    monkeypatch.setattr(settings, "AI_HTTP_RETRY_BACKOFF_SECONDS", 0)
+    await init_http_client()
+    yield await get_http_client()
+    await close_http_client()
+
+
+# Fixture backing the spatial AI database with an in-memory mongomock database
+@pytest.fixture
+def spatial_ai_db(monkeypatch):
+    db = MockMotorDatabase()
+
+    async def mock_get_db_spatial_ai():
+        return db
+
+    monkeypatch.setattr("app.services.ai_service.get_db_spatial_ai", mock_get_db_spatial_ai)
+    app.dependency_overrides[get_db_spatial_ai] = mock_get_db_spatial_ai
+    yield db
+    app.dependency_overrides.pop(get_db_spatial_ai, None)
@@ -0,0 +1,224 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from httpx import AsyncClient, ASGITransport
+
+from app.api.v2.endpoints.ai_agent import UserMessageText
+from app.core import metrics
+from app.main import app
+from app.services.ai_service import process_ai_response_text
+from app.utils.admission import AdmissionController
+from app.utils.http_client import get_http_client
+from tests.AIStubServer import AIStubServer
+
+
+def make_controller(name, max_concurrency=2, max_queue=2, queue_timeout=1.0):
+    return AdmissionController(name, max_concurrency=max_concurrency, max_queue=max_queue,
+                               queue_timeout=queue_timeout, retry_after=7)
+
+
+@pytest.mark.asyncio
+async def test_full_queue_is_shed_with_429():
+    controller = make_controller("test_admission_shed")
+    release = asyncio.Event()
+    order = []
+
+    async def work(i):
+        async with controller.slot():
+            order.append(i)
+            await release.wait()
+
+    tasks = [asyncio.ensure_future(work(i)) for i in range(4)]
+    await asyncio.sleep(0.01)
+
+    assert (controller.in_flight.value, controller.queue_depth.value) == (2, 2)
+    with pytest.raises(HTTPException) as error:
+        await controller.acquire()
+    assert error.value.status_code == 429
+    assert error.value.headers == {"Retry-After": "7"}
+    assert controller.rejected.value == 1
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == [0, 1, 2, 3]
+    assert (controller.in_flight.value, controller.queue_depth.value) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_queue_deadline_returns_503():
+    controller = make_controller("test_admission_deadline", max_concurrency=1, queue_timeout=0.05)
+    await controller.acquire()
+
+    with pytest.raises(HTTPException) as error:
+        await controller.acquire()
+
+    assert error.value.status_code == 503
+    assert controller.timed_out.value == 1
+    assert controller.queue_depth.value == 0
+    controller.release()
+    assert controller.in_flight.value == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    controller = make_controller("test_admission_cancel", max_concurrency=1)
+    await controller.acquire()
+    waiter = asyncio.ensure_future(controller.acquire())
+    await asyncio.sleep(0.01)
+
+    waiter.cancel()
+    await asyncio.sleep(0.01)
+    assert controller.queue_depth.value == 0
+
+    controller.release()
+    await controller.acquire()
+    assert controller.in_flight.value == 1
+
+
+@pytest.mark.asyncio
+async def test_text_endpoint_sheds_load(http_session, spatial_ai_db, monkeypatch):
+    monkeypatch.setattr("app.services.ai_service.ai_admission",
+                        make_controller("test_admission_endpoint", max_concurrency=2, max_queue=3))
+    app.dependency_overrides[get_http_client] = get_http_client
+    try:
+        async with AIStubServer(delay=0.2) as stub:
+            monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                responses = await asyncio.gather(*[
+                    client.post("/api/v2/textusermessage", json={
+                        "companyId": str(ObjectId()), "userId": str(ObjectId()), "lang": "EN", "question": "Hi?"
+                    })
+                    for _ in range(8)
+                ])
+    finally:
+        app.dependency_overrides.pop(get_http_client)
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] * 5 + [429] * 3
+    assert all(r.headers["Retry-After"] == "7" for r in responses if r.status_code == 429)
+    assert len(stub.requests) == 5
+
+
+@pytest.mark.asyncio
+async def test_stream_endpoint_sheds_load_before_streaming(http_session, spatial_ai_db, monkeypatch):
+    monkeypatch.setattr("app.services.ai_service.ai_admission",
+                        make_controller("test_admission_stream", max_concurrency=1, max_queue=1))
+    app.dependency_overrides[get_http_client] = get_http_client
+    try:
+        async with AIStubServer(delay=0.2) as stub:
+            monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                responses = await asyncio.gather(*[
+                    client.post("/api/v2/textusermessage/stream", json={
+                        "companyId": str(ObjectId()), "userId": str(ObjectId()), "lang": "EN", "question": "Hi?"
+                    })
+                    for _ in range(4)
+                ])
+    finally:
+        app.dependency_overrides.pop(get_http_client)
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] * 2 + [429] * 2
+    assert all(r.headers["Retry-After"] == "7" for r in responses if r.status_code == 429)
+    assert all("event: done" in r.text for r in responses if r.status_code == 200)
+    assert len(stub.requests) == 2
+
+
+async def queue_calls(controller, calls, order):
+    """Hold the only slot, queue ``calls`` as (tenant, weight) pairs, then let them run one by one."""
+    await controller.acquire()
+
+    async def work(i, tenant, weight):
+        async with controller.slot(tenant, weight):
+            order.append((tenant, i))
+
+    tasks = [asyncio.ensure_future(work(i, tenant, weight)) for i, (tenant, weight) in enumerate(calls)]
+    await asyncio.sleep(0.01)
+    controller.release()
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_small_tenant_is_not_stuck_behind_a_big_one():
+    controller = make_controller("test_admission_fair", max_concurrency=1, max_queue=20)
+    order = []
+    await queue_calls(controller, [("big", 1)] * 6 + [("small", 1)] * 2, order)
+
+    assert [tenant for tenant, _ in order] == ["big", "small", "big", "small", "big", "big", "big", "big"]
+    # Calls of one tenant keep their order
+    assert [i for tenant, i in order if tenant == "big"] == [0, 1, 2, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_weights_set_each_tenants_share():
+    controller = make_controller("test_admission_weights", max_concurrency=1, max_queue=20)
+    order = []
+    await queue_calls(controller, [("light", 1)] * 4 + [("heavy", 3)] * 8, order)
+
+    first_eight = [tenant for tenant, _ in order][:8]
+    assert (first_eight.count("heavy"), first_eight.count("light")) == (6, 2)
+
+
+@pytest.mark.asyncio
+async def test_one_tenant_cannot_fill_the_queue():
+    controller = AdmissionController("test_admission_tenant_cap", max_concurrency=1, max_queue=10,
+                                     queue_timeout=1.0, retry_after=7, max_queue_per_tenant=2)
+    await controller.acquire()
+    waiters = [asyncio.ensure_future(controller.acquire("big")) for _ in range(2)]
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(HTTPException) as error:
+        await controller.acquire("big")
+    assert error.value.status_code == 429
+    small = asyncio.ensure_future(controller.acquire("small"))
+    await asyncio.sleep(0.01)
+    assert metrics.registry['test_admission_tenant_cap_queue_depth{company="big"}'].value == 2
+    assert metrics.registry['test_admission_tenant_cap_queue_depth{company="small"}'].value == 1
+
+    for _ in range(3):
+        controller.release()
+    await asyncio.gather(*waiters, small)
+    assert metrics.registry['test_admission_tenant_cap_queue_depth{company="big"}'].value == 0
+    assert metrics.registry['test_admission_tenant_cap_wait_seconds{company="small"}'].count == 1
+
+
+@pytest.mark.asyncio
+async def test_text_answers_are_queued_per_company(http_session, spatial_ai_db, monkeypatch):
+    company_id = ObjectId()
+    await spatial_ai_db["ai_setting"].insert_one({
+        "companyId": str(company_id), "chatEnabled": True, "creative": False, "unknown": False,
+        "schedulerWeight": 4,
+    })
+    controller = make_controller("test_admission_company")
+    acquired = []
+    acquire = controller.acquire
+
+    async def recording_acquire(tenant=None, weight=1.0):
+        acquired.append((tenant, weight))
+        await acquire(tenant, weight)
+
+    monkeypatch.setattr(controller, "acquire", recording_acquire)
+    monkeypatch.setattr("app.services.ai_service.ai_admission", controller)
+    async with AIStubServer() as stub:
+        monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+        await process_ai_response_text(UserMessageText(
+            companyId=str(company_id), userId=str(ObjectId()), lang="EN", question="Hi?"
+        ), http_session)
+
+    assert acquired == [(str(company_id), 4.0)]
+
+
+def test_settings_update_keeps_scheduler_weight_not_sent(test_client, spatial_ai_db):
+    company_id = str(ObjectId())
+    spatial_ai_db["ai_setting"].collection.insert_one({
+        "companyId": company_id, "chatEnabled": True, "creative": False, "unknown": False, "schedulerWeight": 4.0,
+    })
+
+    response = test_client.post(f"/api/v2/aiSettings/{company_id}", json={
+        "companyId": company_id, "chatEnabled": True, "creative": True, "unknown": False,
+    })
+
+    assert response.status_code == 200
+    assert spatial_ai_db["ai_setting"].collection.find_one({"companyId": company_id})["schedulerWeight"] == 4.0
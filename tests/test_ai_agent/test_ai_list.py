@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.models.dashboard import TableData
+
+
+def insert_changes(spatial_ai_db, company_id, count):
+    for i in range(count):
+        change = TableData(companyId=company_id, title=f"change {i}", date=datetime(2024, 10, 1 + i // 2, 9),
+                           status="done" if i % 3 else "pending", statusClass="ok", progress=i)
+        spatial_ai_db["changes"].collection.insert_one(change.model_dump(by_alias=True))
+
+
+def test_ai_list_pages_newest_first(test_client: TestClient, spatial_ai_db):
+    company_id = "company"
+    insert_changes(spatial_ai_db, company_id, 7)
+    insert_changes(spatial_ai_db, "other", 2)
+
+    pages, cursor = [], None
+    while True:
+        response = test_client.get(f"/api/v2/getAiList/{company_id}",
+                                   params={"limit": 3, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    rows = [row for page in pages for row in page]
+    assert sorted(row["progress"] for row in rows) == list(range(7))
+    assert [row["date"] for row in rows] == sorted((row["date"] for row in rows), reverse=True)
+    # Same body the TableData response model gave
+    assert rows[0] == TableData(**rows[0]).model_dump(mode="json", by_alias=True)
+
+
+def test_ai_list_status_filter_and_page_cap(test_client: TestClient, spatial_ai_db, monkeypatch):
+    monkeypatch.setattr(settings, "AI_LIST_MAX_PAGE_SIZE", 4)
+    insert_changes(spatial_ai_db, "company", 9)
+
+    response = test_client.get("/api/v2/getAiList/company", params={"status": "pending"})
+    assert sorted(row["progress"] for row in response.json()) == [0, 3, 6]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = test_client.get("/api/v2/getAiList/company", params={"limit": 100})
+    assert len(response.json()) == 4
+    assert test_client.get("/api/v2/getAiList/company", params={"cursor": "bad"}).status_code == 400
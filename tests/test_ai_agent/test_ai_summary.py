@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.utils.pagination import decode_cursor, encode_cursor, keyset_filter
+
+
+def insert_messages(spatial_ai_db, company_id, count, process_time=1.5, day=1):
+    for i in range(count):
+        spatial_ai_db["UserMessage"].collection.insert_one({
+            "_id": str(ObjectId()), "companyId": company_id, "userId": str(ObjectId()), "lang": "EN",
+            # Pairs of messages share a time, so pages break ties on _id
+            "time": datetime(2024, 10, day, 12, i // 2).isoformat(),
+            "messages": {"question": f"q{day}-{i}", "answer": "a", "process_time": process_time},
+        })
+
+
+def test_cursor_round_trip_keeps_types():
+    values = {"time": "2024-10-01T12:00:00", "_id": ObjectId()}
+    assert decode_cursor(encode_cursor(values)) == values
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+    with pytest.raises(ValueError):
+        keyset_filter([("time", -1), ("_id", -1)], {"time": "x"})
+
+
+def test_keyset_filter():
+    assert keyset_filter([("time", -1), ("_id", 1)], {"time": "t", "_id": "i"}) == {"$or": [
+        {"time": {"$lt": "t"}},
+        {"time": "t", "_id": {"$gt": "i"}},
+    ]}
+
+
+def test_ai_summary_totals_cover_every_page(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    insert_messages(spatial_ai_db, company_id, 7)
+    # Another company's messages are not counted
+    insert_messages(spatial_ai_db, str(ObjectId()), 3)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = test_client.get(f"/api/v2/ai_summary/{company_id}", params=params)
+        assert response.status_code == 200
+        summary = response.json()
+        assert (summary["total_questions"], summary["total_time"]) == (7, "0:00:10.500000")
+        assert len(summary["details"]) <= 3
+        seen += summary["details"]
+        cursor = summary["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 7
+    assert len({detail["question"] for detail in seen}) == 7
+    times = [detail["time"] for detail in seen]
+    assert times == sorted(times, reverse=True)
+
+
+def test_ai_summary_date_range(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    for day in (1, 2, 3):
+        insert_messages(spatial_ai_db, company_id, 2, day=day)
+
+    response = test_client.get(f"/api/v2/ai_summary/{company_id}",
+                               params={"start": "2024-10-02T00:00:00", "end": "2024-10-03T00:00:00"})
+
+    assert response.status_code == 200
+    assert sorted(detail["question"] for detail in response.json()["details"]) == ["q2-0", "q2-1"]
+    assert test_client.get(f"/api/v2/ai_summary/{company_id}",
+                           params={"start": "2025-01-01T00:00:00"}).status_code == 404
+
+
+def test_ai_summary_matches_object_id_company_and_rejects_bad_cursor(test_client: TestClient, spatial_ai_db):
+    company_id = ObjectId()
+    spatial_ai_db["UserMessage"].collection.insert_one({
+        "_id": ObjectId(), "companyId": company_id, "userId": ObjectId(), "lang": "EN",
+        "time": datetime(2024, 1, 1).isoformat(), "messages": {"question": "old", "answer": "a"},
+    })
+
+    summary = test_client.get(f"/api/v2/ai_summary/{company_id}").json()
+    assert (summary["total_questions"], summary["total_time"], summary["next_cursor"]) == (1, "0:00:00", None)
+    response = test_client.get(f"/api/v2/ai_summary/{company_id}", params={"cursor": "garbage"})
+    assert response.status_code == 400
+
+
+def test_ai_summary_aggregates_only_the_totals(test_client: TestClient, spatial_ai_db, monkeypatch):
+    company_id = str(ObjectId())
+    insert_messages(spatial_ai_db, company_id, 5)
+    collection, pipelines = spatial_ai_db["UserMessage"], []
+    aggregate = collection.aggregate
+
+    def recording_aggregate(pipeline, **kwargs):
+        pipelines.append(pipeline)
+        return aggregate(pipeline, **kwargs)
+
+    monkeypatch.setattr(collection, "aggregate", recording_aggregate)
+    summary = test_client.get(f"/api/v2/ai_summary/{company_id}", params={"limit": 2}).json()
+
+    assert (summary["total_questions"], len(summary["details"])) == (5, 2)
+    # The details page and the stage sample are read with indexed finds
+    assert [[next(iter(stage)) for stage in pipeline] for pipeline in pipelines] == [["$match", "$group"]]
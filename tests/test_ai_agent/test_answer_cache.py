@@ -0,0 +1,115 @@
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.services.ai_service import process_ai_response_text, normalize_question, invalidate_answer_cache
+from app.api.v2.endpoints.ai_agent import UserMessageText
+from tests.AIStubServer import AIStubServer
+
+
+@pytest.fixture
+async def stub(monkeypatch):
+    async with AIStubServer() as stub:
+        monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+        yield stub
+
+
+async def enable_answer_cache(db, company_id, enabled=True):
+    await db["ai_setting"].insert_one({
+        "companyId": str(company_id), "chatEnabled": True, "creative": False, "unknown": False,
+        "answerCache": enabled, "answerCacheTtl": 600,
+    })
+
+
+def ask(company_id, question, lang="EN"):
+    return UserMessageText(companyId=str(company_id), userId=str(ObjectId()), lang=lang, question=question)
+
+
+def test_normalize_question():
+    assert normalize_question("  What are your OPENING hours?! ") == "what are your opening hours"
+    assert normalize_question("Qual è il prezzo?") == normalize_question("qual È  il prezzo")
+
+
+@pytest.mark.asyncio
+async def test_repeated_question_is_served_from_cache(http_session, spatial_ai_db, stub):
+    company_id = ObjectId()
+    await enable_answer_cache(spatial_ai_db, company_id)
+
+    first = await process_ai_response_text(ask(company_id, "Opening hours?"), http_session)
+    second = await process_ai_response_text(ask(company_id, "opening hours"), http_session)
+
+    assert len(stub.requests) == 1
+    assert stub.requests[0]["user_messages"] == []
+    assert first.cached is False
+    assert second.cached is True
+    assert second.answer == first.answer
+    assert second.question == "opening hours"
+    assert second.process_time < first.process_time
+
+    stored = await spatial_ai_db["UserMessage"].find({}).sort("time", 1).to_list(length=None)
+    assert [m["messages"]["cached"] for m in stored] == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_cache_is_per_language_and_opt_in(http_session, spatial_ai_db, stub):
+    cached_company, other_company = ObjectId(), ObjectId()
+    await enable_answer_cache(spatial_ai_db, cached_company)
+    await enable_answer_cache(spatial_ai_db, other_company, enabled=False)
+
+    await process_ai_response_text(ask(cached_company, "Pricing?"), http_session)
+    await process_ai_response_text(ask(cached_company, "Pricing?", lang="IT"), http_session)
+    await process_ai_response_text(ask(other_company, "Pricing?"), http_session)
+    await process_ai_response_text(ask(other_company, "Pricing?"), http_session)
+
+    assert len(stub.requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_invalidation_drops_company_answers(http_session, spatial_ai_db, stub):
+    company_id = ObjectId()
+    await enable_answer_cache(spatial_ai_db, company_id)
+
+    await process_ai_response_text(ask(company_id, "Pricing?"), http_session)
+    invalidate_answer_cache(company_id)
+    answer = await process_ai_response_text(ask(company_id, "Pricing?"), http_session)
+
+    assert len(stub.requests) == 2
+    assert answer.cached is False
+
+
+def test_settings_update_invalidates_answer_cache(test_client: TestClient, spatial_ai_db, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr("app.api.v2.endpoints.dashboard.invalidate_answer_cache", invalidated.append)
+    company_id = str(ObjectId())
+    spatial_ai_db["ai_setting"].collection.insert_one({
+        "companyId": company_id, "chatEnabled": True, "creative": False, "unknown": False,
+    })
+
+    response = test_client.post(f"/api/v2/aiSettings/{company_id}", json={
+        "companyId": company_id, "chatEnabled": True, "creative": False, "unknown": False,
+        "answerCache": True, "answerCacheTtl": 60,
+    })
+
+    assert response.status_code == 200
+    assert invalidated == [company_id]
+    assert spatial_ai_db["ai_setting"].collection.find_one({"companyId": company_id})["answerCache"] is True
+
+
+def test_settings_update_keeps_answer_cache_fields_not_sent(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    spatial_ai_db["ai_setting"].collection.insert_one({
+        "companyId": company_id, "chatEnabled": True, "creative": False, "unknown": False,
+        "answerCache": True, "answerCacheTtl": 600,
+    })
+
+    # A client that predates the answer cache
+    response = test_client.post(f"/api/v2/aiSettings/{company_id}", json={
+        "companyId": company_id, "chatEnabled": False, "creative": False, "unknown": False,
+    })
+
+    assert response.status_code == 200
+    stored = spatial_ai_db["ai_setting"].collection.find_one({"companyId": company_id})
+    assert (stored["chatEnabled"], stored["answerCache"], stored["answerCacheTtl"]) == (False, True, 600)
+    assert test_client.post(f"/api/v2/aiSettings/{company_id}", json={
+        "companyId": company_id, "chatEnabled": True, "creative": False, "unknown": False, "answerCacheTtl": 0,
+    }).status_code == 422
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from app.models.user_messages import AIResponse
+from app.services import answer_postprocessing
+from app.services.ai_service import process_ai_response_links
+from app.services.answer_postprocessing import LanguageRules, get_rules, load_rules, register_step
+
+ANSWER = " 1. See (https://example.com/a) and [www.example.com/b]\n2.1 Version 3.2.1. is out\n3.Price 10.5 EUR\n12abc 4.\n"
+
+
+@pytest.fixture
+def rules_directory(tmp_path):
+    yield tmp_path
+    load_rules()
+
+
+def write_rules(directory, lang, **table):
+    (directory / f"{lang}.json").write_text(json.dumps(table))
+
+
+@pytest.mark.parametrize("lang, voice", [
+    ("EN", "1. See  and \nnumber number 2 point 1. Version number 3 point 2 point 1.. is out\n"
+           "number 3.Price number 10 point 5. EUR\n12abc 4."),
+    ("IT", "1. See  and \nnumero numero 2 punto 1. Version numero 3 punto 2 punto 1.. is out\n"
+           "numero 3.Price numero 10 punto 5. EUR\n12abc 4."),
+])
+def test_links_voice_and_cleaning(lang, voice):
+    response = AIResponse(question="q", answer=ANSWER)
+    process_ai_response_links(response, lang)
+
+    assert response.links == ["https://example.com/a", "www.example.com/b"]
+    assert response.answer == "1. See  and \n2.1 Version 3.2.1. is out\n3.Price 10.5 EUR\n12abc 4."
+    assert response.voice == voice
+
+
+def test_text_continuing_a_line_keeps_its_leading_list_number():
+    rules = get_rules("EN")
+    assert rules.rewrite_voice("1. and 2.5", line_start=False) == "1. and number 2 point 5."
+    assert rules.rewrite_voice("1.2 ok", line_start=False) == "number 1 point 2. ok"
+    assert rules.rewrite_voice("1. and 2.5") == "number 1. and number 2 point 5."
+
+
+@pytest.mark.parametrize("lang, expected", [("IT", "IT"), ("it", "IT"), ("EN-US", "EN"), ("it_IT", "IT"),
+                                            ("FR", "EN"), (None, "EN")])
+def test_language_fallback(lang, expected):
+    assert get_rules(lang).lang == expected
+
+
+def test_new_language_is_a_rule_file(rules_directory):
+    write_rules(rules_directory, "EN", number_word="number", point_word="point")
+    write_rules(rules_directory, "DE", number_word="Nummer", point_word="Punkt",
+                voice_rewrites={"&": "und", "z.B.": "zum Beispiel"})
+    load_rules(rules_directory)
+
+    rules = get_rules("de-DE")
+    assert rules.rewrite_voice("1. Preise & Zeiten, z.B. 2.1") == "Nummer 1. Preise und Zeiten, zum Beispiel Nummer 2 Punkt 1."
+
+
+def test_rule_tables_are_validated():
+    with pytest.raises(ValueError):
+        LanguageRules("XX", number_word="n", point_word="p", voice_rewrites={"two words": "x"})
+    with pytest.raises(ValueError):
+        LanguageRules("XX", number_word="n", point_word="p", steps=["links", "missing"])
+
+
+def test_custom_steps_can_be_plugged_in(rules_directory, monkeypatch):
+    monkeypatch.setitem(answer_postprocessing.STEPS, "shout", None)
+
+    def shout(text, rules):
+        text.voice = text.voice.upper()
+
+    register_step("shout", shout)
+    write_rules(rules_directory, "EN", number_word="number", point_word="point",
+                steps=["links", "voice", "shout", "clean"])
+    load_rules(rules_directory)
+
+    assert get_rules("EN").process("1. hi (https://x.io) ").voice == "NUMBER 1. HI"
@@ -0,0 +1,71 @@
+import time
+from unittest.mock import patch
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.api.v2.endpoints.ai_agent import UserMessageTextBatch
+from app.core.config import settings
+from app.services.ai_service import process_ai_response_text_batch
+from tests.AIStubServer import AIStubServer
+
+
+def make_batch(questions, company_id=None, user_id=None):
+    return UserMessageTextBatch(companyId=str(company_id or ObjectId()), userId=str(user_id or ObjectId()),
+                                lang="EN", questions=questions)
+
+
+@pytest.mark.asyncio
+async def test_batch_fans_out_and_stores_turns_with_one_write(http_session, spatial_ai_db, monkeypatch):
+    monkeypatch.setattr(settings, "AI_BATCH_MAX_CONCURRENCY", 4)
+    company_id, user_id = ObjectId(), ObjectId()
+    collection = spatial_ai_db["UserMessage"].collection
+    collection.insert_one({"_id": str(ObjectId()), "companyId": str(company_id), "userId": str(user_id),
+                           "lang": "EN", "time": "2024-10-01T12:00:00",
+                           "messages": {"question": "earlier", "answer": "a", "process_time": 1.0}})
+
+    async with AIStubServer(delay=0.2) as stub:
+        monkeypatch.setattr(settings, "AI_SITE", stub.url)
+        with patch.object(collection, "insert_many", wraps=collection.insert_many) as insert_many:
+            start = time.perf_counter()
+            answers = await process_ai_response_text_batch(
+                make_batch([f"q{i}" for i in range(4)], company_id, user_id), http_session)
+            elapsed = time.perf_counter() - start
+
+    # Four sequential calls would take 0.8 seconds
+    assert elapsed < 0.6
+    assert [(r.index, r.status_code, r.answer.answer) for r in answers.results] == \
+        [(i, 200, f"Answer to: q{i}") for i in range(4)]
+    # Every question was sent with the same history, loaded once
+    assert [[m["messages"]["question"] for m in r["user_messages"]] for r in stub.requests] == [["earlier"]] * 4
+    insert_many.assert_called_once()
+    stored = list(collection.find({"messages.question": {"$ne": "earlier"}}))
+    assert sorted(d["messages"]["question"] for d in stored) == ["q0", "q1", "q2", "q3"]
+    assert all({"settings", "history", "upstream"} <= set(d["stageTimes"]) for d in stored)
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_failures_per_question(http_session, spatial_ai_db, monkeypatch):
+    monkeypatch.setattr(settings, "AI_BATCH_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "AI_HTTP_RETRIES", 0)
+    async with AIStubServer() as stub:
+        monkeypatch.setattr(settings, "AI_SITE", stub.url)
+        stub.fail_statuses = [500]
+        answers = await process_ai_response_text_batch(make_batch(["fails", "works"]), http_session)
+
+    failed, answered = answers.results
+    assert (failed.index, failed.status_code, failed.answer) == (0, 500, None)
+    assert failed.detail
+    assert (answered.index, answered.status_code, answered.answer.answer) == (1, 200, "Answer to: works")
+    stored = list(spatial_ai_db["UserMessage"].collection.find())
+    assert [d["messages"]["question"] for d in stored] == ["works"]
+
+
+def test_batch_endpoint_limits_questions(test_client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "AI_BATCH_MAX_QUESTIONS", 2)
+    body = {"companyId": str(ObjectId()), "userId": str(ObjectId()), "lang": "EN"}
+
+    assert test_client.post("/api/v2/textusermessage/batch", json={**body, "questions": []}).status_code == 422
+    response = test_client.post("/api/v2/textusermessage/batch", json={**body, "questions": ["a", "b", "c"]})
+    assert response.status_code == 400
@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.services.company_config_service import company_config_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_config_cache():
+    company_config_cache.clear()
+    yield
+    company_config_cache.clear()
+
+
+@pytest.mark.parametrize("path, update", [
+    ("aiSettings", {"chatEnabled": True, "creative": True, "unknown": False, "url": ""}),
+    ("ai_info", {"enterpriseName": "Acme", "website": "https://acme.test"}),
+    ("appearance", {"office": "option2", "character": "option3"}),
+])
+def test_post_is_visible_on_next_get(test_client: TestClient, spatial_ai_db, path, update):
+    company_id = str(ObjectId())
+    first = test_client.get(f"/api/v2/{path}/{company_id}")
+    assert first.status_code == 200
+
+    owner = {"company_id": company_id} if path == "appearance" else {"companyId": company_id}
+    assert test_client.post(f"/api/v2/{path}/{company_id}", json={**first.json(), **update, **owner}).status_code == 200
+
+    second = test_client.get(f"/api/v2/{path}/{company_id}", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert update.items() <= second.json().items()
+
+
+def test_repeated_gets_are_served_from_cache_and_revalidated(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    first = test_client.get(f"/api/v2/aiSettings/{company_id}")
+    assert first.headers["Cache-Control"] == "no-cache"
+    hits = company_config_cache.hits.value
+
+    collection = spatial_ai_db["ai_setting"].collection
+    with patch.object(collection, "find_one", wraps=collection.find_one) as find_one:
+        again = test_client.get(f"/api/v2/aiSettings/{company_id}")
+        not_modified = test_client.get(f"/api/v2/aiSettings/{company_id}",
+                                       headers={"If-None-Match": f'W/{first.headers["ETag"]}, "other"'})
+
+    find_one.assert_not_called()
+    assert again.content == first.content
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == first.headers["ETag"]
+    assert company_config_cache.hits.value == hits + 2
+    assert 0 < company_config_cache.hit_rate.value <= 1
@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.services.message_export import export_query, resume_point, stream_export
+
+
+def insert_messages(spatial_ai_db, company_id, user_ids, count):
+    documents = [{
+        "_id": str(ObjectId()), "companyId": company_id, "userId": user_ids[i % len(user_ids)], "lang": "EN",
+        # Pairs of messages share a time, so resuming relies on _id to break ties
+        "time": datetime(2024, 10, 1 + i // 10, 12, (i % 10) // 2).isoformat(),
+        "messages": {"question": f"q{i}", "answer": f'a, "quoted"\nline {i}',
+                     "links": ["https://example.com"], "process_time": 0.5},
+    } for i in range(count)]
+    spatial_ai_db["UserMessage"].collection.insert_many(documents)
+    return documents
+
+
+def test_ndjson_export_with_filters(test_client: TestClient, spatial_ai_db):
+    company_id, users = str(ObjectId()), [str(ObjectId()), str(ObjectId())]
+    insert_messages(spatial_ai_db, company_id, users, 30)
+    insert_messages(spatial_ai_db, str(ObjectId()), users, 5)
+
+    response = test_client.get(f"/api/v2/ai_export/{company_id}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(row["question"] for row in rows) == sorted(f"q{i}" for i in range(30))
+    assert [row["time"] for row in rows] == sorted(row["time"] for row in rows)
+    assert rows[0]["links"] == ["https://example.com"]
+
+    response = test_client.get(f"/api/v2/ai_export/{company_id}", params={
+        "user_id": users[0], "start": "2024-10-02T00:00:00", "end": "2024-10-03T00:00:00"})
+    assert sorted(json.loads(line)["question"] for line in response.text.splitlines()) == \
+        [f"q{i}" for i in range(10, 20, 2)]
+
+
+def test_csv_export_round_trips(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    documents = insert_messages(spatial_ai_db, company_id, [str(ObjectId())], 3)
+
+    response = test_client.get(f"/api/v2/ai_export/{company_id}", params={"format": "csv"})
+
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows] == [d["_id"] for d in sorted(documents, key=lambda d: (d["time"], d["_id"]))]
+    assert rows[0]["answer"] == documents[0]["messages"]["answer"]
+    assert rows[0]["links"] == "https://example.com"
+
+
+@pytest.mark.asyncio
+async def test_export_resumes_after_last_id_in_small_chunks(spatial_ai_db):
+    company_id = str(ObjectId())
+    insert_messages(spatial_ai_db, company_id, [str(ObjectId())], 25)
+    collection = spatial_ai_db["UserMessage"]
+
+    async def export(after=None):
+        last = await resume_point(collection, company_id, after) if after else None
+        query = export_query(company_id, last=last)
+        chunks = [chunk async for chunk in stream_export(collection, query, "ndjson", chunk_rows=4)]
+        return chunks, [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+
+    chunks, full = await export()
+    assert len(chunks) == 7
+    # Interrupted after row 9, which shares its time with row 8
+    _, resumed = await export(after=full[8]["id"])
+    assert full[9:] == resumed
+
+    with pytest.raises(ValueError):
+        await resume_point(collection, company_id, str(ObjectId()))
+
+
+def test_export_rejects_unknown_resume_id_and_format(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    assert test_client.get(f"/api/v2/ai_export/{company_id}", params={"after": "nope"}).status_code == 400
+    assert test_client.get(f"/api/v2/ai_export/{company_id}", params={"format": "xml"}).status_code == 422
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app.core.config import settings
+from app.models.user_messages import UserMessages, convert_DB_user_message_pydantic
+from app.services.ai_service import (get_user_messages_json, serialize_user_messages, convert_objectid_to_str,
+                                     project_history_fields)
+from tests.MockDataBase import MockMotorCollection
+
+
+def make_message(company_id, user_id, minutes_ago, index):
+    return {
+        "companyId": str(company_id),
+        "userId": str(user_id),
+        "lang": "EN",
+        "time": (datetime.now() - timedelta(minutes=minutes_ago)).isoformat(),
+        "messages": {
+            "question": f"question {index}",
+            "answer": f"answer {index}",
+            "links": ["https://example.com"],
+            "process_time": 1.5,
+            "voice_answer": f"answer {index}",
+        },
+    }
+
+
+@pytest.fixture
+def history():
+    company_id, user_id = ObjectId(), ObjectId()
+    collection = MockMotorCollection()
+    # Turn 0 is the oldest, one minute apart
+    collection.collection.insert_many([make_message(company_id, user_id, 50 - i, i) for i in range(50)])
+    # Another user of the same company must never leak into the history
+    collection.collection.insert_one(make_message(company_id, ObjectId(), 0, "other"))
+    return collection, company_id, user_id
+
+
+@pytest.mark.asyncio
+async def test_history_is_limited_to_last_turns_in_order(history, monkeypatch):
+    collection, company_id, user_id = history
+    monkeypatch.setattr(settings, "AI_HISTORY_MAX_TURNS", 5)
+    monkeypatch.setattr(settings, "AI_HISTORY_MAX_AGE_MINUTES", 0)
+
+    messages = await get_user_messages_json(collection, company_id, user_id)
+
+    assert [m["messages"]["question"] for m in messages] == [f"question {i}" for i in range(45, 50)]
+    assert all(m["userId"] == str(user_id) for m in messages)
+
+
+@pytest.mark.asyncio
+async def test_history_is_limited_by_age(history, monkeypatch):
+    collection, company_id, user_id = history
+    monkeypatch.setattr(settings, "AI_HISTORY_MAX_TURNS", 0)
+    monkeypatch.setattr(settings, "AI_HISTORY_MAX_AGE_MINUTES", 10)
+
+    messages = await get_user_messages_json(collection, company_id, user_id)
+
+    assert [m["messages"]["question"] for m in messages] == [f"question {i}" for i in range(41, 50)]
+
+
+@pytest.mark.asyncio
+async def test_history_only_carries_projected_fields(history, monkeypatch):
+    collection, company_id, user_id = history
+    monkeypatch.setattr(settings, "AI_HISTORY_MAX_TURNS", 1)
+
+    message = (await get_user_messages_json(collection, company_id, user_id))[0]
+
+    assert message["messages"]["answer"] == "answer 49"
+    assert message["messages"]["links"] is None
+    assert message["messages"]["process_time"] is None
+
+
+@pytest.mark.asyncio
+async def test_history_matches_ids_stored_as_object_ids(monkeypatch):
+    company_id, user_id = ObjectId(), ObjectId()
+    collection = MockMotorCollection()
+    legacy = make_message(company_id, user_id, 1, "legacy")
+    legacy.update(companyId=company_id, userId=user_id)
+    collection.collection.insert_one(legacy)
+
+    messages = await get_user_messages_json(collection, company_id, user_id)
+
+    assert [m["messages"]["question"] for m in messages] == ["question legacy"]
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+@pytest.mark.parametrize("document", [
+    {"_id": ObjectId(), "companyId": ObjectId(), "userId": ObjectId(), "time": datetime(2024, 10, 1, 12, 30),
+     "lang": "IT", "messages": {"question": "q", "answer": "a", "links": ["https://example.com"],
+                                 "process_time": 1.5, "voice_answer": "v", "cached": True},
+     "stageTimes": {"upstream": 1.2}},
+    {"_id": str(ObjectId()), "companyId": str(ObjectId()), "userId": str(ObjectId()),
+     "time": "2024-10-01T12:30:00.123456", "messages": {"question": "q", "answer": "a"}},
+    {"_id": str(ObjectId()), "companyId": str(ObjectId()), "userId": str(ObjectId()), "lang": None,
+     "time": "2024-10-01 12:30", "messages": {"question": "q", "answer": "a"}},
+])
+def test_serialization_matches_the_pydantic_models(document):
+    for stored in (document, project_history_fields(document)):
+        expected = [UserMessages(**message).model_dump(by_alias=True)
+                    for message in convert_DB_user_message_pydantic([dict(stored)])]
+        assert serialize_user_messages([stored]) == convert_objectid_to_str(expected)
@@ -0,0 +1,87 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.models.user_messages import UserMessages, AIResponse
+from app.services.ai_service import get_user_messages_json, insert_user_message_async, history_cache
+from app.utils.cache import LRUCache
+from tests.MockDataBase import MockMotorCollection
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = LRUCache("test_cache_bytes", max_bytes=100, ttl=60)
+    cache.set("a", "a", size=40)
+    cache.set("b", "b", size=40)
+    cache.get("a")  # "b" is now the least recently used entry
+    cache.set("c", "c", size=40)
+
+    assert cache.peek("a") == "a"
+    assert cache.peek("b") is None
+    assert cache.peek("c") == "c"
+    assert cache.evictions.value == 1
+    assert cache.bytes.value == 80
+
+
+def test_cache_rejects_values_larger_than_the_budget():
+    cache = LRUCache("test_cache_oversized", max_bytes=100, ttl=60)
+    cache.set("a", "a", size=101)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_cache_entries_expire():
+    cache = LRUCache("test_cache_ttl", max_bytes=100, ttl=60)
+    with patch("app.utils.cache.time.monotonic", return_value=1000):
+        cache.set("a", "a", size=1)
+    with patch("app.utils.cache.time.monotonic", return_value=1059):
+        assert cache.get("a") == "a"
+    with patch("app.utils.cache.time.monotonic", return_value=1061):
+        assert cache.get("a") is None
+
+    assert cache.hits.value == 1
+    assert cache.misses.value == 1
+
+
+def make_user_message(company_id, user_id, question):
+    return UserMessages(
+        time=str(datetime.now()),
+        AIResponses=AIResponse(question=question, answer=f"answer to {question}", process_time=0.5),
+        lang="EN",
+        companyId=str(company_id),
+        userId=str(user_id),
+    )
+
+
+@pytest.mark.asyncio
+async def test_insert_writes_through_to_cached_history(monkeypatch):
+    monkeypatch.setattr(settings, "AI_HISTORY_MAX_TURNS", 3)
+    company_id, user_id = ObjectId(), ObjectId()
+    collection = MockMotorCollection()
+    for i in range(3):
+        await insert_user_message_async(collection, make_user_message(company_id, user_id, f"q{i}"))
+
+    assert [m["messages"]["question"] for m in await get_user_messages_json(collection, company_id, user_id)] == \
+        ["q0", "q1", "q2"]
+    hits = history_cache.hits.value
+
+    await insert_user_message_async(collection, make_user_message(company_id, user_id, "q3"))
+    with patch.object(collection, "find", side_effect=AssertionError("history should come from the cache")):
+        cached = await get_user_messages_json(collection, company_id, user_id)
+
+    assert history_cache.hits.value == hits + 1
+    assert [m["messages"]["question"] for m in cached] == ["q1", "q2", "q3"]
+    history_cache.invalidate((str(company_id), str(user_id)))
+    assert await get_user_messages_json(collection, company_id, user_id) == cached
+
+
+def test_metrics_endpoint_exposes_cache_counters(test_client: TestClient):
+    response = test_client.get("/api/v2/metrics")
+
+    assert response.status_code == 200
+    assert {"history_cache_hits", "history_cache_misses", "history_cache_evictions",
+            "history_cache_bytes"} <= response.json().keys()
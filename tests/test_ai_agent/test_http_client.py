@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from app.core.config import settings
+from app.utils import http_client
+from app.utils.http_client import close_http_client, send_request
+from tests.AIStubServer import AIStubServer
+
+
+@pytest.mark.asyncio
+async def test_send_request_text(http_session):
+    async with AIStubServer() as stub:
+        payload = {"user_messages": [], "lang": "EN", "question": "Opening hours?"}
+        response = await send_request(http_session, f"{stub.url}/get_answer/", payload=payload)
+
+    assert response["answer"] == "Answer to: Opening hours?"
+    assert stub.requests == [payload]
+
+
+@pytest.mark.asyncio
+async def test_send_request_retries_gateway_errors(http_session):
+    async with AIStubServer() as stub:
+        stub.fail_statuses = [503, 502]
+        response = await send_request(http_session, f"{stub.url}/get_answer/", payload={"question": "hi"})
+
+    assert response["question"] == "hi"
+    assert len(stub.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_send_request_gives_up_after_retries(http_session):
+    async with AIStubServer() as stub:
+        stub.fail_statuses = [503] * (settings.AI_HTTP_RETRIES + 1)
+        with pytest.raises(aiohttp.ClientResponseError):
+            await send_request(http_session, f"{stub.url}/get_answer/", payload={"question": "hi"})
+
+    assert len(stub.requests) == settings.AI_HTTP_RETRIES + 1
+
+
+@pytest.mark.asyncio
+async def test_send_request_does_not_block_event_loop(http_session):
+    async with AIStubServer(delay=0.2) as stub:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            send_request(http_session, f"{stub.url}/get_answer/", payload={"question": str(i)})
+            for i in range(20)
+        ])
+        elapsed = time.perf_counter() - start
+
+    # 20 sequential calls would take 4 seconds
+    assert elapsed < 1.5
+
+
+@pytest.mark.asyncio
+async def test_close_http_client_resets_session(http_session):
+    await close_http_client()
+    assert http_client.http_session is None
+    assert http_session.closed
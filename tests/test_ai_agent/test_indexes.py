@@ -0,0 +1,67 @@
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+from app.core.config import settings
+from app.indexes import INDEXES, MAIN, SPATIAL_AI, audit_query_plans, ensure_indexes, plan_stages, query_shapes
+from tests.MockDataBase import MockMotorDatabase
+
+AUDIT_DB_NAME = "test_index_audit"
+
+
+def top_level_fields(query):
+    fields = set()
+    for key, value in query.items():
+        if key == "$and":
+            for clause in value:
+                fields |= top_level_fields(clause)
+        else:
+            fields.add(key)
+    return fields
+
+
+@pytest.mark.asyncio
+async def test_ensure_indexes_is_idempotent():
+    databases = {MAIN: MockMotorDatabase(), SPATIAL_AI: MockMotorDatabase()}
+    assert await ensure_indexes(databases) == []
+    assert await ensure_indexes(databases) == []
+
+    for spec in INDEXES:
+        index_information = databases[spec.database][spec.collection].collection.index_information()
+        assert index_information[spec.name]["key"] == spec.keys
+
+
+def test_every_query_shape_has_an_index_on_its_leading_field():
+    for shape in query_shapes():
+        fields = top_level_fields(shape.filter)
+        if "_id" in fields:
+            continue
+        leading = {spec.keys[0][0] for spec in INDEXES
+                   if (spec.database, spec.collection) == (shape.database, shape.collection)}
+        assert fields & leading, shape.name
+
+
+def test_plan_stages_walks_nested_plans():
+    plan = {"queryPlan": {"stage": "FETCH", "inputStage": {"stage": "SORT_MERGE", "inputStages": [
+        {"stage": "IXSCAN"}, {"stage": "IXSCAN"}]}}, "slotBasedPlan": {"stage": "ignored"}}
+    assert plan_stages(plan) == ["FETCH", "SORT_MERGE", "IXSCAN", "IXSCAN"]
+
+
+@pytest.fixture
+async def mongo_databases():
+    client = AsyncIOMotorClient(settings.MONGODB_URL, serverSelectionTimeoutMS=500)
+    try:
+        await client.server_info()
+    except PyMongoError:
+        client.close()
+        pytest.skip("needs a MongoDB server at MONGODB_URL")
+    database = client[AUDIT_DB_NAME]
+    yield {MAIN: database, SPATIAL_AI: database}
+    await client.drop_database(AUDIT_DB_NAME)
+    client.close()
+
+
+@pytest.mark.asyncio
+async def test_no_query_shape_scans_its_collection(mongo_databases):
+    assert await ensure_indexes(mongo_databases) == []
+    assert await audit_query_plans(mongo_databases) == []
@@ -0,0 +1,93 @@
+import asyncio
+import random
+from datetime import date, datetime, timedelta
+
+import bson
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.services.usage_rollups import PROCESS_TIME_ACCURACY, ROLLUP_COLLECTION, record_usage
+from app.utils.latency_sketch import PERCENTILES, LatencySketch
+from app.utils.stage_timer import percentiles
+
+# Estimates can sit right on the accuracy bound
+ACCURACY = PROCESS_TIME_ACCURACY + 1e-9
+
+
+def latencies(seed, count):
+    """Mostly a second or two, with a slow tail of timeouts and retries."""
+    rng = random.Random(seed)
+    return [rng.lognormvariate(0.3, 0.6) if rng.random() < 0.97 else rng.uniform(10, 120) for _ in range(count)]
+
+
+@pytest.mark.parametrize("values", [
+    latencies(1, 100000),
+    [random.Random(2).expovariate(5) for _ in range(20000)],
+    [0.0005, 0.002] * 500 + [300.0],
+])
+def test_percentiles_within_relative_accuracy(values):
+    sketch = LatencySketch(PROCESS_TIME_ACCURACY)
+    for value in values:
+        sketch.add(value)
+
+    exact = percentiles(values, PERCENTILES)
+    estimated = sketch.percentiles()
+    assert estimated.keys() == exact.keys() == {"p50", "p90", "p95", "p99"}
+    for name, value in exact.items():
+        # Durations under a millisecond are counted as one
+        assert estimated[name] == pytest.approx(max(value, sketch.min_value), rel=ACCURACY)
+
+
+def test_sketch_size_depends_on_spread_not_count():
+    sketch = LatencySketch(PROCESS_TIME_ACCURACY)
+    for value in latencies(3, 200000):
+        sketch.add(value)
+    assert sketch.count == 200000
+    # A millisecond to five minutes fits in 316 buckets whatever the count
+    assert len(sketch) < 316
+    assert len(bson.encode({"processTimeSketch": sketch.buckets})) < 4096
+
+
+def test_merged_sketches_match_one_sketch():
+    parts = [latencies(seed, 5000) for seed in range(4)]
+    whole, merged = LatencySketch(PROCESS_TIME_ACCURACY), LatencySketch(PROCESS_TIME_ACCURACY)
+    for part in parts:
+        sketch = LatencySketch(PROCESS_TIME_ACCURACY)
+        for value in part:
+            sketch.add(value)
+            whole.add(value)
+        merged.merge(sketch.buckets)
+
+    assert merged.buckets == whole.buckets
+    assert LatencySketch().percentiles() == {}
+
+
+def test_ai_latency_per_day_and_overall(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    by_day = {1: latencies(4, 300), 2: latencies(5, 200)}
+    # Rollups of two languages a day
+    messages = [
+        {"_id": str(ObjectId()), "companyId": company_id, "userId": "u", "lang": "EN" if i % 3 else "IT",
+         "time": datetime(2024, 10, day, 12).isoformat(), "messages": {"process_time": value}}
+        for day, values in by_day.items() for i, value in enumerate(values)
+    ]
+    # As if stored by several workers
+    for start in range(0, len(messages), 128):
+        asyncio.run(record_usage(spatial_ai_db[ROLLUP_COLLECTION], messages[start:start + 128]))
+
+    response = test_client.get(f"/api/v2/ai_latency/{company_id}", params={"start": "2024-10-01", "end": "2024-10-08"})
+    assert response.status_code == 200
+    latency = response.json()
+    assert [(day["day"], day["questions"]) for day in latency["days"]] == [("2024-10-01", 300), ("2024-10-02", 200)]
+    assert latency["overall"]["questions"] == 500
+    for result, values in [(latency["days"][0], by_day[1]), (latency["overall"], by_day[1] + by_day[2])]:
+        exact = percentiles(values, PERCENTILES)
+        assert result["percentiles"] == pytest.approx(exact, rel=ACCURACY)
+
+    # The last 30 days by default
+    recent = test_client.get(f"/api/v2/ai_latency/{company_id}").json()
+    assert (recent["overall"], recent["days"]) == ({"day": None, "questions": 0, "percentiles": {}}, [])
+    end = date.today() - timedelta(days=1)
+    assert test_client.get(f"/api/v2/ai_latency/{company_id}",
+                           params={"start": date.today().isoformat(), "end": end.isoformat()}).status_code == 400
@@ -0,0 +1,116 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.services.message_archive import ARCHIVE_COLLECTION, archive_messages, archived_messages
+
+
+def insert_messages(spatial_ai_db, company_id, user_ids, times):
+    documents = [{
+        "_id": str(ObjectId()), "companyId": company_id, "userId": user_ids[i % len(user_ids)], "lang": "EN",
+        "time": time.isoformat(),
+        "messages": {"question": f"q{i}", "answer": "a", "links": [], "process_time": 0.5},
+    } for i, time in enumerate(times)]
+    spatial_ai_db["UserMessage"].collection.insert_many(documents)
+    return documents
+
+
+def aged_tenant(spatial_ai_db, company_id, user_ids):
+    """Ten turns a day over three old days, and three recent turns."""
+    old = [datetime(2024, 10, 1 + i // 10, 12, (i % 10) // 2) for i in range(30)]
+    recent = [datetime.now() - timedelta(hours=i) for i in (3, 2, 1)]
+    return insert_messages(spatial_ai_db, company_id, user_ids, old + recent)
+
+
+@pytest.mark.asyncio
+async def test_archive_moves_old_turns_into_daily_buckets(spatial_ai_db):
+    company_id, users = str(ObjectId()), [str(ObjectId()), str(ObjectId())]
+    documents = aged_tenant(spatial_ai_db, company_id, users)
+
+    assert await archive_messages(spatial_ai_db, 30, batch_size=7) == 30
+    assert await archive_messages(spatial_ai_db, 30) == 0
+
+    assert spatial_ai_db["UserMessage"].collection.count_documents({}) == 3
+    buckets = list(spatial_ai_db[ARCHIVE_COLLECTION].collection.find({}))
+    # One bucket per user and day
+    assert len(buckets) == 6
+    assert sum(len(bucket["turns"]) for bucket in buckets) == 30
+    bucket = next(b for b in buckets if b["_id"] == f"{company_id}:{users[0]}:2024-10-01")
+    assert (bucket["start"], bucket["end"]) == ("2024-10-01T12:00:00", "2024-10-01T12:04:00")
+
+    archived = [document async for document in archived_messages(spatial_ai_db[ARCHIVE_COLLECTION], company_id)]
+    expected = sorted(documents[:30], key=lambda d: (d["time"], d["_id"]))
+    assert [document["_id"] for document in archived] == [d["_id"] for d in expected]
+    assert archived[0]["messages"]["question"] == expected[0]["messages"]["question"]
+
+
+@pytest.mark.asyncio
+async def test_archive_goes_company_by_company(spatial_ai_db):
+    first, second = str(ObjectId()), ObjectId()
+    aged_tenant(spatial_ai_db, first, [str(ObjectId())])
+    # Stored before ids were kept as strings
+    aged_tenant(spatial_ai_db, second, [ObjectId()])
+
+    assert await archive_messages(spatial_ai_db, 30, company_id=str(second)) == 30
+    assert spatial_ai_db["UserMessage"].collection.count_documents({"companyId": first}) == 33
+    assert await archive_messages(spatial_ai_db, 30, batch_size=4) == 30
+    assert spatial_ai_db["UserMessage"].collection.count_documents({}) == 6
+
+
+@pytest.mark.asyncio
+async def test_archive_interrupted_after_copy_does_not_duplicate(spatial_ai_db):
+    company_id = str(ObjectId())
+    aged_tenant(spatial_ai_db, company_id, [str(ObjectId())])
+    await archive_messages(spatial_ai_db, 30)
+    # As if the previous run had stopped between copying and deleting
+    archived = [document async for document in archived_messages(spatial_ai_db[ARCHIVE_COLLECTION], company_id)]
+    spatial_ai_db["UserMessage"].collection.insert_many(archived[:5])
+
+    assert await archive_messages(spatial_ai_db, 30) == 5
+    assert sum(len(bucket["turns"]) for bucket in spatial_ai_db[ARCHIVE_COLLECTION].collection.find({})) == 30
+
+
+def test_export_reads_archive_then_stored_turns(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    documents = aged_tenant(spatial_ai_db, company_id, [str(ObjectId())])
+    expected = [d["_id"] for d in sorted(documents, key=lambda d: (d["time"], d["_id"]))]
+    asyncio.run(archive_messages(spatial_ai_db, 30))
+
+    response = test_client.get(f"/api/v2/ai_export/{company_id}")
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == expected
+
+    # Resuming after an archived turn
+    response = test_client.get(f"/api/v2/ai_export/{company_id}", params={"after": expected[9]})
+    assert response.status_code == 200
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == expected[10:]
+
+    response = test_client.get(f"/api/v2/ai_export/{company_id}",
+                               params={"start": "2024-10-02T00:00:00", "end": "2024-10-03T00:00:00"})
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == expected[10:20]
+
+
+def test_ai_summary_spans_archive(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    documents = aged_tenant(spatial_ai_db, company_id, [str(ObjectId())])
+    asyncio.run(archive_messages(spatial_ai_db, 30))
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 4, **({"cursor": cursor} if cursor else {})}
+        summary = test_client.get(f"/api/v2/ai_summary/{company_id}", params=params).json()
+        assert (summary["total_questions"], summary["total_time"]) == (33, "0:00:16.500000")
+        seen += summary["details"]
+        cursor = summary["next_cursor"]
+        if cursor is None:
+            break
+
+    newest_first = sorted(documents, key=lambda d: (d["time"], d["_id"]), reverse=True)
+    assert [detail["question"] for detail in seen] == [d["messages"]["question"] for d in newest_first]
+
+    summary = test_client.get(f"/api/v2/ai_summary/{company_id}",
+                              params={"start": "2024-10-03T00:00:00", "end": "2024-10-04T00:00:00"}).json()
+    assert summary["total_questions"] == 10
@@ -0,0 +1,216 @@
+import asyncio
+import itertools
+
+import aiohttp
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.services.ai_service import call_ai_service, is_ai_service_failure, is_local_rejection
+from app.utils.admission import AdmissionController
+from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN
+from app.utils.hedging import Hedger
+from tests.AIStubServer import AIStubServer
+
+
+async def succeed():
+    return "ok"
+
+
+async def fail():
+    raise ConnectionError("backend down")
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_fails_fast_and_recovers():
+    breaker = CircuitBreaker("test_circuit", window=4, min_calls=4, error_rate=0.5, open_seconds=0.05)
+    for _ in range(2):
+        assert await breaker.call(succeed) == "ok"
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)
+    assert breaker.state == OPEN
+    assert breaker.opened.value == 1
+
+    calls = []
+    with pytest.raises(CircuitOpenError) as error:
+        await breaker.call(lambda: calls.append(1))
+    assert calls == []
+    assert 0 < error.value.retry_after <= 0.05
+    assert breaker.rejected.value == 1
+
+    await asyncio.sleep(0.06)
+    probe = asyncio.Event()
+
+    async def slow_probe():
+        await probe.wait()
+        return "ok"
+
+    probe_task = asyncio.ensure_future(breaker.call(slow_probe))
+    await asyncio.sleep(0)
+    assert breaker.state == HALF_OPEN
+    # Only one probe at a time while half-open
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(succeed)
+
+    probe.set()
+    assert await probe_task == "ok"
+    assert breaker.state == CLOSED
+    assert breaker.state_gauge.value == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker("test_circuit_probe", window=2, min_calls=2, open_seconds=0.02)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)
+    await asyncio.sleep(0.03)
+
+    with pytest.raises(ConnectionError):
+        await breaker.call(fail)
+    assert breaker.state == OPEN
+    assert breaker.opened.value == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_calls_open_the_circuit():
+    breaker = CircuitBreaker("test_circuit_slow", window=3, min_calls=3, slow_call_seconds=0.01, slow_rate=0.6)
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "late"
+
+    for fn in (slow, succeed, slow):
+        await breaker.call(fn)
+    assert breaker.state == OPEN
+
+
+@pytest.mark.asyncio
+async def test_ignored_errors_do_not_count():
+    breaker = CircuitBreaker("test_circuit_ignored", window=2, min_calls=2, is_failure=is_ai_service_failure)
+
+    async def shed():
+        raise HTTPException(status_code=429)
+
+    for _ in range(3):
+        with pytest.raises(HTTPException):
+            await breaker.call(shed)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_cancelled_or_shed_probe_does_not_decide_the_circuit():
+    breaker = CircuitBreaker("test_circuit_neutral_probe", window=2, min_calls=2, open_seconds=0.02,
+                             is_failure=is_ai_service_failure, is_neutral=is_local_rejection)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)
+    await asyncio.sleep(0.03)
+
+    # A client disconnect cancels the probe
+    probe_task = asyncio.ensure_future(breaker.call(asyncio.Event().wait))
+    await asyncio.sleep(0)
+    assert breaker.state == HALF_OPEN
+    probe_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe_task
+
+    async def shed():
+        raise HTTPException(status_code=429)
+
+    # Shed before reaching the backend: neither closes nor reopens the circuit
+    with pytest.raises(HTTPException):
+        await breaker.call(shed)
+    assert breaker.state == HALF_OPEN
+
+    assert await breaker.call(succeed) == "ok"
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_against_slow_tail():
+    hedger = Hedger("test_hedger", min_delay=0.01, min_samples=5)
+    delays = itertools.chain([0.001] * 5, [1.0], itertools.repeat(0.001))
+    cancelled = []
+
+    async def attempt():
+        try:
+            await asyncio.sleep(next(delays))
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "answer"
+
+    for _ in range(5):
+        await hedger.call(attempt)
+    assert hedger.fired.value == 0
+
+    start = asyncio.get_running_loop().time()
+    assert await hedger.call(attempt) == "answer"
+    assert asyncio.get_running_loop().time() - start < 0.5
+    assert (hedger.fired.value, hedger.won.value) == (1, 1)
+    await asyncio.sleep(0)
+    assert cancelled == [True]
+
+
+@pytest.mark.asyncio
+async def test_hedge_falls_back_to_the_other_attempt_on_error():
+    hedger = Hedger("test_hedger_error", min_delay=0.01, min_samples=1)
+    await hedger.call(succeed)
+    outcomes = iter([fail, succeed])
+
+    async def attempt():
+        fn = next(outcomes)
+        if fn is fail:
+            await asyncio.sleep(0.05)
+        return await fn()
+
+    assert await hedger.call(attempt) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_hedge_only_goes_out_in_a_spare_slot():
+    controller = AdmissionController("test_hedge_admission", max_concurrency=1, max_queue=4, queue_timeout=1.0,
+                                     retry_after=1)
+    hedger = Hedger("test_hedger_slots", min_delay=0.01, min_samples=1)
+    for _ in range(40):
+        await hedger.call(succeed)
+    calls = []
+
+    async def slow():
+        calls.append(True)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    # Every slot is taken: the slow call is not sent again
+    async with controller.slot():
+        assert await hedger.call(slow, reserve=controller.try_acquire, release=controller.release) == "ok"
+    assert (len(calls), hedger.fired.value, hedger.skipped.value) == (1, 0, 1)
+
+    controller.max_concurrency = 2
+    async with controller.slot():
+        assert await hedger.call(slow, reserve=controller.try_acquire, release=controller.release) == "ok"
+    assert (len(calls), hedger.fired.value) == (3, 1)
+    await asyncio.sleep(0.01)
+    assert controller.in_flight.value == 0
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_returns_503_without_calling_ai_site(http_session, monkeypatch):
+    breaker = CircuitBreaker("test_circuit_service", window=3, min_calls=3, open_seconds=30,
+                             is_failure=is_ai_service_failure)
+    monkeypatch.setattr("app.services.ai_service.ai_circuit_breaker", breaker)
+    monkeypatch.setattr("app.services.ai_service.settings.AI_HTTP_RETRIES", 0)
+    async with AIStubServer() as stub:
+        stub.fail_statuses = [503] * 3
+        url = f"{stub.url}/get_answer/"
+        for _ in range(3):
+            with pytest.raises(aiohttp.ClientResponseError):
+                await call_ai_service(http_session, url, payload={"question": str(ObjectId())})
+
+        with pytest.raises(HTTPException) as error:
+            await call_ai_service(http_session, url, payload={"question": "hi"})
+
+    assert error.value.status_code == 503
+    assert error.value.headers == {"Retry-After": "30"}
+    assert len(stub.requests) == 3
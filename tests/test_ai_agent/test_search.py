@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+from app.core.config import settings
+from app.indexes import INDEXES
+from app.services.message_search import search_messages, search_pipeline
+
+SEARCH_DB_NAME = "test_search"
+
+
+def test_search_pipeline_filters_then_pages_by_score():
+    company_id = ObjectId()
+    after = {"score": 1.5, "time": "2024-10-01T12:00:00", "_id": "id"}
+    pipeline = search_pipeline(company_id, "refund", datetime(2024, 10, 1), None, "EN", 10, after)
+
+    assert pipeline[0] == {"$match": {"$text": {"$search": "refund"}, "companyId": str(company_id),
+                                      "time": {"$gte": "2024-10-01T00:00:00"}, "lang": "EN"}}
+    assert pipeline[1] == {"$addFields": {"score": {"$meta": "textScore"}}}
+    assert pipeline[2]["$match"]["$or"][0] == {"score": {"$lt": 1.5}}
+    assert pipeline[3:5] == [{"$sort": {"score": -1, "time": -1, "_id": -1}}, {"$limit": 11}]
+
+
+def test_ai_search_rejects_bad_input(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    assert test_client.get(f"/api/v2/ai_search/{company_id}").status_code == 422
+    assert test_client.get(f"/api/v2/ai_search/{company_id}", params={"q": "  "}).status_code == 400
+    assert test_client.get(f"/api/v2/ai_search/{company_id}",
+                           params={"q": "x" * (settings.AI_SEARCH_MAX_LENGTH + 1)}).status_code == 400
+    assert test_client.get("/api/v2/ai_search/not-an-id", params={"q": "refund"}).status_code == 400
+    assert test_client.get(f"/api/v2/ai_search/{company_id}",
+                           params={"q": "refund", "cursor": "garbage"}).status_code == 400
+
+
+@pytest.fixture
+async def mongo_messages():
+    client = AsyncIOMotorClient(settings.MONGODB_URL, serverSelectionTimeoutMS=500)
+    try:
+        await client.server_info()
+    except PyMongoError:
+        client.close()
+        pytest.skip("needs a MongoDB server at MONGODB_URL")
+    collection = client[SEARCH_DB_NAME]["UserMessage"]
+    spec = next(spec for spec in INDEXES if spec.name == "companyId_text")
+    await collection.create_index(spec.keys, name=spec.name, **spec.options)
+    yield collection
+    await client.drop_database(SEARCH_DB_NAME)
+    client.close()
+
+
+@pytest.mark.asyncio
+async def test_search_ranks_and_pages_within_company(mongo_messages):
+    company_id = ObjectId()
+
+    def message(question, answer, day=1, lang="EN", company=company_id):
+        return {"_id": str(ObjectId()), "companyId": str(company), "userId": str(ObjectId()), "lang": lang,
+                "time": datetime(2024, 10, day).isoformat(), "messages": {"question": question, "answer": answer}}
+
+    await mongo_messages.insert_many(
+        [message("How do I get a refund?", "Refunds take a week.")]
+        + [message("Shipping times", f"Ask for a refund if late ({i}).", day=2 + i % 3) for i in range(7)]
+        + [message("Refund", "Refund", lang="FR"), message("Opening hours", "Nine to five.")]
+        + [message("Refund policy", "Refund refund", company=ObjectId())]
+    )
+
+    results, cursor = await search_messages(mongo_messages, company_id, "refund", lang="EN", limit=3)
+    assert results[0]["question"] == "How do I get a refund?"
+    seen = results
+    while cursor:
+        results, cursor = await search_messages(mongo_messages, company_id, "refund", lang="EN", limit=3,
+                                                cursor=cursor)
+        seen += results
+    assert len(seen) == len({result["id"] for result in seen}) == 8
+    scores = [result["score"] for result in seen]
+    assert scores == sorted(scores, reverse=True)
+
+    results, _ = await search_messages(mongo_messages, company_id, "refund", start=datetime(2024, 10, 3),
+                                       end=datetime(2024, 10, 4))
+    assert {result["time"] for result in results} == {"2024-10-03T00:00:00"}
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from app.api.v2.endpoints.ai_agent import UserMessageText
+from app.services.ai_service import process_ai_response_text, upstream_single_flight
+from app.utils.single_flight import SingleFlight
+from tests.AIStubServer import AIStubServer
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test_flight_share")
+    executions = []
+
+    async def fetch():
+        executions.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": 42}
+
+    results = await asyncio.gather(*[flight.do("key", fetch) for _ in range(10)])
+
+    assert results == [{"answer": 42}] * 10
+    assert len(executions) == 1
+    assert (flight.calls.value, flight.saved.value) == (1, 9)
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_exceptions_reach_every_caller():
+    flight = SingleFlight("test_flight_errors")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(*[flight.do("key", fail) for _ in range(3)], return_exceptions=True)
+
+    assert [str(result) for result in results] == ["upstream down"] * 3
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight("test_flight_cancel")
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    leader = asyncio.ensure_future(flight.do("key", fetch))
+    follower = asyncio.ensure_future(flight.do("key", fetch))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    assert await follower == "done"
+
+
+@pytest.mark.asyncio
+async def test_identical_cached_company_questions_share_upstream_call(http_session, spatial_ai_db, monkeypatch):
+    company_id = ObjectId()
+    await spatial_ai_db["ai_setting"].insert_one({
+        "companyId": str(company_id), "chatEnabled": True, "creative": False, "unknown": False,
+        "answerCache": True,
+    })
+    saved = upstream_single_flight.saved.value
+
+    async with AIStubServer(delay=0.2) as stub:
+        monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+        answers = await asyncio.gather(*[
+            process_ai_response_text(UserMessageText(
+                companyId=str(company_id), userId=str(ObjectId()), lang="EN", question="Opening hours?"
+            ), http_session)
+            for _ in range(20)
+        ])
+
+    assert len(stub.requests) == 1
+    assert upstream_single_flight.saved.value == saved + 19
+    assert {answer.answer for answer in answers} == {"Answer to: Opening hours?"}
+    stored = await spatial_ai_db["UserMessage"].find({"companyId": str(company_id)}).to_list(length=None)
+    assert len({message["userId"] for message in stored}) == 20
+
+
+@pytest.mark.asyncio
+async def test_coalesced_callers_keep_their_own_question(http_session, spatial_ai_db, monkeypatch):
+    company_id = ObjectId()
+    await spatial_ai_db["ai_setting"].insert_one({
+        "companyId": str(company_id), "chatEnabled": True, "creative": False, "unknown": False,
+        "answerCache": True,
+    })
+    questions = ["Opening hours?", "opening HOURS", "Opening hours!!"]
+
+    async with AIStubServer(delay=0.2) as stub:
+        monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+        answers = await asyncio.gather(*[
+            process_ai_response_text(UserMessageText(
+                companyId=str(company_id), userId=str(ObjectId()), lang="EN", question=question
+            ), http_session)
+            for question in questions
+        ])
+
+    assert len(stub.requests) == 1
+    assert [answer.question for answer in answers] == questions
+    stored = await spatial_ai_db["UserMessage"].find({"companyId": str(company_id)}).to_list(length=None)
+    assert sorted(message["messages"]["question"] for message in stored) == sorted(questions)
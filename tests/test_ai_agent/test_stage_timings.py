@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.core.metrics import Histogram
+from app.services.ai_service import process_ai_response_text
+from app.api.v2.endpoints.ai_agent import UserMessageText
+from app.utils.stage_timer import StageTimer, percentiles
+from tests.AIStubServer import AIStubServer
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_histogram", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value)
+
+    assert histogram.snapshot() == {"count": 4, "sum": 4.25, "buckets": {"0.1": 1, "1": 3, "+Inf": 4}}
+
+
+def test_stage_timer_accumulates_repeated_stages():
+    timer = StageTimer("test_stage")
+    for _ in range(2):
+        with timer.stage("work"):
+            pass
+    with pytest.raises(ValueError):
+        with timer.stage("failing"):
+            raise ValueError()
+    timer.observe()
+
+    assert set(timer.stages) == {"work", "failing"}
+    assert metrics.registry["test_stage_work_seconds"].count == 1
+    assert metrics.registry["test_stage_failing_seconds"].count == 1
+
+
+def test_percentiles():
+    assert percentiles(list(range(1, 101))) == {"p50": 51, "p90": 91, "p99": 100}
+    assert percentiles([]) == {}
+
+
+@pytest.mark.asyncio
+async def test_text_answer_records_stage_timings(http_session, spatial_ai_db, monkeypatch):
+    upstream = metrics.histogram("ai_stage_upstream_seconds")
+    observed = upstream.count
+    async with AIStubServer(delay=0.05) as stub:
+        monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+        await process_ai_response_text(UserMessageText(
+            companyId=str(ObjectId()), userId=str(ObjectId()), lang="EN", question="Hi?"
+        ), http_session)
+
+    stored = await spatial_ai_db["UserMessage"].find_one({})
+    assert set(stored["stageTimes"]) == {"settings", "history", "upstream", "convert", "postprocess"}
+    assert stored["stageTimes"]["upstream"] >= 0.05
+    assert stored["stageTimes"]["upstream"] <= stored["messages"]["process_time"]
+    assert upstream.count == observed + 1
+    assert metrics.registry["ai_stage_insert_seconds"].count > 0
+
+
+def test_ai_summary_reports_stage_percentiles(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    for i in range(10):
+        spatial_ai_db["UserMessage"].collection.insert_one({
+            "_id": str(ObjectId()), "companyId": company_id, "userId": str(ObjectId()), "lang": "EN",
+            "time": datetime(2024, 10, 1, 12, i).isoformat(),
+            "messages": {"question": f"q{i}", "answer": "a", "process_time": 1.0},
+            "stageTimes": {"history": 0.01 * (i + 1), "upstream": 0.5},
+        })
+    # Messages stored before stage timings were recorded
+    spatial_ai_db["UserMessage"].collection.insert_one({
+        "_id": str(ObjectId()), "companyId": company_id, "userId": str(ObjectId()), "lang": "EN",
+        "time": datetime(2024, 9, 1).isoformat(), "messages": {"question": "old", "answer": "a"},
+    })
+
+    response = test_client.get(f"/api/v2/ai_summary/{company_id}")
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["total_questions"] == 11
+    assert summary["stage_percentiles"] == {
+        "history": {"p50": 0.06, "p90": 0.1, "p99": 0.1},
+        "upstream": {"p50": 0.5, "p90": 0.5, "p99": 0.5},
+    }
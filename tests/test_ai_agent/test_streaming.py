@@ -0,0 +1,117 @@
+import json
+import random
+
+import pytest
+from bson import ObjectId
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.models.user_messages import AIResponse
+from app.services.ai_service import StreamingAnswerProcessor, process_ai_response_links
+from app.utils.circuit_breaker import OPEN, CircuitBreaker
+from app.utils.http_client import get_http_client
+from tests.AIStubServer import AIStubServer
+
+ANSWER = (
+    "  Here is what we offer:\n"
+    "1. Pricing (https://example.com/pricing) for teams\n"
+    "2. Support, see section 2.1.3 and [www.example.com/help]\n"
+    "3.Onboarding in 10.5 days\n"
+    "Ciao! "
+)
+
+
+def split_randomly(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 20)))
+    return [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("lang", ["EN", "IT"])
+def test_streaming_processor_matches_batch_processing(lang):
+    expected = AIResponse(question="q", answer=ANSWER)
+    process_ai_response_links(expected, lang)
+
+    rng = random.Random(lang)
+    for _ in range(200):
+        processor = StreamingAnswerProcessor(lang)
+        deltas = [processor.feed(chunk) for chunk in split_randomly(ANSWER, rng)] + [processor.close()]
+        deltas = [delta for delta in deltas if delta]
+
+        assert processor.answer == expected.answer
+        assert processor.voice == expected.voice
+        assert processor.links == expected.links
+        assert "".join(d["answer"] for d in deltas).rstrip() == expected.answer
+        assert "".join(d["voice"] for d in deltas).rstrip() == expected.voice
+
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_stream_endpoint_relays_chunks_and_persists_answer(http_session, spatial_ai_db, monkeypatch):
+    app.dependency_overrides[get_http_client] = get_http_client
+    try:
+        async with AIStubServer() as stub:
+            monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+            stub.stream_chunks = ["1. Visit (https://exa", "mple.com) today", "\n2. Call us"]
+            company_id, user_id = str(ObjectId()), str(ObjectId())
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                response = await client.post("/api/v2/textusermessage/stream", json={
+                    "companyId": company_id, "userId": user_id, "lang": "EN", "question": "How?"
+                })
+    finally:
+        app.dependency_overrides.pop(get_http_client)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [event for event, _ in events[:-1]] == ["delta"] * (len(events) - 1)
+    done_event, done = events[-1]
+    assert done_event == "done"
+    assert done["answer"] == "1. Visit  today\n2. Call us"
+    assert done["voice_answer"] == "number 1. Visit  today\nnumber 2. Call us"
+    assert done["links"] == ["https://example.com"]
+
+    stored = await spatial_ai_db["UserMessage"].find({}).to_list(length=None)
+    assert len(stored) == 1
+    assert stored[0]["companyId"] == company_id
+    assert stored[0]["messages"]["answer"] == done["answer"]
+
+
+@pytest.mark.asyncio
+async def test_stream_endpoint_rejects_invalid_ids():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/api/v2/textusermessage/stream", json={
+            "companyId": "not-an-id", "userId": str(ObjectId()), "lang": "EN", "question": "How?"
+        })
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_stream_goes_through_the_circuit_breaker(http_session, spatial_ai_db, monkeypatch):
+    breaker = CircuitBreaker("test_circuit_stream", window=2, min_calls=2, open_seconds=30)
+    monkeypatch.setattr("app.services.ai_service.ai_circuit_breaker", breaker)
+    app.dependency_overrides[get_http_client] = get_http_client
+    question = {"companyId": str(ObjectId()), "userId": str(ObjectId()), "lang": "EN", "question": "How?"}
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            # Nothing listens there
+            monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", "http://127.0.0.1:9")
+            for _ in range(2):
+                await client.post("/api/v2/textusermessage/stream", json=question)
+            assert breaker.state == OPEN
+
+            async with AIStubServer() as stub:
+                monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+                response = await client.post("/api/v2/textusermessage/stream", json=question)
+    finally:
+        app.dependency_overrides.pop(get_http_client)
+
+    assert stub.requests == []
+    assert (response.status_code, response.headers["Retry-After"]) == (503, "30")
@@ -0,0 +1,173 @@
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.api.v2.endpoints.ai_agent import UserMessageText
+from app.core.config import settings
+from app.models.user_messages import AIResponse, UserMessages
+from app.services.ai_service import insert_user_message_async, process_ai_response_text, user_message_writer
+from app.services.top_questions import TOP_QUESTIONS_COLLECTION, QuestionTracker, question_tracker
+from app.utils.space_saving import SpaceSaving
+from tests.AIStubServer import AIStubServer
+from tests.MockDataBase import MockMotorCollection
+
+
+def skewed_stream(seed, length, items=500):
+    rng = random.Random(seed)
+    return rng.choices([f"q{i}" for i in range(items)], [1 / (rank + 1) ** 1.2 for rank in range(items)], k=length)
+
+
+def assert_bounds(sketch, stream):
+    true_counts = Counter(stream)
+    assert sketch.total == len(stream)
+    for item, count, error in sketch.top(sketch.capacity):
+        assert count - error <= true_counts[item] <= count
+    # Every item seen more than total / capacity times is tracked
+    assert {item for item, count in true_counts.items() if count > len(stream) / sketch.capacity} <= set(sketch.counts)
+
+
+def test_space_saving_is_exact_under_capacity():
+    sketch = SpaceSaving(10)
+    for item in "abcabca":
+        sketch.add(item)
+    assert sketch.top(2) == [("a", 3, 0), ("b", 2, 0)]
+    assert sketch.floor() == 0
+
+
+def test_space_saving_bounds_on_skewed_stream():
+    stream = skewed_stream(1, 20000)
+    sketch = SpaceSaving(50)
+    for item in stream:
+        sketch.add(item)
+
+    assert len(sketch) == 50
+    assert_bounds(sketch, stream)
+    assert [item for item, _, _ in sketch.top(3)] == ["q0", "q1", "q2"]
+    assert sketch.min_count == min(sketch.counts.values())
+
+
+def test_merged_sketches_keep_bounds():
+    first, second = skewed_stream(2, 10000), skewed_stream(3, 5000)
+    sketches = [SpaceSaving(50), SpaceSaving(50)]
+    for sketch, stream in zip(sketches, (first, second)):
+        for item in stream:
+            sketch.add(item)
+
+    merged = SpaceSaving.merged(*sketches)
+    assert len(merged) == 50
+    assert_bounds(merged, first + second)
+    # A merged sketch keeps counting
+    merged.add("q0")
+    assert merged.top(1)[0][:2] == ("q0", sketches[0].counts["q0"] + sketches[1].counts["q0"] + 1)
+
+
+def test_questions_are_counted_as_the_answer_cache_keys_them():
+    tracker = QuestionTracker(capacity=10, checkpoint_interval=60)
+    for question in ("  How do I   RESET my password?? ", "how do I reset my password", "opening, hours",
+                     "Opening hours!", "?"):
+        tracker.add("company", question)
+    assert tracker._pending["company"].top(3) == [("how do i reset my password", 2, 0), ("opening hours", 2, 0)]
+
+
+@pytest.mark.asyncio
+async def test_checkpoints_from_workers_add_up(spatial_ai_db):
+    collection = spatial_ai_db[TOP_QUESTIONS_COLLECTION]
+    company_id = str(ObjectId())
+    workers = [QuestionTracker(capacity=20, checkpoint_interval=60) for _ in range(2)]
+    for worker, questions in zip(workers, (["Refund?"] * 3 + ["Hours"], ["refund", "Shipping"])):
+        for question in questions:
+            worker.add(company_id, question)
+
+    for worker in workers:
+        await worker.checkpoint(collection)
+    workers[0].add(company_id, "Shipping")
+
+    stored = collection.collection.find_one({"_id": company_id})
+    assert (stored["version"], stored["total"]) == (2, 6)
+    sketch = await workers[0].sketch(collection, company_id)
+    assert sketch.total == 7
+    assert sketch.top(2) == [("refund", 4, 0), ("shipping", 2, 0)]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_checkpoint_keeps_unsaved_counts(spatial_ai_db, monkeypatch):
+    collection = spatial_ai_db[TOP_QUESTIONS_COLLECTION]
+    tracker = QuestionTracker(capacity=20, checkpoint_interval=60)
+    companies = [str(ObjectId()) for _ in range(3)]
+    for company_id in companies:
+        tracker.add(company_id, "Refund?")
+
+    saving = asyncio.Event()
+    find_one = collection.find_one
+
+    async def slow_find_one(query):
+        if query["_id"] == companies[1]:
+            saving.set()
+            await asyncio.Event().wait()
+        return await find_one(query)
+
+    monkeypatch.setattr(collection, "find_one", slow_find_one, raising=False)
+    task = asyncio.ensure_future(tracker.checkpoint(collection))
+    await saving.wait()
+    tracker.add(companies[1], "Hours")
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    monkeypatch.setattr(collection, "find_one", find_one, raising=False)
+    assert set(tracker._pending) == set(companies[1:])
+    await tracker.checkpoint(collection)
+    assert [collection.collection.find_one({"_id": company_id})["total"] for company_id in companies] == [1, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_stored_questions_are_counted(http_session, spatial_ai_db, monkeypatch):
+    company_id = str(ObjectId())
+    async with AIStubServer() as stub:
+        monkeypatch.setattr(settings, "AI_SITE", stub.url)
+        for question in ("Opening hours?", "opening  hours", "Refund?"):
+            await process_ai_response_text(UserMessageText(
+                companyId=company_id, userId=str(ObjectId()), lang="EN", question=question
+            ), http_session)
+
+    sketch = await question_tracker.sketch(spatial_ai_db[TOP_QUESTIONS_COLLECTION], company_id)
+    assert sketch.top(1) == [("opening hours", 2, 0)]
+
+
+@pytest.mark.asyncio
+async def test_questions_are_counted_once_written(spatial_ai_db, monkeypatch):
+    monkeypatch.setattr(settings, "AI_MESSAGE_WRITE_BEHIND", True)
+    company_id, collection = ObjectId(), MockMotorCollection()
+    user_messages = [
+        UserMessages(time="2024-10-01T12:00:00", lang="EN", companyId=str(company_id), userId=str(ObjectId()),
+                     AIResponses=AIResponse(question=question, answer="a", process_time=0.5))
+        for question in ("Refund?", "Hours?")
+    ]
+    collection.collection.insert_one({"_id": str(user_messages[0].id)})
+    for user_message in user_messages:
+        await insert_user_message_async(collection, user_message)
+
+    tracked = spatial_ai_db[TOP_QUESTIONS_COLLECTION]
+    assert (await question_tracker.sketch(tracked, company_id)).total == 0
+    await user_message_writer.close()
+    # The duplicate was not stored, so its question is not counted
+    assert (await question_tracker.sketch(tracked, company_id)).top(2) == [("hours", 1, 0)]
+
+
+def test_top_questions_endpoint(test_client: TestClient, spatial_ai_db):
+    company_id = str(ObjectId())
+    spatial_ai_db[TOP_QUESTIONS_COLLECTION].collection.insert_one({
+        "_id": company_id, "version": 1, "total": 9,
+        "items": [{"question": "refund", "count": 5, "error": 0}, {"question": "hours", "count": 4, "error": 1}],
+    })
+    for question in ("Hours?", "hours"):
+        question_tracker.add(company_id, question)
+
+    response = test_client.get(f"/api/v2/top_questions/{company_id}", params={"k": 1})
+    assert response.status_code == 200
+    assert response.json() == {"total": 11, "questions": [{"question": "hours", "count": 6, "error": 1}]}
+    assert test_client.get("/api/v2/top_questions/not-an-id").status_code == 400
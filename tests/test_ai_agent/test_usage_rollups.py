@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime
+
+import bson
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.api.v2.endpoints.ai_agent import UserMessageText
+from app.core.config import settings
+from app.services.ai_service import process_ai_response_text
+from app.services.usage_rollups import PROCESS_TIME_ACCURACY, ROLLUP_COLLECTION, USERS_PRECISION, Usage, \
+    rebuild_usage_rollups, record_usage
+from app.utils.hyperloglog import HyperLogLog
+from tests.AIStubServer import AIStubServer
+
+# Estimates can sit right on the accuracy bound
+ACCURACY = PROCESS_TIME_ACCURACY + 1e-9
+
+
+def make_message(company_id, user_id, day, process_time, lang="EN"):
+    return {
+        "_id": str(ObjectId()), "companyId": company_id, "userId": user_id, "lang": lang,
+        "time": datetime(2024, 10, day, 12).isoformat(),
+        "messages": {"question": "q", "answer": "a", "process_time": process_time},
+    }
+
+
+def rollups_of(spatial_ai_db):
+    return {d["_id"]: d for d in spatial_ai_db[ROLLUP_COLLECTION].collection.find()}
+
+
+def test_percentiles_from_sketch():
+    usage = Usage()
+    for process_time in [0.1] * 50 + [1.2] * 40 + [8] * 9 + [500]:
+        usage.add_message({"userId": "u", "messages": {"process_time": process_time}})
+
+    expected = {"p50": 1.2, "p90": 8, "p95": 8, "p99": 500}
+    assert usage.percentiles().keys() == expected.keys()
+    for name, value in usage.percentiles().items():
+        assert value == pytest.approx(expected[name], rel=ACCURACY)
+    assert Usage().percentiles() == {}
+
+
+def test_unique_users_estimate_is_bounded():
+    # Three standard errors
+    error = 3 * 1.04 / 2 ** (USERS_PRECISION / 2)
+    days = [Usage() for _ in range(3)]
+    for day, usage in enumerate(days):
+        for user in range(day * 20000, day * 20000 + 50000):
+            usage.add_message({"userId": f"user{user}"})
+    assert days[0].unique_users() == pytest.approx(50000, rel=error)
+    assert len(bson.encode({"usersSketch": days[0].users.registers})) < 16384
+
+    # Merging days counts users seen on several days once
+    total = Usage()
+    for usage in days:
+        total.add_rollup({"usersSketch": usage.users.registers})
+    assert total.unique_users() == pytest.approx(90000, rel=error)
+    assert len(total.users) <= 2 ** USERS_PRECISION
+
+
+@pytest.mark.asyncio
+async def test_stored_answers_update_rollups(http_session, spatial_ai_db, monkeypatch):
+    company_id, user_id = str(ObjectId()), str(ObjectId())
+    async with AIStubServer() as stub:
+        monkeypatch.setattr(settings, "AI_SITE", stub.url)
+        for user in (user_id, user_id, str(ObjectId())):
+            await process_ai_response_text(UserMessageText(
+                companyId=company_id, userId=user, lang="EN", question="Hi?"
+            ), http_session)
+
+    day = datetime.now().date().isoformat()
+    rollup = rollups_of(spatial_ai_db)[f"{company_id}:{day}:EN"]
+    assert (rollup["companyId"], rollup["day"], rollup["lang"]) == (company_id, day, "EN")
+    assert rollup["questions"] == 3
+    assert HyperLogLog(USERS_PRECISION, rollup["usersSketch"]).count() == 2
+    assert sum(rollup["processTimeSketch"].values()) == 3
+    assert rollup["processTime"] >= rollup["processTimeMax"] > 0
+
+
+@pytest.mark.asyncio
+async def test_rebuild_matches_incremental_rollups(spatial_ai_db):
+    company_id, user_id = ObjectId(), str(ObjectId())
+    messages = [
+        make_message(str(company_id), user_id, 1, 0.7),
+        make_message(str(company_id), user_id, 1, 2.5, lang="IT"),
+        make_message(str(company_id), str(ObjectId()), 2, 12),
+        # Stored before ids were kept as strings
+        {**make_message(company_id, ObjectId(user_id), 2, 0.2), "_id": ObjectId()},
+    ]
+    await record_usage(spatial_ai_db[ROLLUP_COLLECTION], messages)
+    incremental = rollups_of(spatial_ai_db)
+    spatial_ai_db["UserMessage"].collection.insert_many(messages)
+    spatial_ai_db["UserMessage"].collection.insert_one(make_message(str(ObjectId()), user_id, 1, 1))
+    # A stale rollup of the company is replaced
+    spatial_ai_db[ROLLUP_COLLECTION].collection.insert_one({"_id": "stale", "companyId": str(company_id)})
+
+    assert await rebuild_usage_rollups(spatial_ai_db, company_id, batch_size=2) == 3
+    rebuilt = rollups_of(spatial_ai_db)
+
+    assert set(rebuilt) == set(incremental)
+    for _id, rollup in incremental.items():
+        assert rollup == rebuilt[_id]
+    assert rebuilt[f"{company_id}:2024-10-02:EN"]["questions"] == 2
+
+
+def test_ai_summary_reads_rollups_for_whole_days(test_client: TestClient, spatial_ai_db, monkeypatch):
+    monkeypatch.setattr(settings, "AI_SUMMARY_USE_ROLLUPS", True)
+    company_id = str(ObjectId())
+    messages = [make_message(company_id, str(ObjectId()), day, 1.0) for day in (1, 1, 2, 3)]
+    spatial_ai_db["UserMessage"].collection.insert_many(messages)
+    # Only rollups know about this day: the totals come from them
+    users = HyperLogLog(USERS_PRECISION)
+    users.add("u")
+    spatial_ai_db[ROLLUP_COLLECTION].collection.insert_one({
+        "_id": f"{company_id}:2024-10-02:IT", "companyId": company_id, "day": "2024-10-02", "lang": "IT",
+        "questions": 5, "processTime": 5.0, "processTimeMax": 1.0, "processTimeSketch": {"0": 5},
+        "usersSketch": users.registers,
+    })
+    asyncio.run(record_usage(spatial_ai_db[ROLLUP_COLLECTION], messages))
+
+    collection = spatial_ai_db["UserMessage"]
+    aggregate = collection.aggregate
+
+    def no_aggregate(pipeline, **kwargs):
+        raise AssertionError(f"messages aggregated: {pipeline}")
+
+    # Only the rollups and a page of details are read, never every message of the range
+    monkeypatch.setattr(collection, "aggregate", no_aggregate)
+    summary = test_client.get(f"/api/v2/ai_summary/{company_id}",
+                              params={"start": "2024-10-01T00:00:00", "end": "2024-10-03T00:00:00"}).json()
+    assert (summary["total_questions"], summary["total_time"], summary["unique_users"]) == (8, "0:00:08", 4)
+    assert summary["process_time_percentiles"] == pytest.approx(
+        {"p50": 1.0, "p90": 1.0, "p95": 1.0, "p99": 1.0}, rel=ACCURACY)
+    assert len(summary["details"]) == 3
+
+    # Not a whole day: computed from the messages
+    monkeypatch.setattr(collection, "aggregate", aggregate)
+    summary = test_client.get(f"/api/v2/ai_summary/{company_id}", params={"start": "2024-10-01T06:00:00"}).json()
+    assert (summary["total_questions"], summary["unique_users"]) == (4, None)
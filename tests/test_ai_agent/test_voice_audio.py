@@ -0,0 +1,70 @@
+import asyncio
+import base64
+import os
+
+import pytest
+from bson import ObjectId
+
+from app.api.v2.endpoints.ai_agent import UserMessage
+from app.core.config import settings
+from app.services.ai_service import process_ai_response
+from app.utils.file_manger import decode_audio
+from tests.AIStubServer import AIStubServer
+
+
+def test_decode_audio_spools_large_clips_to_disk(monkeypatch):
+    monkeypatch.setattr(settings, "AUDIO_SPOOL_MAX_BYTES", 1024)
+    small, large = os.urandom(512), os.urandom(1024 * 1024 + 3)
+
+    with decode_audio(base64.b64encode(small).decode()) as buffer:
+        assert not buffer._rolled
+        assert buffer.read() == small
+    with decode_audio(base64.b64encode(large).decode()) as buffer:
+        assert buffer._rolled
+        assert buffer.read() == large
+
+
+def test_decode_audio_ignores_line_breaks():
+    audio = os.urandom(300 * 1024)
+    encoded = base64.encodebytes(audio).decode()  # wrapped every 76 characters
+
+    with decode_audio(encoded) as buffer:
+        assert buffer.read() == audio
+
+
+@pytest.mark.asyncio
+async def test_parallel_voice_requests_each_upload_their_own_audio(http_session, spatial_ai_db, monkeypatch):
+    # Spill every other clip to disk to cover both buffer kinds
+    monkeypatch.setattr(settings, "AUDIO_SPOOL_MAX_BYTES", 16)
+    clips = [f"clip-{i}".encode() * (1 + i % 2) * 4 for i in range(100)]
+
+    async with AIStubServer(delay=0.05) as stub:
+        monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+        answers = await asyncio.gather(*[
+            process_ai_response(UserMessage(
+                companyId=str(ObjectId()), userId=str(ObjectId()), lang="EN",
+                wavData=base64.b64encode(clip).decode(),
+            ), http_session)
+            for clip in clips
+        ])
+
+    assert sorted(request["audio"] for request in stub.requests) == sorted(clips)
+    # The stub echoes the audio it received as the question
+    assert [answer.question for answer in answers] == [clip.decode() for clip in clips]
+    assert not os.path.exists("output.wav")
+
+
+@pytest.mark.asyncio
+async def test_spooled_audio_is_resent_on_retry(http_session, spatial_ai_db, monkeypatch):
+    monkeypatch.setattr(settings, "AUDIO_SPOOL_MAX_BYTES", 16)
+    clip = os.urandom(256 * 1024)
+
+    async with AIStubServer() as stub:
+        monkeypatch.setattr("app.services.ai_service.settings.AI_SITE", stub.url)
+        stub.fail_statuses = [503]
+        await process_ai_response(UserMessage(
+            companyId=str(ObjectId()), userId=str(ObjectId()), lang="EN",
+            wavData=base64.b64encode(clip).decode(),
+        ), http_session)
+
+    assert [request["audio"] for request in stub.requests] == [clip, clip]
@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from bson import ObjectId
+
+from app.core.config import settings
+from app.models.user_messages import UserMessages, AIResponse
+from app.services.ai_service import get_user_messages_json, insert_user_message_async, user_message_writer
+from app.utils.write_behind import WriteBehindBuffer
+from tests.MockDataBase import MockMotorCollection
+
+
+def make_buffer(name, batch_size=100, flush_interval=60, max_pending=1000):
+    return WriteBehindBuffer(name, batch_size=batch_size, flush_interval=flush_interval, max_pending=max_pending)
+
+
+def make_user_message(company_id, user_id, question):
+    return UserMessages(
+        time=str(datetime.now()),
+        AIResponses=AIResponse(question=question, answer=f"answer to {question}", process_time=0.5),
+        lang="EN",
+        companyId=str(company_id),
+        userId=str(user_id),
+    )
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_written_with_one_insert_many():
+    buffer = make_buffer("test_write_behind_batch", batch_size=3)
+    collection = MockMotorCollection()
+    with patch.object(collection.collection, "insert_many", wraps=collection.collection.insert_many) as insert_many:
+        for i in range(3):
+            await buffer.add(collection, {"_id": str(ObjectId()), "i": i})
+        await asyncio.sleep(0)
+
+    insert_many.assert_called_once()
+    assert insert_many.call_args.kwargs == {"ordered": False}
+    assert collection.collection.count_documents({}) == 3
+    assert (buffer.written.value, buffer.batches.value, buffer.pending_gauge.value) == (3, 1, 0)
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_on_interval_and_close():
+    buffer = make_buffer("test_write_behind_interval", flush_interval=0.02)
+    collection = MockMotorCollection()
+    await buffer.add(collection, {"_id": "a"})
+    assert collection.collection.count_documents({}) == 0
+
+    await asyncio.sleep(0.05)
+    assert collection.collection.count_documents({}) == 1
+
+    await buffer.add(collection, {"_id": "b"})
+    await buffer.close()
+    assert collection.collection.count_documents({}) == 2
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_waits_for_a_flush():
+    buffer = make_buffer("test_write_behind_bounded", max_pending=2)
+    collection = MockMotorCollection()
+    for i in range(5):
+        await buffer.add(collection, {"_id": i})
+        assert len(buffer.pending(lambda document: True)) <= 2
+
+    assert collection.collection.count_documents({}) == 4
+    await buffer.close()
+    assert collection.collection.count_documents({}) == 5
+
+
+@pytest.mark.asyncio
+async def test_batches_being_written_count_toward_the_bound():
+    buffer = make_buffer("test_write_behind_in_flight", batch_size=2, max_pending=4)
+    collection = MockMotorCollection()
+    database_up = asyncio.Event()
+    held = []
+
+    async def slow_insert_many(documents, ordered):
+        await database_up.wait()
+        collection.collection.insert_many(documents, ordered=ordered)
+
+    collection.insert_many = slow_insert_many
+    adds = asyncio.ensure_future(asyncio.gather(*(buffer.add(collection, {"_id": i}) for i in range(10))))
+    for _ in range(5):
+        await asyncio.sleep(0)
+        held.append(len(buffer.pending(lambda document: True)))
+    assert not adds.done()
+    assert max(held) == 4
+
+    database_up.set()
+    await adds
+    await buffer.close()
+    assert collection.collection.count_documents({}) == 10
+
+
+@pytest.mark.asyncio
+async def test_failed_documents_are_counted_and_the_rest_written():
+    buffer = make_buffer("test_write_behind_errors")
+    collection = MockMotorCollection()
+    collection.collection.insert_one({"_id": "dup"})
+    for _id in ("a", "dup", "b"):
+        await buffer.add(collection, {"_id": _id})
+    await buffer.close()
+
+    assert sorted(d["_id"] for d in collection.collection.find()) == ["a", "b", "dup"]
+    assert (buffer.written.value, buffer.failed.value) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_callback_gets_only_the_stored_documents():
+    written = []
+
+    async def on_written(documents, context):
+        written.append((context, [document["_id"] for document in documents]))
+
+    buffer = WriteBehindBuffer("test_write_behind_callback", batch_size=100, flush_interval=60, max_pending=1000,
+                               on_written=on_written)
+    collection = MockMotorCollection()
+    collection.collection.insert_one({"_id": "dup"})
+    for _id, context in (("a", "x"), ("dup", "x"), ("b", "y"), ("c", "x")):
+        await buffer.add(collection, {"_id": _id}, context)
+    await buffer.close()
+
+    assert sorted(written) == [("x", ["a", "c"]), ("y", ["b"])]
+
+
+@pytest.mark.asyncio
+async def test_history_sees_turns_not_written_yet(monkeypatch):
+    monkeypatch.setattr(settings, "AI_MESSAGE_WRITE_BEHIND", True)
+    company_id, user_id = ObjectId(), ObjectId()
+    collection = MockMotorCollection()
+    await insert_user_message_async(collection, make_user_message(company_id, user_id, "q0"))
+    await user_message_writer.flush()
+    await insert_user_message_async(collection, make_user_message(company_id, user_id, "q1"))
+    await insert_user_message_async(collection, make_user_message(ObjectId(), user_id, "other company"))
+
+    assert collection.collection.count_documents({}) == 1
+    history = await get_user_messages_json(collection, company_id, user_id)
+    assert [m["messages"]["question"] for m in history] == ["q0", "q1"]
+
+    await user_message_writer.close()
+    assert collection.collection.count_documents({}) == 3
+
+
+@pytest.mark.asyncio
+async def test_rollups_are_updated_when_turns_are_written(monkeypatch):
+    monkeypatch.setattr(settings, "AI_MESSAGE_WRITE_BEHIND", True)
+    collection, rollups = MockMotorCollection(), MockMotorCollection()
+    for question in ("q0", "q1"):
+        await insert_user_message_async(collection, make_user_message(ObjectId(), ObjectId(), question), rollups)
+
+    # Acknowledged without waiting for MongoDB
+    assert rollups.collection.count_documents({}) == 0
+    await user_message_writer.close()
+    assert sum(rollup["questions"] for rollup in rollups.collection.find()) == 2